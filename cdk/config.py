@@ -16,6 +16,8 @@ CDK_ENV = {"account": ACCOUNT, "region": REGION}
 ###################################
 # S3
 S3_ATHENA_QUERY_FILE_NAME = "exec_athena_query.py"
+S3_PIPELINE_RUNNER_FILE_NAME = "pipeline_runner.py"
+S3_ATHENA_ADMISSION_FILE_NAME = "athena_admission.py"
 S3_LANDING_BUCKET = "apg-landing-{account}-{stage}".format(account=ACCOUNT, stage=DEPLOYMENT_STAGE)
 S3_PROCESSED_BUCKET = "apg-processed-{account}-{stage}".format(account=ACCOUNT, stage=DEPLOYMENT_STAGE)
 S3_AUDIT_BUCKET = "apg-audit-{account}-{stage}".format(account=ACCOUNT, stage=DEPLOYMENT_STAGE)
@@ -25,7 +27,11 @@ S3_GLUE_ASSETS_BUCKET = "apg-glue-assets-{account}-{stage}".format(account=ACCOU
 
 # s3 glue asset data validation json file prefix
 S3_GLUE_ASSETS_STAGE = "stage"
-S3_GLUE_ASSET_FILES = [S3_ATHENA_QUERY_FILE_NAME]
+S3_GLUE_ASSET_FILES = [
+    S3_ATHENA_QUERY_FILE_NAME,
+    S3_PIPELINE_RUNNER_FILE_NAME,
+    S3_ATHENA_ADMISSION_FILE_NAME,
+]
 
 # S3 Landing Incoming path
 
@@ -46,7 +52,73 @@ AUDIT_META = {"param_audit_db": AUDIT_DB_NAME, "param_audit_table": AUDIT_TABLE}
 WRANGLER_ASSET = "awswrangler-layer-3.2.0-py3.9.zip"
 WRANGLER_ASSET_VERSION = "3.2.0"
 AUDIT_CONFIG_GEN_LAMBDA_NAME = "audit-config-generator-lambda"
+WF_TRIGGER_LAMBDA_NAME = "apg-workflow-trigger-lambda"
 DONE_LAMBDA_NAME = "apg-create-done-file-lambda"
+EXECUTION_COMPLETE_LAMBDA_NAME = "apg-execution-complete-lambda"
+BACKFILL_DATES_LAMBDA_NAME = "apg-backfill-dates-lambda"
+ATHENA_EXECUTOR_LAMBDA_NAME = "apg-athena-executor-lambda"
+ATHENA_QUERY_STATE_LAMBDA_NAME = "apg-athena-query-state-lambda"
+
+# SQS front door for the workflow trigger lambda
+# When enabled, landing bucket .done notifications are buffered in SQS and
+# delivered to the lambda in batches instead of one invocation per object
+WF_TRIGGER_SQS_ENABLED = os.environ.get("WF_TRIGGER_SQS_ENABLED", "false").lower() == "true"
+WF_TRIGGER_SQS_BATCH_SIZE = 10
+WF_TRIGGER_SQS_BATCHING_WINDOW_SECONDS = 30
+WF_TRIGGER_SQS_MAX_CONCURRENCY = 2  # Lambda minimum for SQS event sources
+WF_TRIGGER_SQS_MAX_RECEIVE_COUNT = 3
+
+# Incoming objects tracked for readiness ( .done is routed to the trigger ).
+# {pipeline}.completed markers are not, the depends_on pipelines they would
+# concern are started on completion of their upstream, see dependent_pipelines.py
+READINESS_TRACKED_SUFFIXES = [".parquet"]
+# Reconciliation sweep of the done file lambda, readiness is event driven
+DONE_FILE_SWEEP_CRON_HOUR = "*/6"
+
+# Fast path for deliveries identical to the last success ( off | skip | alias )
+INPUT_FINGERPRINT_FAST_PATH = os.environ.get("INPUT_FINGERPRINT_FAST_PATH", "off")
+
+# Incoming parquet files are rewritten sorted and zstd compressed instead of copied
+LAYOUT_REWRITE_ENABLED = os.environ.get("LAYOUT_REWRITE_ENABLED", "false").lower() == "true"
+# Row order of the rewritten files ( time | key ), see the lambda config
+LAYOUT_SORT_ORDER = os.environ.get("LAYOUT_SORT_ORDER", "time")
+# Daily runs recompute only the dates whose landing rows changed ( needs the rewrite )
+INCREMENTAL_RECOMPUTE_ENABLED = (
+    os.environ.get("INCREMENTAL_RECOMPUTE_ENABLED", "false").lower() == "true"
+)
+
+# Athena executor and query state lambdas of runtime lambda / callback tasks
+ATHENA_EXECUTOR_LAMBDA_ENABLED = (
+    os.environ.get("ATHENA_EXECUTOR_LAMBDA_ENABLED", "false").lower() == "true"
+)
+
+# AWS SDK for pandas managed layer, pyarrow of the trigger lambda's layout
+# rewrite and awswrangler ( 3.x API ) of the athena executor lambdas.
+# Layer versions of the WRANGLER_ASSET_VERSION release per region, other
+# regions set AWS_SDK_PANDAS_LAYER_VERSION:
+# https://aws-sdk-pandas.readthedocs.io/en/3.2.0/layers.html
+AWS_SDK_PANDAS_LAYER_VERSIONS = {
+    "us-east-1": "11",
+}
+AWS_SDK_PANDAS_LAYER_VERSION = os.environ.get(
+    "AWS_SDK_PANDAS_LAYER_VERSION", AWS_SDK_PANDAS_LAYER_VERSIONS.get(REGION)
+)
+AWS_SDK_PANDAS_LAYER_ARN = None
+if LAYOUT_REWRITE_ENABLED or ATHENA_EXECUTOR_LAMBDA_ENABLED:
+    if not AWS_SDK_PANDAS_LAYER_VERSION:
+        raise ValueError(
+            f"No AWSSDKPandas-Python39 layer version pinned for {REGION}, set "
+            f"AWS_SDK_PANDAS_LAYER_VERSION to the awswrangler {WRANGLER_ASSET_VERSION} one"
+        )
+    AWS_SDK_PANDAS_LAYER_ARN = (
+        f"arn:aws:lambda:{REGION}:336392948345:layer:"
+        f"AWSSDKPandas-Python39:{AWS_SDK_PANDAS_LAYER_VERSION}"
+    )
+
+# DynamoDB
+EXECUTION_LEDGER_TABLE = f"apg-execution-ledger-{DEPLOYMENT_STAGE}"
+ATHENA_CALLBACK_TABLE = f"apg-athena-callback-tokens-{DEPLOYMENT_STAGE}"
+ATHENA_ADMISSION_TABLE = f"apg-athena-admission-{DEPLOYMENT_STAGE}"
 
 PIPELINE_NAME = {
     "usghgemission_daily": "USGHGEFCalculationDaily",
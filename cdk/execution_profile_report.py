@@ -0,0 +1,262 @@
+#!/usr/bin/env python3
+"""
+Recommends execution profile changes from exported run history.
+
+Run from the cdk directory with the JSON exported by
+    aws glue get-job-runs --job-name <job> > glue_runs_<job>.json
+    aws athena batch-get-query-execution --query-execution-ids ... > athena.json
+
+    python execution_profile_report.py --glue-runs glue_runs_*.json \
+        --athena-queries athena.json [--json]
+
+Findings per task,
+    memory   : runs killed on memory at 0.0625 DPU, use 1 DPU
+    dpu      : 1 DPU tasks that never came close to needing it
+    timeout  : runs timing out, or a timeout far above the slowest run
+    retry    : step function retries that never turned a failure into
+               a success, they only add latency
+    queueing : Athena queue time above engine time, lower the concurrency
+"""
+import argparse
+import json
+import math
+import re
+import statistics
+from collections import defaultdict
+
+import pipeline_stacks.usghgemission_daily_config as daily_cfg
+import pipeline_stacks.usghgemission_monthly_config as monthly_cfg
+from pkg.execution_profiles import get_execution_profile, get_glue_job_name
+
+# (device_type, frequency, tasks) of every pipeline stack
+PIPELINES = [
+    ("usghgemission_daily", "daily", daily_cfg.UTILITY_EMISSION_DAILY),
+    (
+        "usghgemission_monthly",
+        "monthly",
+        monthly_cfg.UTILITY_EMISSION_MONTHLY + monthly_cfg.MONTHLY_AUDIT_TABLES,
+    ),
+]
+
+MIN_RUNS = 5
+MEMORY_ERROR_PATTERN = re.compile(
+    r"MemoryError|out of memory|OutOfMemory|exit code 137|killed", re.IGNORECASE
+)
+# Timeout recommended as this multiple of the slowest successful run
+TIMEOUT_HEADROOM = 2
+# A timeout above this multiple of the slowest successful run is too generous
+TIMEOUT_GENEROUS_RATIO = 4
+# 1 DPU tasks whose slowest run is below this fraction of the timeout
+DPU_IDLE_RATIO = 0.1
+INSERT_TABLE_PATTERN = re.compile(r"insert\s+into\s+[\w.]*?(\w+)\s", re.IGNORECASE)
+
+
+def get_tasks() -> dict:
+    """Glue job name => task, table and execution profile"""
+    tasks = {}
+    for device_type, frequency, pipeline_tasks in PIPELINES:
+        for task in pipeline_tasks:
+            for table in task["tables"]:
+                job_name = get_glue_job_name(
+                    device_type=device_type,
+                    job_type=task["function"],
+                    table_name=table,
+                    frequency=frequency,
+                )
+                tasks[job_name] = {
+                    "table": table,
+                    "function": task["function"],
+                    "profile": get_execution_profile(task),
+                }
+    return tasks
+
+
+def load_records(paths: list, key: str) -> list:
+    records = []
+    for path in paths:
+        with open(path) as export_file:
+            content = json.load(export_file)
+        records.extend(content.get(key, []) if isinstance(content, dict) else content)
+    return records
+
+
+def check_memory(runs: list, profile: dict) -> list:
+    killed = [
+        run for run in runs if MEMORY_ERROR_PATTERN.search(run.get("ErrorMessage", ""))
+    ]
+    if killed and profile["dpu"] < 1:
+        return [
+            {
+                "finding": "memory",
+                "detail": f"{len(killed)} run(s) hit the memory ceiling at {profile['dpu']} DPU",
+                "recommend": {"dpu": 1},
+            }
+        ]
+    return []
+
+
+def check_dpu(runs: list, profile: dict) -> list:
+    succeeded = [run for run in runs if run.get("JobRunState") == "SUCCEEDED"]
+    if profile["dpu"] < 1 or len(succeeded) < MIN_RUNS:
+        return []
+    if any(MEMORY_ERROR_PATTERN.search(run.get("ErrorMessage", "")) for run in runs):
+        return []
+    slowest = max(run.get("ExecutionTime", 0) for run in succeeded)
+    if slowest < profile["timeout_mins"] * 60 * DPU_IDLE_RATIO:
+        return [
+            {
+                "finding": "dpu",
+                "detail": f"slowest of {len(succeeded)} runs took {slowest}s at 1 DPU",
+                "recommend": {"dpu": 0.0625},
+            }
+        ]
+    return []
+
+
+def check_timeout(runs: list, profile: dict) -> list:
+    timeout_secs = profile["timeout_mins"] * 60
+    timed_out = [run for run in runs if run.get("JobRunState") == "TIMEOUT"]
+    succeeded = [run for run in runs if run.get("JobRunState") == "SUCCEEDED"]
+    if timed_out:
+        return [
+            {
+                "finding": "timeout",
+                "detail": f"{len(timed_out)} run(s) timed out after {profile['timeout_mins']} min",
+                "recommend": {"timeout_mins": profile["timeout_mins"] * TIMEOUT_HEADROOM},
+            }
+        ]
+    if len(succeeded) < MIN_RUNS:
+        return []
+    slowest = max(run.get("ExecutionTime", 0) for run in succeeded)
+    if slowest * TIMEOUT_GENEROUS_RATIO < timeout_secs:
+        recommended = max(1, math.ceil(slowest * TIMEOUT_HEADROOM / 60))
+        return [
+            {
+                "finding": "timeout",
+                "detail": (
+                    f"slowest of {len(succeeded)} runs took {slowest}s, "
+                    f"timeout is {profile['timeout_mins']} min"
+                ),
+                "recommend": {"timeout_mins": recommended},
+            }
+        ]
+    return []
+
+
+def check_retry(runs: list, profile: dict) -> list:
+    """
+    Runs of one step ( same --step_execution_id and exec_date ) are the
+    step function attempts, a retry helped when a failed attempt was
+    followed by a success
+    """
+    if profile["retry"]["max_attempts"] == 0:
+        return []
+    attempts = defaultdict(list)
+    for run in runs:
+        arguments = run.get("Arguments", {})
+        step = (
+            arguments.get("--step_execution_id"),
+            arguments.get("--param_execution_date"),
+        )
+        if step[0] is not None:
+            attempts[step].append(run)
+
+    helped = wasted = 0
+    for step_runs in attempts.values():
+        states = [
+            run.get("JobRunState")
+            for run in sorted(step_runs, key=lambda run: str(run.get("StartedOn", "")))
+        ]
+        if len(states) < 2:
+            continue
+        if states[-1] == "SUCCEEDED":
+            helped += 1
+        else:
+            wasted += 1
+    if wasted >= MIN_RUNS and helped == 0:
+        return [
+            {
+                "finding": "retry",
+                "detail": f"{wasted} retried step(s) failed on every attempt, none recovered",
+                "recommend": {"retry": {"max_attempts": 0}},
+            }
+        ]
+    return []
+
+
+def check_queueing(queries: list, profile: dict) -> list:
+    succeeded = [q for q in queries if q.get("Status", {}).get("State") == "SUCCEEDED"]
+    if len(succeeded) < MIN_RUNS:
+        return []
+    queue = statistics.median(
+        q["Statistics"].get("QueryQueueTimeInMillis", 0) for q in succeeded
+    )
+    engine = statistics.median(
+        q["Statistics"].get("EngineExecutionTimeInMillis", 0) for q in succeeded
+    )
+    if queue > engine and profile["max_concurrent_runs"] > 1:
+        return [
+            {
+                "finding": "queueing",
+                "detail": f"median Athena queue {queue}ms above engine time {engine}ms",
+                "recommend": {"max_concurrent_runs": max(1, profile["max_concurrent_runs"] // 2)},
+            }
+        ]
+    return []
+
+
+def get_report(glue_runs: list, athena_queries: list) -> dict:
+    tasks = get_tasks()
+    runs_by_job = defaultdict(list)
+    for run in glue_runs:
+        runs_by_job[run.get("JobName")].append(run)
+
+    queries_by_table = defaultdict(list)
+    for query in athena_queries:
+        match = INSERT_TABLE_PATTERN.search(query.get("Query", ""))
+        if match:
+            queries_by_table[match.group(1)].append(query)
+
+    report = {}
+    for job_name, task in tasks.items():
+        runs = runs_by_job.get(job_name, [])
+        profile = task["profile"]
+        findings = (
+            check_memory(runs, profile)
+            + check_dpu(runs, profile)
+            + check_timeout(runs, profile)
+            + check_retry(runs, profile)
+        )
+        if task["function"] == "job":
+            findings += check_queueing(queries_by_table.get(task["table"], []), profile)
+        report[job_name] = {"runs": len(runs), "profile": profile, "findings": findings}
+    return report
+
+
+def print_report(report: dict):
+    for job_name, job_report in report.items():
+        print(f"{job_name} ( {job_report['runs']} runs )")
+        if not job_report["findings"]:
+            print("    no change recommended")
+        for finding in job_report["findings"]:
+            print(
+                f"    {finding['finding']:<9}: {finding['detail']}\n"
+                f"               execution_profile {json.dumps(finding['recommend'])}"
+            )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--glue-runs", nargs="*", default=[])
+    parser.add_argument("--athena-queries", nargs="*", default=[])
+    parser.add_argument("--json", action="store_true")
+    cli_args = parser.parse_args()
+
+    execution_report = get_report(
+        glue_runs=load_records(cli_args.glue_runs, "JobRuns"),
+        athena_queries=load_records(cli_args.athena_queries, "QueryExecutions"),
+    )
+    if cli_args.json:
+        print(json.dumps(execution_report, indent=4))
+    else:
+        print_report(execution_report)
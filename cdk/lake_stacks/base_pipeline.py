@@ -8,11 +8,18 @@ from aws_cdk import (
     aws_s3_notifications,
     aws_events as events,
     aws_s3 as s3,
+    aws_dynamodb as dynamodb,
+    aws_lambda_event_sources as lambda_event_sources,
+    aws_sqs as sqs,
+    RemovalPolicy,
+    Fn,
     Stack,
     aws_events_targets as targets
 )
 from aws_cdk.aws_iam import Policy
 import config as cf
+from pkg.common_policy import attach_common_polices_to_role
+from pkg.lambda_helpers import create_layer
 # from aws_cdk import Stack
 from constructs import Construct
 # import aws_cdk.aws_events as events
@@ -29,6 +36,23 @@ class BasePipeline(Stack):
         path_common_src = os.path.join(cf.PATH_SRC, "commons")
         path_wf_trigger_src = os.path.join(cf.PATH_SRC, "workflow_trigger_lambda")
 
+        # Execution ledger : one item per (state machine, exec_date)
+        execution_ledger_table = dynamodb.Table(
+            self,
+            id="apg-execution-ledger",
+            table_name=cf.EXECUTION_LEDGER_TABLE,
+            partition_key=dynamodb.Attribute(
+                name="state_machine", type=dynamodb.AttributeType.STRING
+            ),
+            sort_key=dynamodb.Attribute(
+                name="exec_date", type=dynamodb.AttributeType.STRING
+            ),
+            billing_mode=dynamodb.BillingMode.PAY_PER_REQUEST,
+            encryption=dynamodb.TableEncryption.AWS_MANAGED,
+            point_in_time_recovery=True,
+            removal_policy=RemovalPolicy.RETAIN,
+        )
+
         # Ingestion : Workflow Trigger Lambda
         lambda_timeout_seconds = 900
 
@@ -38,30 +62,51 @@ class BasePipeline(Stack):
             handler="workflow_trigger.handler",
             runtime=lambda_.Runtime.PYTHON_3_9,
             code=lambda_.Code.from_asset(
-                path=path_wf_trigger_src, exclude=["create_done_file.py"]
+                path=path_wf_trigger_src,
+                exclude=["create_done_file.py", "execution_complete.py", "backfill_dates.py"],
             ),
-            function_name="apg-workflow-trigger-lambda",
+            function_name=cf.WF_TRIGGER_LAMBDA_NAME,
             environment={
                 "STAGE": cf.DEPLOYMENT_STAGE,
                 "REGION": cf.REGION,
                 "ACCOUNT": cf.ACCOUNT,
+                "EXECUTION_LEDGER_TABLE": execution_ledger_table.table_name,
+                "INPUT_FINGERPRINT_FAST_PATH": cf.INPUT_FINGERPRINT_FAST_PATH,
+                "LAYOUT_REWRITE_ENABLED": str(cf.LAYOUT_REWRITE_ENABLED).lower(),
+                "LAYOUT_SORT_ORDER": cf.LAYOUT_SORT_ORDER,
+                "INCREMENTAL_RECOMPUTE_ENABLED": str(cf.INCREMENTAL_RECOMPUTE_ENABLED).lower(),
             },
-            memory_size=500,
+            # Layout rewrites hold a sort buffer per file in memory
+            memory_size=3008 if cf.LAYOUT_REWRITE_ENABLED else 500,
             timeout=Duration.seconds(lambda_timeout_seconds),
         )
+        if cf.LAYOUT_REWRITE_ENABLED:
+            # pyarrow of the layout rewrite, the preflight reads the footer itself
+            wf_trigger_lambda.add_layers(
+                lambda_.LayerVersion.from_layer_version_arn(
+                    self, "aws-sdk-pandas-layer", cf.AWS_SDK_PANDAS_LAYER_ARN
+                )
+            )
 
         landing_bucket = s3.Bucket.from_bucket_name(
             self, f"imported-bucket-{cf.S3_LANDING_BUCKET}", cf.S3_LANDING_BUCKET
         )
 
-        landing_bucket.add_event_notification(
-            s3.EventType.OBJECT_CREATED,
-            aws_s3_notifications.LambdaDestination(wf_trigger_lambda),
-            s3.NotificationKeyFilter(
-                prefix=f"{cf.S3_LANDING_INCOMING_PATH}/",
-                suffix=".done",
-            ),
-        )
+        if cf.WF_TRIGGER_SQS_ENABLED:
+            self.add_wf_trigger_sqs_front_door(
+                landing_bucket=landing_bucket,
+                wf_trigger_lambda=wf_trigger_lambda,
+                lambda_timeout_seconds=lambda_timeout_seconds,
+            )
+        else:
+            landing_bucket.add_event_notification(
+                s3.EventType.OBJECT_CREATED,
+                aws_s3_notifications.LambdaDestination(wf_trigger_lambda),
+                s3.NotificationKeyFilter(
+                    prefix=f"{cf.S3_LANDING_INCOMING_PATH}/",
+                    suffix=".done",
+                ),
+            )
 
         wf_trigger_lambda.add_to_role_policy(
             iam.PolicyStatement(
@@ -79,10 +124,54 @@ class BasePipeline(Stack):
         wf_trigger_lambda.add_to_role_policy(
             iam.PolicyStatement(
                 effect=iam.Effect.ALLOW,
-                actions=["states:StartExecution", "states:ListExecutions"],
+                actions=["states:StartExecution"],
                 resources=[f"arn:aws:states:*:{cf.ACCOUNT}:stateMachine:*"],
             )
         )
+        execution_ledger_table.grant_read_write_data(wf_trigger_lambda)
+
+        # Pre-flight validation reads the landing table schema and the
+        # exec_date partitions are registered after the copy
+        wf_trigger_lambda.add_to_role_policy(
+            iam.PolicyStatement(
+                effect=iam.Effect.ALLOW,
+                actions=["glue:GetTable", "glue:BatchCreatePartition"],
+                resources=[
+                    f"arn:aws:glue:{cf.REGION}:{cf.ACCOUNT}:catalog",
+                    f"arn:aws:glue:{cf.REGION}:{cf.ACCOUNT}:database/{cf.LANDING_DB_NAME}",
+                    f"arn:aws:glue:{cf.REGION}:{cf.ACCOUNT}:table/{cf.LANDING_DB_NAME}/*",
+                ],
+            )
+        )
+        # Fingerprint fast path aliases partitions onto copies of previous outputs
+        wf_trigger_lambda.add_to_role_policy(
+            iam.PolicyStatement(
+                effect=iam.Effect.ALLOW,
+                actions=[
+                    "glue:GetTable",
+                    "glue:GetPartition",
+                    "glue:CreatePartition",
+                    "glue:UpdatePartition",
+                    "glue:DeletePartition",
+                ],
+                resources=[
+                    f"arn:aws:glue:{cf.REGION}:{cf.ACCOUNT}:catalog",
+                    f"arn:aws:glue:{cf.REGION}:{cf.ACCOUNT}:database/{cf.LANDING_DB_NAME}",
+                    f"arn:aws:glue:{cf.REGION}:{cf.ACCOUNT}:table/{cf.LANDING_DB_NAME}/*",
+                    f"arn:aws:glue:{cf.REGION}:{cf.ACCOUNT}:database/{cf.PROCESSED_DB_NAME}",
+                    f"arn:aws:glue:{cf.REGION}:{cf.ACCOUNT}:table/{cf.PROCESSED_DB_NAME}/*",
+                ],
+            )
+        )
+        wf_trigger_lambda.add_to_role_policy(
+            iam.PolicyStatement(
+                effect=iam.Effect.ALLOW,
+                # Partitions are written to the encrypted catalog ( BatchCreatePartition,
+                # CreatePartition and UpdatePartition of the aliased partitions )
+                actions=["kms:Decrypt", "kms:Encrypt", "kms:GenerateDataKey"],
+                resources=[Fn.import_value(cf.GLUE_CATALOG_KEY_ARN)],
+            )
+        )
 
         wf_trigger_lambda.add_to_role_policy(
             iam.PolicyStatement(
@@ -114,13 +203,15 @@ class BasePipeline(Stack):
             handler="create_done_file.handler",
             runtime=lambda_.Runtime.PYTHON_3_9,
             code=lambda_.Code.from_asset(
-                path=path_wf_trigger_src, exclude=["workflow_trigger.py"]
+                path=path_wf_trigger_src,
+                exclude=["workflow_trigger.py", "execution_complete.py", "backfill_dates.py"],
             ),
             function_name="apg-create-done-file-lambda",
             environment={
                 "STAGE": cf.DEPLOYMENT_STAGE,
                 "REGION": cf.REGION,
                 "ACCOUNT": cf.ACCOUNT,
+                "EXECUTION_LEDGER_TABLE": execution_ledger_table.table_name,
             },
             memory_size=128,
             timeout=Duration.seconds(600),
@@ -137,16 +228,176 @@ class BasePipeline(Stack):
             )
         )
 
-        # Event Bridge rule to schedule lambda.Function
+        execution_ledger_table.grant_read_write_data(create_done_file_lambda)
+
+        # Readiness : every incoming data file updates its (pipeline, date) record
+        for suffix in cf.READINESS_TRACKED_SUFFIXES:
+            landing_bucket.add_event_notification(
+                s3.EventType.OBJECT_CREATED,
+                aws_s3_notifications.LambdaDestination(create_done_file_lambda),
+                s3.NotificationKeyFilter(
+                    prefix=f"{cf.S3_LANDING_INCOMING_PATH}/",
+                    suffix=suffix,
+                ),
+            )
+
+        # Event Bridge rule to schedule lambda.Function ( reconciliation sweep )
         rule_trigger_done_file_lambda = events.Rule(
             self,
             "Schedule Done File Lambda",
-            schedule=events.Schedule.cron(minute="0", hour="*"),
+            schedule=events.Schedule.cron(minute="0", hour=cf.DONE_FILE_SWEEP_CRON_HOUR),
         )
         rule_trigger_done_file_lambda.add_target(
             targets.LambdaFunction(create_done_file_lambda)
         )
 
+        # Lambda : Close ledger runs and start queued exec_dates
+        execution_complete_lambda = lambda_.Function(
+            self,
+            id=cf.EXECUTION_COMPLETE_LAMBDA_NAME,
+            handler="execution_complete.handler",
+            runtime=lambda_.Runtime.PYTHON_3_9,
+            code=lambda_.Code.from_asset(
+                path=path_wf_trigger_src,
+                exclude=["workflow_trigger.py", "create_done_file.py", "backfill_dates.py"],
+            ),
+            function_name=cf.EXECUTION_COMPLETE_LAMBDA_NAME,
+            environment={
+                "STAGE": cf.DEPLOYMENT_STAGE,
+                "REGION": cf.REGION,
+                "ACCOUNT": cf.ACCOUNT,
+                "EXECUTION_LEDGER_TABLE": execution_ledger_table.table_name,
+                "WF_TRIGGER_LAMBDA_NAME": cf.WF_TRIGGER_LAMBDA_NAME,
+            },
+            memory_size=128,
+            timeout=Duration.seconds(60),
+        )
+        execution_ledger_table.grant_read_write_data(execution_complete_lambda)
+        # Replays changed deliveries received while a run was in flight
+        execution_complete_lambda.add_to_role_policy(
+            iam.PolicyStatement(
+                effect=iam.Effect.ALLOW,
+                actions=["lambda:InvokeFunction"],
+                resources=[
+                    f"arn:aws:lambda:{cf.REGION}:{cf.ACCOUNT}:function:{cf.WF_TRIGGER_LAMBDA_NAME}"
+                ],
+            )
+        )
+        execution_complete_lambda.add_to_role_policy(
+            iam.PolicyStatement(
+                effect=iam.Effect.ALLOW,
+                actions=["states:StartExecution"],
+                resources=[f"arn:aws:states:*:{cf.ACCOUNT}:stateMachine:*"],
+            )
+        )
+        # Starts dependent pipelines and writes the {pipeline}.completed marker
+        execution_complete_lambda.add_to_role_policy(
+            iam.PolicyStatement(
+                effect=iam.Effect.ALLOW,
+                actions=["ssm:GetParameter"],
+                resources=[f"arn:aws:ssm:{cf.REGION}:{cf.ACCOUNT}:parameter/pipeline/*"],
+            )
+        )
+        execution_complete_lambda.add_to_role_policy(
+            iam.PolicyStatement(
+                effect=iam.Effect.ALLOW,
+                actions=["s3:PutObject"],
+                resources=[f"arn:aws:s3:::{cf.S3_LANDING_BUCKET}/incoming/*"],
+            )
+        )
+        # Queued runs resolve their incremental parameters from the period
+        # fingerprints, ListBucket makes a missing sidecar a 404 not a 403
+        execution_complete_lambda.add_to_role_policy(
+            iam.PolicyStatement(
+                effect=iam.Effect.ALLOW,
+                actions=["s3:GetObject"],
+                resources=[
+                    f"arn:aws:s3:::{cf.S3_LANDING_BUCKET}/{cf.LANDING_DB_NAME}/*/exec_date=*/"
+                    "_period_fingerprints.json"
+                ],
+            )
+        )
+        execution_complete_lambda.add_to_role_policy(
+            iam.PolicyStatement(
+                effect=iam.Effect.ALLOW,
+                actions=["s3:ListBucket"],
+                resources=[f"arn:aws:s3:::{cf.S3_LANDING_BUCKET}"],
+            )
+        )
+        # Terminal execution states are routed by the pipeline stacks, see
+        # pkg.lambda_helpers.add_execution_complete_rule
+
+        # Lambda : Date expansion and summary of the pipeline backfill state machines
+        backfill_dates_lambda = lambda_.Function(
+            self,
+            id=cf.BACKFILL_DATES_LAMBDA_NAME,
+            handler="backfill_dates.handler",
+            runtime=lambda_.Runtime.PYTHON_3_9,
+            code=lambda_.Code.from_asset(
+                path=path_wf_trigger_src,
+                exclude=[
+                    "workflow_trigger.py",
+                    "create_done_file.py",
+                    "execution_complete.py",
+                ],
+            ),
+            function_name=cf.BACKFILL_DATES_LAMBDA_NAME,
+            environment={
+                "STAGE": cf.DEPLOYMENT_STAGE,
+                "REGION": cf.REGION,
+                "ACCOUNT": cf.ACCOUNT,
+                "EXECUTION_LEDGER_TABLE": execution_ledger_table.table_name,
+            },
+            memory_size=128,
+            timeout=Duration.seconds(60),
+        )
+        # Holds the exec_dates of backfill ranges in the ledger
+        execution_ledger_table.grant_read_write_data(backfill_dates_lambda)
+        backfill_dates_lambda.add_to_role_policy(
+            iam.PolicyStatement(
+                effect=iam.Effect.ALLOW,
+                actions=["ssm:GetParameter"],
+                resources=[f"arn:aws:ssm:{cf.REGION}:{cf.ACCOUNT}:parameter/pipeline/*"],
+            )
+        )
+
+        # Task tokens of callback runs, by Athena query execution id
+        athena_callback_table = dynamodb.Table(
+            self,
+            id="apg-athena-callback-tokens",
+            table_name=cf.ATHENA_CALLBACK_TABLE,
+            partition_key=dynamodb.Attribute(
+                name="query_execution_id", type=dynamodb.AttributeType.STRING
+            ),
+            billing_mode=dynamodb.BillingMode.PAY_PER_REQUEST,
+            encryption=dynamodb.TableEncryption.AWS_MANAGED,
+            time_to_live_attribute="expires_at",
+            removal_policy=RemovalPolicy.DESTROY,
+        )
+
+        # Athena slots by workgroup, see athena_admission.py
+        athena_admission_table = dynamodb.Table(
+            self,
+            id="apg-athena-admission",
+            table_name=cf.ATHENA_ADMISSION_TABLE,
+            partition_key=dynamodb.Attribute(
+                name="workgroup", type=dynamodb.AttributeType.STRING
+            ),
+            billing_mode=dynamodb.BillingMode.PAY_PER_REQUEST,
+            encryption=dynamodb.TableEncryption.AWS_MANAGED,
+            removal_policy=RemovalPolicy.DESTROY,
+        )
+
+        if cf.ATHENA_EXECUTOR_LAMBDA_ENABLED:
+            self.add_athena_executor_lambdas(
+                path_common_src=path_common_src,
+                athena_callback_table=athena_callback_table,
+                athena_admission_table=athena_admission_table,
+            )
+
+        # Terminal query states of the pipeline workgroups are routed by the
+        # pipeline stacks, see pkg.athena_helpers.add_query_state_rule
+
         s3_glue_assets_bucket_perm = Policy(
             self,
             id="s3-glue-assets-bucket-permissions",
@@ -210,6 +461,139 @@ class BasePipeline(Stack):
             )  # noqa
         )
 
+    def add_athena_executor_lambdas(
+        self,
+        path_common_src: str,
+        athena_callback_table: dynamodb.Table,
+        athena_admission_table: dynamodb.Table,
+    ):
+        """Executor and query state lambdas of the lambda and callback runtime tasks"""
+        athena_executor_code = lambda_.Code.from_asset(
+            path=os.path.join(path_common_src, "execute_athena_query"),
+            exclude=[
+                "execute_batch_ddl_athena_j2sql.py",
+                "pipeline_runner.py",
+                "lambda_layer",
+                "scripts",
+            ],
+        )
+        athena_executor_layers = [
+            lambda_.LayerVersion.from_layer_version_arn(
+                self, "athena-executor-pandas-layer", cf.AWS_SDK_PANDAS_LAYER_ARN
+            ),
+            create_layer(
+                self,
+                layer_id="athena-executor-jinja2-layer",
+                makefile_path=os.path.join(
+                    path_common_src, "execute_athena_query", "lambda_layer"
+                ),
+                code_asset_name="build",
+            ),
+        ]
+        athena_executor_environment = {
+            "STAGE": cf.DEPLOYMENT_STAGE,
+            "REGION": cf.REGION,
+            "ACCOUNT": cf.ACCOUNT,
+            "ATHENA_CALLBACK_TABLE": athena_callback_table.table_name,
+        }
+        send_task_result_statement = iam.PolicyStatement(
+            effect=iam.Effect.ALLOW,
+            actions=["states:SendTaskSuccess", "states:SendTaskFailure"],
+            resources=[f"arn:aws:states:{cf.REGION}:{cf.ACCOUNT}:stateMachine:*"],
+        )
+
+        # Lambda : Athena executor, the exec_athena_query.py of runtime lambda tasks
+        athena_executor_lambda = lambda_.Function(
+            self,
+            id=cf.ATHENA_EXECUTOR_LAMBDA_NAME,
+            handler="exec_athena_query.lambda_handler",
+            runtime=lambda_.Runtime.PYTHON_3_9,
+            code=athena_executor_code,
+            function_name=cf.ATHENA_EXECUTOR_LAMBDA_NAME,
+            environment=athena_executor_environment,
+            memory_size=1024,
+            timeout=Duration.seconds(900),
+            layers=athena_executor_layers,
+        )
+        attach_common_polices_to_role(scope=self, iam_role=athena_executor_lambda.role)
+        athena_callback_table.grant_read_write_data(athena_executor_lambda)
+        athena_executor_lambda.add_to_role_policy(send_task_result_statement)
+
+        # Lambda : Resumes the step of a callback run on its query state change
+        athena_query_state_lambda = lambda_.Function(
+            self,
+            id=cf.ATHENA_QUERY_STATE_LAMBDA_NAME,
+            handler="exec_athena_query.query_state_change_handler",
+            runtime=lambda_.Runtime.PYTHON_3_9,
+            code=athena_executor_code,
+            function_name=cf.ATHENA_QUERY_STATE_LAMBDA_NAME,
+            environment=athena_executor_environment,
+            memory_size=256,
+            timeout=Duration.seconds(60),
+            layers=athena_executor_layers,
+        )
+        athena_callback_table.grant_read_write_data(athena_query_state_lambda)
+        athena_query_state_lambda.add_to_role_policy(send_task_result_statement)
+        # Releases the admission slot of the completed query
+        athena_admission_table.grant_read_write_data(athena_query_state_lambda)
+        athena_query_state_lambda.add_to_role_policy(
+            iam.PolicyStatement(
+                effect=iam.Effect.ALLOW,
+                actions=["athena:GetQueryExecution"],
+                resources=[f"arn:aws:athena:{cf.REGION}:{cf.ACCOUNT}:workgroup/*"],
+            )
+        )
+
+    def add_wf_trigger_sqs_front_door(
+        self,
+        landing_bucket: s3.IBucket,
+        wf_trigger_lambda: lambda_.Function,
+        lambda_timeout_seconds: int,
+    ):
+        """Buffers .done notifications in SQS and feeds the lambda in batches"""
+        wf_trigger_dlq = sqs.Queue(
+            self,
+            id="apg-workflow-trigger-dlq",
+            queue_name="apg-workflow-trigger-dlq",
+            encryption=sqs.QueueEncryption.SQS_MANAGED,
+            enforce_ssl=True,
+            retention_period=Duration.days(14),
+        )
+        wf_trigger_queue = sqs.Queue(
+            self,
+            id="apg-workflow-trigger-queue",
+            queue_name="apg-workflow-trigger-queue",
+            encryption=sqs.QueueEncryption.SQS_MANAGED,
+            enforce_ssl=True,
+            # AWS recommends 6x the function timeout for SQS event sources
+            visibility_timeout=Duration.seconds(6 * lambda_timeout_seconds),
+            dead_letter_queue=sqs.DeadLetterQueue(
+                max_receive_count=cf.WF_TRIGGER_SQS_MAX_RECEIVE_COUNT,
+                queue=wf_trigger_dlq,
+            ),
+        )
+
+        landing_bucket.add_event_notification(
+            s3.EventType.OBJECT_CREATED,
+            aws_s3_notifications.SqsDestination(wf_trigger_queue),
+            s3.NotificationKeyFilter(
+                prefix=f"{cf.S3_LANDING_INCOMING_PATH}/",
+                suffix=".done",
+            ),
+        )
+
+        wf_trigger_lambda.add_event_source(
+            lambda_event_sources.SqsEventSource(
+                wf_trigger_queue,
+                batch_size=cf.WF_TRIGGER_SQS_BATCH_SIZE,
+                max_batching_window=Duration.seconds(
+                    cf.WF_TRIGGER_SQS_BATCHING_WINDOW_SECONDS
+                ),
+                max_concurrency=cf.WF_TRIGGER_SQS_MAX_CONCURRENCY,
+                report_batch_item_failures=True,
+            )
+        )
+
     def lambda_execution_role_logs_permission_inline_policy_generator(
         self, lamda_name: str
     ):  # noqa
@@ -35,3 +35,75 @@ GLUE_JOBS_RETRY = 0
 GLUE_TASK_RETRY = 2
 LAMBDA_TASK_RETRY = 1
 WAITING_TIME_BEFORE_RETRY = 60
+
+# BACKFILL STATE MACHINES ( Distributed Map over exec_dates )
+BACKFILL_MAX_CONCURRENCY = 8
+BACKFILL_TIMEOUT_HOURS = 24
+# Glue jobs accept the backfill dates running at once
+GLUE_JOB_MAX_CONCURRENT_RUNS = BACKFILL_MAX_CONCURRENCY
+
+# ATHENA WORKGROUP of every pipeline
+#   bytes_scanned_cutoff_per_query : queries scanning more are cancelled
+#   result_reuse_max_age_mins      : Athena query result reuse of the SELECT
+#                                    statements run by the executors, a run of
+#                                    the same query within this age, 0 = off.
+#                                    INSERT statements never reuse results
+ATHENA_WORKGROUP = {
+    "engine_version": "Athena engine version 3",
+    "bytes_scanned_cutoff_per_query": 100 * 1024 ** 3,
+    "result_reuse_max_age_mins": 60,
+}
+
+# ATHENA ADMISSION ( per workgroup slots shared by every executor )
+# Slots of every pipeline workgroup, keep their sum under the account's
+# active DML query quota
+ATHENA_ADMISSION_SLOTS = 10
+# Raised by the executors on SQL, permission and data errors, never retried
+ATHENA_FATAL_ERROR = "AthenaFatalError"
+
+# Step function errors of a Glue job run that did not start, the only ones
+# Glue steps retry. The jobs retry a failed task themselves, purging its
+# destination again, a failed run could be an AthenaFatalError
+GLUE_SERVICE_ERRORS = [
+    "Glue.ConcurrentRunsExceededException",
+    "Glue.ThrottlingException",
+    "Glue.InternalServiceException",
+    "Glue.OperationTimeoutException",
+]
+
+# Submission errors of the Step Functions Athena integration, the only ones
+# native Athena steps retry, a failed INSERT is not run again unpurged
+ATHENA_SUBMISSION_ERRORS = [
+    "Athena.TooManyRequestsException",
+    "Athena.InternalServerException",
+]
+
+# STATE MACHINES
+# Added to the worst case of the DAG for the state machine timeout, covers
+# the steps outside the DAG and the Glue start up
+STATE_MACHINE_TIMEOUT_MARGIN_MINS = 15
+
+# EXECUTION PROFILE of a task, override per task with "execution_profile"
+#   runtime            : glue ( pythonshell job ), lambda ( athena executor
+#                        lambda, no provisioning, for tasks under 15 minutes )
+#                        athena ( "job" tasks only, SQL rendered at synth
+#                        time and run by the step functions integration )
+#                        or callback ( executor lambda submits the SQL and
+#                        the step waits on the query state change, no
+#                        compute billed while Athena runs )
+#   dpu                : pythonshell capacity, 0.0625 or 1
+#   retry.backoff_rate : interval multiplier between step function retries
+#   retry.jitter       : randomise the retry intervals ( FULL jitter )
+DEFAULT_EXECUTION_PROFILE = {
+    "runtime": "glue",
+    "dpu": 0.0625,
+    "timeout_mins": 15,
+    "max_concurrent_runs": GLUE_JOB_MAX_CONCURRENT_RUNS,
+    "retry": {
+        "max_attempts": GLUE_TASK_RETRY,
+        "interval_seconds": WAITING_TIME_BEFORE_RETRY,
+        "backoff_rate": 2.0,
+        "max_delay_seconds": 600,
+        "jitter": True,
+    },
+}
@@ -14,14 +14,19 @@ import pipeline_stacks.usghgemission_daily_config as u_cfg
 from constructs import Construct
 
 from pkg.glue_helpers import create_glue_job_cw_log_group
-from pkg.glue_step_helpers import (  # noqa
-    create_glue_step,
-    get_glue_steps,
-    create_parallel_snf_definition,
+from pkg.common_policy import (
+    add_native_athena_statements,
+    create_standard_glue_job_role,
 )
-
-from pkg.common_policy import create_standard_glue_job_role
-from pkg.lambda_helpers import get_lambda_step
+from pkg.athena_helpers import create_pipeline_workgroup
+from pkg.backfill_helpers import create_backfill_state_machine
+from pkg.dag_helpers import (
+    create_dag_chain,
+    create_dag_glue_jobs,
+    get_state_machine_timeout_mins,
+    has_runtime,
+)
+from pkg.lambda_helpers import add_execution_complete_rule
 
 
 class USGHGEmissionDailyPipeline(Stack):
@@ -39,20 +44,15 @@ class USGHGEmissionDailyPipeline(Stack):
             scope=self, iam_role_name=ef_task_glue_job_role_name
         )
 
+        create_pipeline_workgroup(self, device_type=device_type)
+
         create_glue_job_cw_log_group(
             scope=self, job_name=device_type, role_name=ef_task_glue_job_role_name
         )
         
-        update_landing_partition_step = get_glue_steps(
-            self,
-            pipeline_tasks=u_cfg.UPDATE_LANDING_PARTITION,
-            frequency="daily",
-            device_type=device_type,
-            task_glue_job_role=ef_task_glue_job_role,
-            pipeline_name=pipeline_name,
-        )
-
-        UTILITY_EMISSION_DAILY = get_glue_steps(
+        # Dependents and the .completed marker are handled on the
+        # execution status change event, see execution_complete lambda
+        dag_job_schedule = create_dag_glue_jobs(
             self,
             pipeline_tasks=u_cfg.UTILITY_EMISSION_DAILY,
             frequency="daily",
@@ -60,24 +60,18 @@ class USGHGEmissionDailyPipeline(Stack):
             task_glue_job_role=ef_task_glue_job_role,
             pipeline_name=pipeline_name,
         )
-
-        usghg_definition = (
-            sfn.Chain.start(update_landing_partition_step)
-            .next(
-                UTILITY_EMISSION_DAILY
-                )
-            .next(
-                get_lambda_step(
-                    self, lambda_name=cf.DONE_LAMBDA_NAME, frequency="daily"
-                )
-            )
+        usghg_definition = create_dag_chain(
+            self, job_schedule=dag_job_schedule, name="daily-dag"
         )
 
         comp_usghg_ef_sm = sfn.StateMachine(
             self,
             "USGHGEmissionFactorDailyWorkflow",
             definition=usghg_definition,
-            timeout=Duration.minutes(30),
+            timeout=Duration.minutes(get_state_machine_timeout_mins(dag_job_schedule)),
+        )
+        add_execution_complete_rule(
+            self, rule_id="USGHGEmissionFactorDailyComplete", state_machine=comp_usghg_ef_sm
         )
 
         comp_usghg_emission_sm_name_parameter = ssm.StringParameter(  # noqa
@@ -86,3 +80,17 @@ class USGHGEmissionDailyPipeline(Stack):
             parameter_name="/pipeline/sm-usghg-emission-factor-daily",
             string_value=comp_usghg_ef_sm.state_machine_name,
         )
+        native_athena = has_runtime(dag_job_schedule, "athena")
+        if native_athena:
+            add_native_athena_statements(comp_usghg_ef_sm.role)
+
+        # Date range reprocessing over the same Glue jobs
+        create_backfill_state_machine(
+            self,
+            name="USGHGEmissionFactorDailyBackfill",
+            state_machine_parameter="/pipeline/sm-usghg-emission-factor-daily",
+            native_athena=native_athena,
+            build_definition=lambda scope: create_dag_chain(
+                scope, job_schedule=dag_job_schedule, name="daily-dag"
+            ),
+        )
@@ -13,14 +13,22 @@ import pipeline_stacks.usghgemission_monthly_config as u_cfg
 
 from constructs import Construct
 from pkg.glue_helpers import create_glue_job_cw_log_group
-from pkg.glue_step_helpers import (  # noqa
-    create_glue_step,
-    get_glue_steps,
-    create_parallel_snf_definition,
-)
 
-from pkg.common_policy import create_standard_glue_job_role
-from pkg.lambda_helpers import get_lambda_step
+from pkg.common_policy import (
+    add_native_athena_statements,
+    create_standard_glue_job_role,
+)
+from pkg.athena_helpers import create_pipeline_workgroup
+from pkg.backfill_helpers import create_backfill_state_machine
+from pkg.dag_helpers import (
+    create_dag_chain,
+    create_dag_glue_jobs,
+    create_dag_runner_job,
+    get_state_machine_timeout_mins,
+    has_runtime,
+)
+from pkg.lambda_helpers import add_execution_complete_rule, get_lambda_step
+from pkg.rollup_helpers import check_rollup_drift
 
 
 class USGHGEmissionMonthlyPipeline(Stack):
@@ -38,57 +46,84 @@ class USGHGEmissionMonthlyPipeline(Stack):
             scope=self, iam_role_name=ef_task_glue_job_role_name
         )
 
+        create_pipeline_workgroup(self, device_type=device_type)
+
         create_glue_job_cw_log_group(
             scope=self, job_name=device_type, role_name=ef_task_glue_job_role_name
         )
         
-        update_landing_partition_step = get_glue_steps(
+        # The rollup SQL uploaded to S3 must be the one generated from the config
+        check_rollup_drift(u_cfg.UTILITY_EMISSION_ROLLUP)
+
+        # Monthly and yearly rollups and audits ordered by their reads / writes
+        create_jobs = (
+            create_dag_runner_job if u_cfg.PIPELINE_RUNNER else create_dag_glue_jobs
+        )
+        dag_job_schedule = create_jobs(
             self,
-            pipeline_tasks=u_cfg.UPDATE_LANDING_PARTITION,
+            pipeline_tasks=u_cfg.UTILITY_EMISSION_MONTHLY + u_cfg.MONTHLY_AUDIT_TABLES,
             frequency="monthly",
             device_type=device_type,
             task_glue_job_role=ef_task_glue_job_role,
             pipeline_name=pipeline_name,
         )
+        usghg_definition = self.get_definition(
+            self, pipeline_name=pipeline_name, dag_job_schedule=dag_job_schedule
+        )
 
-        UTILITY_EMISSION_MONTHLY = get_glue_steps(
+        comp_usghg_ef_sm = sfn.StateMachine(
             self,
-            pipeline_tasks=u_cfg.UTILITY_EMISSION_MONTHLY,
-            frequency="monthly",
-            device_type=device_type,
-            task_glue_job_role=ef_task_glue_job_role,
-            pipeline_name=pipeline_name,
+            "USGHGEmissionFactorMonthlyWorkflow",
+            definition=usghg_definition,
+            timeout=Duration.minutes(get_state_machine_timeout_mins(dag_job_schedule)),
+        )
+        add_execution_complete_rule(
+            self, rule_id="USGHGEmissionFactorMonthlyComplete", state_machine=comp_usghg_ef_sm
         )
 
-        monthly_audit_branch_steps = get_glue_steps(
+        comp_usghg_emission_sm_name_parameter = ssm.StringParameter(  # noqa
             self,
-            pipeline_tasks=u_cfg.MONTHLY_AUDIT_TABLES,
-            frequency="monthly",
-            device_type=device_type,
-            task_glue_job_role=ef_task_glue_job_role,
-            pipeline_name=pipeline_name,
+            id="sm-usghg-emission-factor-monthly",
+            parameter_name="/pipeline/sm-usghg-emission-factor-monthly",
+            string_value=comp_usghg_ef_sm.state_machine_name,
         )
-        # Audit STEP DEFINITION
-        monthly_audit_parallel_definition = create_parallel_snf_definition(
-            self, steps=monthly_audit_branch_steps, name="monthly-audit"
+        native_athena = has_runtime(dag_job_schedule, "athena")
+        if native_athena:
+            add_native_athena_statements(comp_usghg_ef_sm.role)
+
+        # Date range reprocessing over the same Glue jobs
+        create_backfill_state_machine(
+            self,
+            name="USGHGEmissionFactorMonthlyBackfill",
+            state_machine_parameter="/pipeline/sm-usghg-emission-factor-monthly",
+            native_athena=native_athena,
+            build_definition=lambda scope: self.get_definition(
+                scope, pipeline_name=pipeline_name, dag_job_schedule=dag_job_schedule
+            ),
         )
+
+    @staticmethod
+    def get_definition(
+        scope: Construct, pipeline_name: str, dag_job_schedule: dict
+    ) -> sfn.Chain:
+        """Audit config generation, then the monthly DAG when $.monthly is true"""
         monthly_definition = sfn.Parallel(
-            self, "monthly-branch", result_path=JsonPath.DISCARD
+            scope, "monthly-branch", result_path=JsonPath.DISCARD
         ).branch(
-            sfn.Choice(self, "start monthly?", input_path="$")
+            sfn.Choice(scope, "start monthly?", input_path="$")
             .when(
                 sfn.Condition.string_equals("$.monthly", "true"),
-                next=sfn.Chain.start(UTILITY_EMISSION_MONTHLY)
-                .next(monthly_audit_parallel_definition)
+                next=create_dag_chain(
+                    scope, job_schedule=dag_job_schedule, name="monthly-dag"
+                ),
             )
-            .otherwise(sfn.Succeed(self, "monthly_skipped"))
+            .otherwise(sfn.Succeed(scope, "monthly_skipped"))
         )
 
-        usghg_definition = (
-            sfn.Chain.start(update_landing_partition_step)
-            .next(
+        return (
+            sfn.Chain.start(
                 get_lambda_step(
-                    self,
+                    scope,
                     pipeline_name=pipeline_name,
                     lambda_name=cf.AUDIT_CONFIG_GEN_LAMBDA_NAME,
                     frequency="daily_and_monthly",
@@ -97,23 +132,4 @@ class USGHGEmissionMonthlyPipeline(Stack):
             .next(
                 monthly_definition
                 )
-            .next(
-                get_lambda_step(
-                    self, lambda_name=cf.DONE_LAMBDA_NAME, frequency="monthly"
-                )
-            )
-        )
-
-        comp_usghg_ef_sm = sfn.StateMachine(
-            self,
-            "USGHGEmissionFactorMonthlyWorkflow",
-            definition=usghg_definition,
-            timeout=Duration.minutes(30),
-        )
-
-        comp_usghg_emission_sm_name_parameter = ssm.StringParameter(  # noqa
-            self,
-            id="sm-usghg-emission-factor-monthly",
-            parameter_name="/pipeline/sm-usghg-emission-factor-monthly",
-            string_value=comp_usghg_ef_sm.state_machine_name,
         )
@@ -1,17 +1,19 @@
+import config as cf
 from pipeline_stacks import pipeline_config as pipe_cfg
 
-UPDATE_LANDING_PARTITION = [
-    {
-        "db_name": pipe_cfg.LANDING_DB_ATTRIBUTES,
-        "tables": ["update_landing_partition"],
-        "function": "job",
-    }
-]
-
+# reads / writes are "<db>.<table>", {table} is the task table. The DAG
+# builder orders tasks on them, everything else runs in parallel
 UTILITY_EMISSION_DAILY = [
     {
         "db_name": pipe_cfg.PROCESSED_DB_ATTRIBUTES,
         "tables": ["utility_emissions_daily"],
         "function": "job",
+        "reads": [
+            f"{cf.LANDING_DB_NAME}.utility_data_in",
+            f"{cf.LANDING_DB_NAME}.utility_data_oh",
+        ],
+        "writes": [f"{cf.PROCESSED_DB_NAME}.{{table}}"],
+        # set-based backfills transform up to a month of exec_dates per run
+        "execution_profile": {"timeout_mins": 30},
     }
 ]
@@ -1,20 +1,43 @@
+import config as cf
 from pipeline_stacks import pipeline_config as pipe_cfg
+from pkg.rollup_helpers import get_rollup_tasks
 
-UPDATE_LANDING_PARTITION = [
-    {
-        "db_name": pipe_cfg.LANDING_DB_ATTRIBUTES,
-        "tables": ["update_landing_partition"],
-        "function": "job",
-    }
-]
+# Run the monthly transform and audits in one pipeline_runner Glue job, the
+# job start up, imports and downloads are paid once instead of per table
+PIPELINE_RUNNER = True
 
-UTILITY_EMISSION_MONTHLY = [
-    {
-        "db_name": pipe_cfg.PROCESSED_DB_ATTRIBUTES,
-        "tables": ["utility_emissions_monthly"],
-        "function": "job",
-    }
-]
+# Monthly and yearly emissions are rolled up from the daily processed table,
+# each grain from the one below it, instead of re-scanning the hourly landing
+# data. The SQL and DDL of the grains are generated, see rollup_sql_generator.py
+UTILITY_EMISSION_ROLLUP = {
+    "name": "UTILITY_EMISSION_ROLLUP",
+    "source": "utility_emissions_daily",
+    "source_grain": "record_date",
+    "measures": {"co2_ton_oh": "sum", "co2_ton_in": "sum"},
+    # Derived from the rolled up measures, never summed themselves
+    "derived": {"co2_ton_total": "co2_ton_oh + co2_ton_in"},
+    "measure_type": "float",
+    "grains": [
+        {
+            "table": "utility_emissions_monthly",
+            "column": "record_month",
+            "type": "string",
+            "expression": "date_format({parent}, '%Y%m')",
+        },
+        {
+            "table": "utility_emissions_yearly",
+            "column": "record_year",
+            "type": "string",
+            "expression": "substr({parent}, 1, 4)",
+        },
+    ],
+}
+
+# reads / writes are "<db>.<table>", {table} is the task table. The DAG
+# builder orders tasks on them, everything else runs in parallel
+UTILITY_EMISSION_MONTHLY = get_rollup_tasks(
+    UTILITY_EMISSION_ROLLUP, db_name=pipe_cfg.PROCESSED_DB_ATTRIBUTES
+)
 
 MONTHLY_AUDIT_TABLES = [
     {
@@ -24,6 +47,9 @@ MONTHLY_AUDIT_TABLES = [
             "utility_data_oh",
         ],
         "function": "audit",
+        "reads": [f"{cf.LANDING_DB_NAME}.{{table}}"],
+        # audit steps write their own partitions of the audit table
+        "writes": [],
     },
     {
         "db_name": pipe_cfg.EX_PROCESSED_TB_AUDIT_DB_ATTRIBUTES,
@@ -31,5 +57,7 @@ MONTHLY_AUDIT_TABLES = [
             "utility_emissions_monthly",
         ],
         "function": "audit",
+        "reads": [f"{cf.PROCESSED_DB_NAME}.{{table}}"],
+        "writes": [],
     },
 ]
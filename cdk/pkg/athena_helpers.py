@@ -0,0 +1,77 @@
+"""Athena workgroup helpers, one workgroup per pipeline"""
+from aws_cdk import (
+    aws_athena as athena,
+    aws_events as events,
+    aws_events_targets as targets,
+)
+from constructs import Construct
+
+import config as cf
+from pipeline_stacks import pipeline_config as pipe_cfg
+from pkg.lambda_helpers import get_lambda_object
+
+
+def get_athena_workgroup_name(device_type: str) -> str:
+    return f"apg-{device_type}-{cf.DEPLOYMENT_STAGE}".replace("_", "-")
+
+
+def add_query_state_rule(scope: Construct, device_type: str, workgroup_name: str) -> events.Rule:
+    """
+    Routes the terminal query states of the workgroup to the query state
+    lambda, queries of other workgroups are no callback runs
+    """
+    rule = events.Rule(
+        scope,
+        f"{device_type}-athena-query-state",
+        event_pattern=events.EventPattern(
+            source=["aws.athena"],
+            detail_type=["Athena Query State Change"],
+            detail={
+                "currentState": ["SUCCEEDED", "FAILED", "CANCELLED"],
+                "workgroupName": [workgroup_name],
+            },
+        ),
+    )
+    rule.add_target(
+        targets.LambdaFunction(
+            get_lambda_object(
+                scope=scope, pipeline_name="", lambda_name=cf.ATHENA_QUERY_STATE_LAMBDA_NAME
+            )
+        )
+    )
+    return rule
+
+
+def create_pipeline_workgroup(scope: Construct, device_type: str) -> athena.CfnWorkGroup:
+    """
+    Workgroup the executors of the pipeline query in, it isolates the
+    pipeline's cost and latency metrics and caps the bytes scanned per query.
+    The configuration is enforced, queries can not override the results
+    location or encryption.
+    """
+    workgroup_name = get_athena_workgroup_name(device_type)
+    workgroup_cfg = pipe_cfg.ATHENA_WORKGROUP
+    if cf.ATHENA_EXECUTOR_LAMBDA_ENABLED:
+        add_query_state_rule(scope, device_type=device_type, workgroup_name=workgroup_name)
+    return athena.CfnWorkGroup(
+        scope,
+        f"{device_type}-athena-workgroup",
+        name=workgroup_name,
+        description=f"Athena workgroup of the {device_type} pipeline",
+        state="ENABLED",
+        recursive_delete_option=True,
+        work_group_configuration=athena.CfnWorkGroup.WorkGroupConfigurationProperty(
+            bytes_scanned_cutoff_per_query=workgroup_cfg["bytes_scanned_cutoff_per_query"],
+            enforce_work_group_configuration=True,
+            publish_cloud_watch_metrics_enabled=True,
+            engine_version=athena.CfnWorkGroup.EngineVersionProperty(
+                selected_engine_version=workgroup_cfg["engine_version"]
+            ),
+            result_configuration=athena.CfnWorkGroup.ResultConfigurationProperty(
+                output_location=f"s3://{cf.S3_ATHENA_BUCKET}/{workgroup_name}/",
+                encryption_configuration=athena.CfnWorkGroup.EncryptionConfigurationProperty(
+                    encryption_option="SSE_S3"
+                ),
+            ),
+        ),
+    )
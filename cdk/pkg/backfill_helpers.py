@@ -0,0 +1,160 @@
+"""
+Backfill state machine of a pipeline.
+
+The input {"start_date": "YYYY-MM-DD", "end_date": "YYYY-MM-DD",
+"monthly": "auto", "set_based": "false"} is expanded by the backfill
+dates lambda into the trigger's input for every exec_date, or for every
+sub range of dates with set_based "true". A Distributed Map runs the pipeline
+chain for each of them, BACKFILL_MAX_CONCURRENCY at a time, and the per
+date results are summarised at the end.
+
+The expansion holds the exec_dates of the range in the execution ledger,
+or fails when one of them is in flight. Deliveries for held exec_dates are
+replayed once the execution completes, and a succeeded backfill starts the
+backfill of the depends_on pipelines over the same range ( input
+"dependents": "false" to opt out ).
+"""
+from typing import Callable
+
+from aws_cdk import (
+    aws_stepfunctions as sfn,
+    aws_stepfunctions_tasks as tasks,
+    aws_ssm as ssm,
+    Duration,
+)
+from aws_cdk.aws_stepfunctions import JsonPath
+from constructs import Construct
+
+import config as cf
+from pipeline_stacks import pipeline_config as pipe_cfg
+from pkg.common_policy import add_native_athena_statements
+from pkg.lambda_helpers import add_execution_complete_rule, get_lambda_object
+
+
+def get_backfill_lambda_step(
+    scope: Construct, name: str, payload: dict, result_path: str
+) -> tasks.LambdaInvoke:
+    return tasks.LambdaInvoke(
+        scope,
+        name,
+        lambda_function=get_lambda_object(
+            scope=scope, pipeline_name="", lambda_name=cf.BACKFILL_DATES_LAMBDA_NAME
+        ),
+        payload=sfn.TaskInput.from_object({"payload": payload}),
+        payload_response_only=True,
+        result_path=result_path,
+    )
+
+
+def create_backfill_date_definition(
+    scope: Construct, name: str, pipeline_definition: sfn.IChainable
+) -> sfn.Chain:
+    """Pipeline chain of one exec_date, failures become a result record"""
+    date_failed = sfn.Pass(
+        scope,
+        f"{name}-date-failed",
+        parameters={
+            "exec_date.$": "$.date",
+            "status": "FAILED",
+            "error.$": "$.error.Error",
+            "cause.$": "$.error.Cause",
+        },
+    )
+    date_succeeded = sfn.Pass(
+        scope,
+        f"{name}-date-succeeded",
+        parameters={"exec_date.$": "$.date", "status": "SUCCEEDED"},
+    )
+    run_date = (
+        sfn.Parallel(scope, f"{name}-date", result_path=JsonPath.DISCARD)
+        .branch(pipeline_definition)
+        .add_catch(date_failed, errors=[sfn.Errors.ALL], result_path="$.error")
+    )
+    return sfn.Chain.start(run_date).next(date_succeeded)
+
+
+def create_backfill_state_machine(
+    scope: Construct,
+    name: str,
+    state_machine_parameter: str,
+    build_definition: Callable[[Construct], sfn.IChainable],
+    native_athena: bool = False,
+) -> sfn.StateMachine:
+    """
+    build_definition creates the pipeline chain in the scope it is given,
+    it is called in a child scope so the steps of the pipeline's own state
+    machine are not reused, the Glue jobs are. native_athena grants the
+    lake access of Athena integration steps to the state machine role.
+    """
+    backfill_scope = Construct(scope, f"{name}-scope")
+
+    expand_dates = get_backfill_lambda_step(
+        backfill_scope,
+        name=f"{name}-expand-dates",
+        payload={
+            "state_machine_parameter": state_machine_parameter,
+            "execution": JsonPath.string_at("$$.Execution.Id"),
+            "backfill": JsonPath.object_at("$"),
+        },
+        result_path="$.backfill",
+    )
+
+    dates_map = sfn.DistributedMap(
+        backfill_scope,
+        f"{name}-dates",
+        items_path="$.backfill.dates",
+        max_concurrency=pipe_cfg.BACKFILL_MAX_CONCURRENCY,
+        result_path="$.results",
+    )
+    dates_map.item_processor(
+        create_backfill_date_definition(
+            backfill_scope,
+            name=name,
+            pipeline_definition=build_definition(backfill_scope),
+        )
+    )
+
+    summarize = get_backfill_lambda_step(
+        backfill_scope,
+        name=f"{name}-summary",
+        payload={"summarize": JsonPath.list_at("$.results")},
+        result_path="$.summary",
+    )
+
+    definition = (
+        sfn.Chain.start(expand_dates)
+        .next(dates_map)
+        .next(summarize)
+        .next(
+            sfn.Choice(backfill_scope, f"{name}-any-failed?")
+            .when(
+                sfn.Condition.number_greater_than("$.summary.failed_count", 0),
+                sfn.Fail(
+                    backfill_scope,
+                    f"{name}-failed",
+                    error="BackfillDatesFailed",
+                    cause="One or more exec_dates failed, see the summary step output",
+                ),
+            )
+            .otherwise(sfn.Succeed(backfill_scope, f"{name}-succeeded"))
+        )
+    )
+
+    backfill_sm = sfn.StateMachine(
+        scope,
+        name,
+        definition=definition,
+        timeout=Duration.hours(pipe_cfg.BACKFILL_TIMEOUT_HOURS),
+    )
+    if native_athena:
+        add_native_athena_statements(backfill_sm.role)
+    # Releases the held exec_dates whatever the execution's end
+    add_execution_complete_rule(scope, rule_id=f"{name}-complete", state_machine=backfill_sm)
+
+    ssm.StringParameter(
+        scope,
+        id=f"{name}-parameter",
+        parameter_name=f"{state_machine_parameter}-backfill",
+        string_value=backfill_sm.state_machine_name,
+    )
+    return backfill_sm
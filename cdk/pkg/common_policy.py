@@ -41,6 +41,9 @@ def attach_common_polices_to_role(scope: Construct, iam_role: Role) -> Role:
     iam_role.attach_inline_policy(
         glue_job_kms_perm(scope, "glue-catalog-kms-permissions")
     )
+    iam_role.attach_inline_policy(
+        athena_admission_perm(scope, "athena-admission-permissions")
+    )
 
 
 def athena_exec_perm(scope: Construct, id: str) -> Policy:
@@ -66,6 +69,29 @@ def athena_exec_perm(scope: Construct, id: str) -> Policy:
     )
 
 
+def athena_admission_perm(scope: Construct, id: str) -> Policy:
+    return Policy(
+        scope,
+        id=id,
+        policy_name=id,
+        document=iam.PolicyDocument(
+            statements=[
+                iam.PolicyStatement(
+                    effect=iam.Effect.ALLOW,
+                    actions=[
+                        "dynamodb:GetItem",
+                        "dynamodb:PutItem",
+                        "dynamodb:UpdateItem",
+                    ],
+                    resources=[
+                        f"arn:aws:dynamodb:{cf.REGION}:{cf.ACCOUNT}:table/{cf.ATHENA_ADMISSION_TABLE}"
+                    ],
+                )
+            ]
+        ),
+    )
+
+
 def glue_job_kms_perm(scope: Construct, id: str) -> Policy:
     def get_key_arn_list(ssm_param_stack_op_name_list: list) -> list:
         key_arn_list = []
@@ -204,3 +230,59 @@ def athena_query_results_bucket_perm(scope: Construct, id: str) -> Policy:
             ]
         ),
     )
+
+
+def add_native_athena_statements(iam_role: Role):
+    """
+    Athena service integration steps query with the state machine role,
+    it needs the lake data and partitions the Glue job role has
+    """
+    iam_role.add_to_principal_policy(
+        iam.PolicyStatement(
+            effect=iam.Effect.ALLOW,
+            actions=[
+                "s3:ListBucket",
+                "s3:GetBucketLocation",
+                "s3:GetObject",
+                "s3:PutObject",
+                "s3:DeleteObject",
+                "s3:AbortMultipartUpload",
+                "s3:ListMultipartUploadParts",
+            ],
+            resources=[
+                f"arn:aws:s3:::{cf.S3_LANDING_BUCKET}",
+                f"arn:aws:s3:::{cf.S3_LANDING_BUCKET}/*",
+                f"arn:aws:s3:::{cf.S3_PROCESSED_BUCKET}",
+                f"arn:aws:s3:::{cf.S3_PROCESSED_BUCKET}/*",
+                f"arn:aws:s3:::{cf.S3_ATHENA_BUCKET}",
+                f"arn:aws:s3:::{cf.S3_ATHENA_BUCKET}/*",
+            ],
+        )
+    )
+    iam_role.add_to_principal_policy(
+        iam.PolicyStatement(
+            effect=iam.Effect.ALLOW,
+            actions=[
+                "glue:GetDatabase",
+                "glue:GetTable",
+                "glue:GetPartition",
+                "glue:GetPartitions",
+                "glue:BatchGetPartition",
+                "glue:CreatePartition",
+                "glue:BatchCreatePartition",
+                "glue:UpdatePartition",
+            ],
+            resources=[
+                f"arn:aws:glue:{cf.REGION}:{cf.ACCOUNT}:catalog",
+                f"arn:aws:glue:{cf.REGION}:{cf.ACCOUNT}:database/*",
+                f"arn:aws:glue:{cf.REGION}:{cf.ACCOUNT}:table/*/*",
+            ],
+        )
+    )
+    iam_role.add_to_principal_policy(
+        iam.PolicyStatement(
+            effect=iam.Effect.ALLOW,
+            actions=["kms:Decrypt", "kms:Encrypt", "kms:GenerateDataKey"],
+            resources=[Fn.import_value(cf.GLUE_CATALOG_KEY_ARN)],
+        )
+    )
@@ -0,0 +1,401 @@
+"""
+Builds state machine definitions from pipeline task configs.
+
+Each task declares the tables it `reads` and `writes` as "<db>.<table>",
+with `{table}` standing for the task table the step is created for. A
+step depends on every other step writing a table it reads.
+
+The schedule is built by series-parallel decomposition of the DAG :
+independent groups of steps run as branches of a Parallel state, and
+inside a group the steps without upstream run first, followed by the
+schedule of the remaining steps. A step therefore starts as soon as its
+own upstream steps finished, not when a whole topological level did.
+The one exception is a join of several upstream steps, which also waits
+for the other upstream steps of its group. In runner mode every step
+runs the same pipeline_runner Glue job, filtered on the step's task.
+
+A schedule is a node ( leaf ), {"sequence": [schedules]} or
+{"parallel": [schedules]}.
+"""
+from aws_cdk import aws_stepfunctions as sfn
+from aws_cdk.aws_iam import Role
+from constructs import Construct
+
+from pipeline_stacks import pipeline_config as pipe_cfg
+from pkg.execution_profiles import get_execution_profile, get_worst_case_mins
+from pkg.glue_step_helpers import (
+    create_ef_glue_job,
+    create_executor_lambda_step,
+    create_glue_step,
+    create_native_athena_step,
+    create_runner_glue_job,
+    get_ef_job_arguments,
+    create_parallel_snf_definition,
+)
+
+SEQUENCE = "sequence"
+PARALLEL = "parallel"
+
+
+def get_dag_nodes(pipeline_tasks: list) -> list:
+    """
+    One node per (task, table), the unit a step is created for. Raises
+    ValueError on duplicate tasks and tables written by several tasks.
+    """
+    nodes = []
+    for task in pipeline_tasks:
+        for table in task["tables"]:
+            nodes.append(
+                {
+                    "id": f"{task['function']}-{table}",
+                    "task": task,
+                    "table": table,
+                    "reads": {r.format(table=table) for r in task.get("reads", [])},
+                    "writes": {w.format(table=table) for w in task.get("writes", [])},
+                }
+            )
+    ids = [node["id"] for node in nodes]
+    duplicates = sorted({i for i in ids if ids.count(i) > 1})
+    if duplicates:
+        raise ValueError(f"Duplicate pipeline tasks {duplicates}")
+    writers = {}
+    for node in nodes:
+        for table in node["writes"]:
+            writers.setdefault(table, []).append(node["id"])
+    # readers could not tell which write they depend on
+    duplicate_writers = {table: ids for table, ids in sorted(writers.items()) if len(ids) > 1}
+    if duplicate_writers:
+        raise ValueError(f"Tables written by several pipeline tasks {duplicate_writers}")
+    return nodes
+
+
+def get_dag_upstream(nodes: list) -> dict:
+    """node id ==> ids of the nodes writing a table it reads"""
+    return {
+        node["id"]: {
+            other["id"]
+            for other in nodes
+            if other["id"] != node["id"] and node["reads"] & other["writes"]
+        }
+        for node in nodes
+    }
+
+
+def get_dag_levels(nodes: list) -> list:
+    """
+    Kahn's algorithm, returning the nodes grouped by level. Raises
+    ValueError naming the tasks left on a cycle.
+    """
+    upstream = get_dag_upstream(nodes)
+    by_id = {node["id"]: node for node in nodes}
+    levels = []
+    done = set()
+    while len(done) < len(nodes):
+        level = [
+            node_id
+            for node_id in by_id
+            if node_id not in done and upstream[node_id] <= done
+        ]
+        if not level:
+            remaining = sorted(set(by_id) - done)
+            raise ValueError(f"Cycle in pipeline tasks, check reads/writes of {remaining}")
+        levels.append([by_id[node_id] for node_id in level])
+        done.update(level)
+    return levels
+
+
+def get_dag_components(node_ids: list, upstream: dict) -> list:
+    """Weakly connected groups of node_ids, in the order of node_ids"""
+    component_of = {node_id: {node_id} for node_id in node_ids}
+    for node_id in node_ids:
+        for other_id in upstream[node_id]:
+            if other_id in component_of and component_of[other_id] is not component_of[node_id]:
+                merged = component_of[node_id] | component_of[other_id]
+                for member in merged:
+                    component_of[member] = merged
+    components = []
+    for node_id in node_ids:
+        if not any(node_id in component for component in components):
+            components.append([i for i in node_ids if i in component_of[node_id]])
+    return components
+
+
+def get_node_schedule(node_ids: list, upstream: dict, by_id: dict) -> dict:
+    """Series-parallel schedule of node_ids, see the module docstring"""
+    components = get_dag_components(node_ids, upstream)
+    if len(components) > 1:
+        return {
+            PARALLEL: [
+                get_node_schedule(component, upstream, by_id) for component in components
+            ]
+        }
+    sources = [i for i in node_ids if not upstream[i] & set(node_ids)]
+    head = by_id[sources[0]] if len(sources) == 1 else {PARALLEL: [by_id[i] for i in sources]}
+    rest = [i for i in node_ids if i not in sources]
+    if not rest:
+        return head
+    tail = get_node_schedule(rest, upstream, by_id)
+    return {SEQUENCE: [head] + (tail[SEQUENCE] if SEQUENCE in tail else [tail])}
+
+
+def get_dag_schedule(nodes: list) -> dict:
+    """Schedule of the DAG nodes, raises ValueError on a cycle"""
+    get_dag_levels(nodes)
+    return get_node_schedule(
+        [node["id"] for node in nodes],
+        upstream=get_dag_upstream(nodes),
+        by_id={node["id"]: node for node in nodes},
+    )
+
+
+def map_schedule(schedule: dict, function) -> dict:
+    """Same schedule with function applied to every leaf"""
+    for key in (SEQUENCE, PARALLEL):
+        if key in schedule:
+            return {key: [map_schedule(child, function) for child in schedule[key]]}
+    return function(schedule)
+
+
+def get_schedule_leaves(schedule: dict) -> list:
+    for key in (SEQUENCE, PARALLEL):
+        if key in schedule:
+            return [leaf for child in schedule[key] for leaf in get_schedule_leaves(child)]
+    return [schedule]
+
+
+def create_dag_glue_jobs(
+        scope: Construct,
+        pipeline_tasks: list,
+        frequency: str,
+        device_type: str,
+        pipeline_name: str,
+        task_glue_job_role: Role,
+) -> dict:
+    """
+    Creates the Glue job of every glue runtime node, returns the DAG
+    schedule of {"job_name", "runtime", "retry"} jobs, with "timeout_mins",
+    "default_args", "table" and "db_name" for the other runtimes
+    """
+
+    def create_node_job(node: dict) -> dict:
+        task = node["task"]
+        execution_profile = get_execution_profile(task)
+        if execution_profile["runtime"] in ("lambda", "athena", "callback"):
+            job_name, default_args = get_ef_job_arguments(
+                pipeline_name=pipeline_name,
+                table_name=node["table"],
+                db_name=task["db_name"],
+                frequency=frequency,
+                job_type=task["function"],
+                device_type=device_type,
+                can_fetch_no_results=task.get("can_fetch_no_results", False),
+            )
+            return {
+                "job_name": job_name,
+                "runtime": execution_profile["runtime"],
+                "retry": execution_profile["retry"],
+                "timeout_mins": execution_profile["timeout_mins"],
+                "default_args": default_args,
+                "table": node["table"],
+                "db_name": task["db_name"],
+            }
+        ef_glue_job = create_ef_glue_job(
+            scope,
+            pipeline_name=pipeline_name,
+            table_name=node["table"],
+            db_name=task["db_name"],
+            frequency=frequency,
+            job_type=task["function"],
+            device_type=device_type,
+            task_glue_job_role=task_glue_job_role,
+            can_fetch_no_results=task.get("can_fetch_no_results", False),
+            execution_profile=execution_profile,
+        )
+        return {
+            "job_name": ef_glue_job.name,
+            "runtime": "glue",
+            "retry": execution_profile["retry"],
+            "timeout_mins": execution_profile["timeout_mins"],
+        }
+
+    return map_schedule(get_dag_schedule(get_dag_nodes(pipeline_tasks)), create_node_job)
+
+
+def create_dag_runner_job(
+        scope: Construct,
+        pipeline_tasks: list,
+        frequency: str,
+        device_type: str,
+        pipeline_name: str,
+        task_glue_job_role: Role,
+) -> dict:
+    """
+    Creates one pipeline_runner Glue job for every node, whatever its
+    runtime, and returns the DAG schedule of its runs filtered on a task.
+    The runner retries the task with its retry policy, Athena fatal errors
+    excepted, the step only retries the Glue errors of a run that did not
+    start.
+    """
+    nodes = get_dag_nodes(pipeline_tasks)
+    runner_tasks = []
+    extra_py_files = []
+    profiles = {}
+    for node in nodes:
+        task = node["task"]
+        execution_profile = get_execution_profile(task)
+        job_name, default_args = get_ef_job_arguments(
+            pipeline_name=pipeline_name,
+            table_name=node["table"],
+            db_name=task["db_name"],
+            frequency=frequency,
+            job_type=task["function"],
+            device_type=device_type,
+            can_fetch_no_results=task.get("can_fetch_no_results", False),
+        )
+        for py_file in default_args.pop("--extra-py-files").split(","):
+            if py_file and py_file not in extra_py_files:
+                extra_py_files.append(py_file)
+        runner_tasks.append(
+            {
+                "job_name": job_name,
+                # Glue arguments are strings, keep the same contract
+                "args": {name[2:]: str(value) for name, value in default_args.items()},
+                "retry": execution_profile["retry"],
+            }
+        )
+        profiles[node["id"]] = dict(execution_profile, job_name=job_name)
+
+    runner_profile = get_execution_profile({})
+    runner_profile.update(
+        {
+            "dpu": max(p["dpu"] for p in profiles.values()),
+            # a run is one task and its in-process retries
+            "timeout_mins": max(
+                get_worst_case_mins(p["timeout_mins"], p["retry"]) for p in profiles.values()
+            ),
+            # the parallel branches of a run start the job at once
+            "max_concurrent_runs": runner_profile["max_concurrent_runs"] * len(nodes),
+        }
+    )
+    runner_glue_job = create_runner_glue_job(
+        scope,
+        pipeline_name=pipeline_name,
+        device_type=device_type,
+        frequency=frequency,
+        runner_tasks=runner_tasks,
+        extra_py_files=extra_py_files,
+        task_glue_job_role=task_glue_job_role,
+        execution_profile=runner_profile,
+    )
+    return map_schedule(
+        get_dag_schedule(nodes),
+        lambda node: {
+            "job_name": profiles[node["id"]]["job_name"],
+            "runtime": "runner",
+            "runner_job_name": runner_glue_job.name,
+            "retry": runner_profile["retry"],
+            "timeout_mins": runner_profile["timeout_mins"],
+        },
+    )
+
+
+def create_job_step(scope: Construct, job: dict) -> sfn.IChainable:
+    if job["runtime"] in ("lambda", "callback"):
+        return create_executor_lambda_step(
+            scope,
+            job_name=job["job_name"],
+            default_args=job["default_args"],
+            retry=job["retry"],
+            callback=job["runtime"] == "callback",
+            timeout_mins=job["timeout_mins"],
+        )
+    if job["runtime"] == "athena":
+        return create_native_athena_step(
+            scope,
+            job_name=job["job_name"],
+            table_name=job["table"],
+            db_name=job["db_name"],
+            default_args=job["default_args"],
+            retry=job["retry"],
+        )
+    if job["runtime"] == "runner":
+        return create_glue_step(
+            scope,
+            glue_job_name=job["runner_job_name"],
+            retry=job["retry"],
+            step_name=job["job_name"],
+            arguments={"--task_filter": job["job_name"]},
+        )
+    return create_glue_step(scope, glue_job_name=job["job_name"], retry=job["retry"])
+
+
+def get_schedule_timeout_mins(job_schedule: dict) -> int:
+    """Worst case of the schedule, sequences add up and parallels wait for the longest"""
+    if SEQUENCE in job_schedule:
+        return sum(get_schedule_timeout_mins(child) for child in job_schedule[SEQUENCE])
+    if PARALLEL in job_schedule:
+        return max(get_schedule_timeout_mins(child) for child in job_schedule[PARALLEL])
+    if job_schedule["runtime"] in ("glue", "runner"):
+        # the step only retries runs that did not start
+        return job_schedule["timeout_mins"] + get_worst_case_mins(0, job_schedule["retry"])
+    return get_worst_case_mins(job_schedule["timeout_mins"], job_schedule["retry"])
+
+
+def get_state_machine_timeout_mins(job_schedule: dict) -> int:
+    return get_schedule_timeout_mins(job_schedule) + pipe_cfg.STATE_MACHINE_TIMEOUT_MARGIN_MINS
+
+
+def has_runtime(job_schedule: dict, runtime: str) -> bool:
+    return any(job["runtime"] == runtime for job in get_schedule_leaves(job_schedule))
+
+
+def create_dag_chain(scope: Construct, job_schedule: dict, name: str) -> sfn.Chain:
+    """
+    Chain of the job schedule, sequences chained and parallels as Parallel
+    states. Steps are created in scope, so the same jobs can be chained
+    again in another state machine under a different scope.
+    """
+    parallel_count = []
+
+    def create_schedule_chain(schedule: dict) -> sfn.Chain:
+        if SEQUENCE in schedule:
+            definition = None
+            for child in schedule[SEQUENCE]:
+                state = create_schedule_chain(child)
+                definition = (
+                    sfn.Chain.start(state) if definition is None else definition.next(state)
+                )
+            return definition
+        if PARALLEL in schedule:
+            parallel_count.append(schedule)
+            return sfn.Chain.start(
+                create_parallel_snf_definition(
+                    scope,
+                    steps=[create_schedule_chain(child) for child in schedule[PARALLEL]],
+                    name=f"{name}-parallel-{len(parallel_count) - 1}",
+                )
+            )
+        return sfn.Chain.start(create_job_step(scope, job=schedule))
+
+    return create_schedule_chain(job_schedule)
+
+
+def create_dag_definition(
+        scope: Construct,
+        pipeline_tasks: list,
+        frequency: str,
+        device_type: str,
+        pipeline_name: str,
+        task_glue_job_role: Role,
+        name: str,
+) -> sfn.Chain:
+    """Creates the jobs and returns their chain"""
+    job_schedule = create_dag_glue_jobs(
+        scope,
+        pipeline_tasks=pipeline_tasks,
+        frequency=frequency,
+        device_type=device_type,
+        pipeline_name=pipeline_name,
+        task_glue_job_role=task_glue_job_role,
+    )
+    return create_dag_chain(scope, job_schedule=job_schedule, name=name)
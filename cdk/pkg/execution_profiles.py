@@ -0,0 +1,71 @@
+"""
+Execution profiles of pipeline tasks.
+
+A task entry may carry an `execution_profile` overriding any key of
+pipeline_config.DEFAULT_EXECUTION_PROFILE, `retry` is merged key by key.
+Shared by the pipeline stacks and execution_profile_report.py.
+"""
+import copy
+import math
+
+import config as cf
+from pipeline_stacks import pipeline_config as pipe_cfg
+
+PYTHONSHELL_DPUS = (0.0625, 1)
+RUNTIMES = ("glue", "lambda", "athena", "callback")
+# Lambda maximum timeout
+LAMBDA_MAX_TIMEOUT_MINS = 15
+
+
+def get_execution_profile(task: dict) -> dict:
+    """Default profile with the task's overrides, raises ValueError when invalid"""
+    overrides = task.get("execution_profile", {})
+    profile = copy.deepcopy(pipe_cfg.DEFAULT_EXECUTION_PROFILE)
+    profile.update({k: v for k, v in overrides.items() if k != "retry"})
+    profile["retry"].update(overrides.get("retry", {}))
+
+    if profile["runtime"] not in RUNTIMES:
+        raise ValueError(f"runtime must be one of {RUNTIMES}, got {profile['runtime']}")
+    # The athena runtime purges the destination partitions with the executor lambda
+    if profile["runtime"] != "glue" and not cf.ATHENA_EXECUTOR_LAMBDA_ENABLED:
+        raise ValueError(
+            f"{profile['runtime']} runtime needs ATHENA_EXECUTOR_LAMBDA_ENABLED : {task}"
+        )
+    if profile["runtime"] == "lambda" and profile["timeout_mins"] > LAMBDA_MAX_TIMEOUT_MINS:
+        raise ValueError(
+            f"lambda runtime allows at most {LAMBDA_MAX_TIMEOUT_MINS} timeout_mins : {profile}"
+        )
+    if profile["runtime"] == "athena" and task.get("function") != "job":
+        raise ValueError(
+            f"athena runtime renders plain SQL, not {task.get('function')} tasks : {task}"
+        )
+    if profile["dpu"] not in PYTHONSHELL_DPUS:
+        raise ValueError(
+            f"pythonshell dpu must be one of {PYTHONSHELL_DPUS}, got {profile['dpu']}"
+        )
+    if profile["timeout_mins"] < 1 or profile["max_concurrent_runs"] < 1:
+        raise ValueError(f"timeout_mins and max_concurrent_runs must be >= 1 : {profile}")
+    if profile["retry"]["max_attempts"] < 0 or profile["retry"]["backoff_rate"] < 1:
+        raise ValueError(f"Invalid retry policy : {profile['retry']}")
+    return profile
+
+
+def get_worst_case_mins(timeout_mins: int, retry: dict) -> int:
+    """Every attempt running to its timeout, with the longest retry delays"""
+    delays = sum(
+        min(
+            retry["interval_seconds"] * retry["backoff_rate"] ** attempt,
+            retry["max_delay_seconds"],
+        )
+        for attempt in range(retry["max_attempts"])
+    )
+    return timeout_mins * (retry["max_attempts"] + 1) + math.ceil(delays / 60)
+
+
+def get_glue_job_name(
+    device_type: str, job_type: str, table_name: str, frequency: str
+) -> str:
+    # limit to 80 char length - glue limitation
+    return f"{device_type[:2]}{device_type[-2:]}-{job_type[:1]}-{table_name}-{frequency}"[
+        :75
+    ]
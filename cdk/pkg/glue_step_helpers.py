@@ -1,5 +1,6 @@
 import json
 import os
+import re
 
 from aws_cdk import aws_stepfunctions as sfn, aws_stepfunctions_tasks as tasks
 
@@ -7,29 +8,41 @@ from aws_cdk.aws_glue import CfnJob
 from aws_cdk.aws_iam import Role
 from aws_cdk.aws_logs import RetentionDays
 from aws_cdk.aws_stepfunctions import IntegrationPattern, JsonPath
-from aws_cdk.aws_stepfunctions_tasks import GlueStartJobRun
 from aws_cdk import Duration
 from constructs import Construct
+from jinja2 import StrictUndefined, UndefinedError
+from jinja2.environment import Environment
 
 import config as cf
 from pipeline_stacks import pipeline_config as pipe_cfg
-from pkg import glue_helpers
+from pkg import glue_helpers, lambda_helpers
+from pkg.athena_helpers import get_athena_workgroup_name
+from pkg.execution_profiles import get_execution_profile, get_glue_job_name
 
 PATH_COMMON_SRC = os.path.join(cf.PATH_SRC, "commons")
 ATHENA_QUERY_EXEC_PATH = os.path.join(PATH_COMMON_SRC, "execute_athena_query")
+# A quoted literal ( group 1, '' escapes a quote ) or a -- comment
+SQL_LITERAL_OR_COMMENT = r"('(?:[^']|'')*')|--[^\n]*"
+# exec_athena_query.py imports the admission controller next to it
+ATHENA_ADMISSION_S3_PATH = (
+    f"s3://{cf.S3_GLUE_ASSETS_BUCKET}/glue_job_scripts/"
+    f"{cf.S3_ATHENA_QUERY_FILE_NAME.replace('.py', '/')}{cf.S3_ATHENA_ADMISSION_FILE_NAME}"
+)
 
 
-def create_ef_glue_job(
-        scope: Construct,
+def get_ef_job_arguments(
         pipeline_name: str,
         device_type: str,
         table_name: str,
         db_name: dict,
         frequency: str,
         job_type: str,
-        task_glue_job_role: Role,
         can_fetch_no_results: bool,
-) -> CfnJob:
+) -> (str, dict):
+    """
+    Job name and default arguments of the athena executor, shared by the
+    Glue job and the executor lambda step of a task
+    """
     # DEFAULTS
     s3_sql_script_key = ""
     table_bucket = ""
@@ -37,7 +50,6 @@ def create_ef_glue_job(
     extra_py_files = ""
     dest_table_props = "{}"
     task_type = ""
-    ef_glue_job: CfnJob = None
 
     # exec_db logic
     if db_name["table_db"] == cf.LANDING_DB_NAME:
@@ -58,24 +70,20 @@ def create_ef_glue_job(
         # Logic for extra_py_files
         extra_py_files = (
             f"s3://{cf.S3_GLUE_ASSETS_BUCKET}/{pipe_cfg.JINJA2_WHL_S3_PREFIX},"
-            f"s3://{cf.S3_GLUE_ASSETS_BUCKET}/{pipe_cfg.WRANGLER_WHL_S3_PREFIX}"
+            f"s3://{cf.S3_GLUE_ASSETS_BUCKET}/{pipe_cfg.WRANGLER_WHL_S3_PREFIX},"
+            f"{ATHENA_ADMISSION_S3_PATH}"
         )
         table_partition = {"exec_date": ""}
 
-        dest_table_props = (
-            "{}"
-            if table_name
-            in ("update_landing_partition", "yearly_update_landing_partition")
-            else json.dumps(
-                {
-                    "table_name": table_name,
-                    "overwrite_data": "yes",
-                    "table_bucket": table_bucket,
-                    "table_db": db_name["table_db"],
-                    "table_partition": table_partition,
-                    "compact_sql_result_parquets": "yes"
-                }
-            )
+        dest_table_props = json.dumps(
+            {
+                "table_name": table_name,
+                "overwrite_data": "yes",
+                "table_bucket": table_bucket,
+                "table_db": db_name["table_db"],
+                "table_partition": table_partition,
+                "compact_sql_result_parquets": "yes"
+            }
         )
 
         # logic for task_type
@@ -98,7 +106,8 @@ def create_ef_glue_job(
         extra_py_files = (
             f"s3://{cf.S3_GLUE_ASSETS_BUCKET}/{pipe_cfg.JINJA2_WHL_S3_PREFIX},"
             f"s3://{cf.S3_GLUE_ASSETS_BUCKET}/{pipe_cfg.WRANGLER_WHL_S3_PREFIX},"
-            f"s3://{cf.S3_GLUE_ASSETS_BUCKET}/j2-macros/audit.jinja2"
+            f"s3://{cf.S3_GLUE_ASSETS_BUCKET}/j2-macros/audit.jinja2,"
+            f"{ATHENA_ADMISSION_S3_PATH}"
         )
 
         # logic for dest_table_props
@@ -121,79 +130,308 @@ def create_ef_glue_job(
         # logic for task_type
         task_type = "audit"
 
-    # logic for  job_max_concurrent_runs
-    job_max_concurrent_runs = 1
+    job_name = get_glue_job_name(
+        device_type=device_type,
+        job_type=job_type,
+        table_name=table_name,
+        frequency=frequency,
+    )
+
+    default_args = {
+        "--s3_glue_asset_bucket": cf.S3_GLUE_ASSETS_BUCKET,
+        "--s3_sql_script_key": s3_sql_script_key,
+        "--s3_sql_script_param_key": s3_sql_script_param_key,
+        "--glue_runtime_sql_params": '{"exec_date":""}',
+        "--glue_dest_table_props": dest_table_props,
+        "--param_execution_date": "",
+        "--glue_execution_db": db_name["exec_db"],
+        "--extra-py-files": extra_py_files,
+        "--pipeline_name": pipeline_name,
+        "--glue_job_name": job_name,
+        "--task_type": task_type,
+        "--step_execution_id": "default-exec-id",
+        "--start_dttm": "default-dttm",
+        "--can_fetch_no_results": can_fetch_no_results,
+        "--athena_admission_table": cf.ATHENA_ADMISSION_TABLE,
+        "--athena_admission_slots": str(pipe_cfg.ATHENA_ADMISSION_SLOTS),
+        "--athena_workgroup": get_athena_workgroup_name(device_type),
+        "--athena_result_reuse_max_age_mins": str(
+            pipe_cfg.ATHENA_WORKGROUP["result_reuse_max_age_mins"]
+        ),
+    }
+    return job_name, default_args
+
+
+def create_ef_glue_job(
+        scope: Construct,
+        pipeline_name: str,
+        device_type: str,
+        table_name: str,
+        db_name: dict,
+        frequency: str,
+        job_type: str,
+        task_glue_job_role: Role,
+        can_fetch_no_results: bool,
+        execution_profile: dict = None,
+) -> CfnJob:
+    job_name, default_args = get_ef_job_arguments(
+        pipeline_name=pipeline_name,
+        device_type=device_type,
+        table_name=table_name,
+        db_name=db_name,
+        frequency=frequency,
+        job_type=job_type,
+        can_fetch_no_results=can_fetch_no_results,
+    )
 
-    job_name = (
-        f"{device_type[:2]}{device_type[-2:]}-{job_type[:1]}-{table_name}-{frequency}"[
-            :75
-        ]
-    )  # limit to 80 char length - glue limitation
+    # logic for dpu, timeout and job_max_concurrent_runs
+    # Normal runs stay serial through the execution ledger, backfills do not
+    if execution_profile is None:
+        execution_profile = get_execution_profile({})
 
     script_name = cf.S3_ATHENA_QUERY_FILE_NAME
     file_prefix = script_name.replace(".py", "/")
     ef_glue_job, _ = glue_helpers.create_glue_job(
         scope,
         job_name=job_name,
-        timeout_mins=15,
-        max_concurrent_runs=job_max_concurrent_runs,
+        timeout_mins=execution_profile["timeout_mins"],
+        max_concurrent_runs=execution_profile["max_concurrent_runs"],
         job_type="pythonshell",
-        default_args={
-            "--s3_glue_asset_bucket": cf.S3_GLUE_ASSETS_BUCKET,
-            "--s3_sql_script_key": s3_sql_script_key,
-            "--s3_sql_script_param_key": s3_sql_script_param_key,
-            "--glue_runtime_sql_params": '{"exec_date":""}',
-            "--glue_dest_table_props": dest_table_props,
-            "--param_execution_date": "",
-            "--glue_execution_db": db_name["exec_db"],
-            "--extra-py-files": extra_py_files,
-            "--pipeline_name": pipeline_name,
-            "--glue_job_name": job_name,
-            "--task_type": task_type,
-            "--step_execution_id": "default-exec-id",
-            "--start_dttm": "default-dttm",
-            "--can_fetch_no_results": can_fetch_no_results,
-        },
+        default_args=default_args,
         reuse_iam_role=True,
         glue_job_iam_role=task_glue_job_role,
         scripts_source_bucket_name=cf.S3_GLUE_ASSETS_BUCKET,
-        pythonshell_dpu=0.0625,
+        pythonshell_dpu=execution_profile["dpu"],
         script_name=script_name,
         file_prefix=file_prefix,
     )
     return ef_glue_job
 
 
-def get_glue_steps(
+def create_runner_glue_job(
         scope: Construct,
-        pipeline_tasks: list,
-        frequency: str,
-        device_type: str,
         pipeline_name: str,
+        device_type: str,
+        frequency: str,
+        runner_tasks: list,
+        extra_py_files: list,
         task_glue_job_role: Role,
-) -> (list[tasks.GlueStartJobRun], tasks.GlueStartJobRun):
-    stage_steps = []
-    ef_glue_step: GlueStartJobRun = None
-    for task in pipeline_tasks:
-        for table in task["tables"]:
-            ef_glue_job = create_ef_glue_job(
-                scope,
-                pipeline_name=pipeline_name,
-                table_name=table,
-                db_name=task["db_name"],
-                frequency=frequency,
-                job_type=task["function"],
-                device_type=device_type,
-                task_glue_job_role=task_glue_job_role,
-                can_fetch_no_results=task['can_fetch_no_results'] if 'can_fetch_no_results' in task.keys() else False
-            )
-            ef_glue_step = create_glue_step(
-                scope, glue_job_name=ef_glue_job.name
-            )  # noqa
-            stage_steps.append(ef_glue_step)
-
-    return_step = ef_glue_step if len(stage_steps) == 1 else stage_steps
-    return return_step
+        execution_profile: dict,
+) -> CfnJob:
+    """
+    pipeline_runner job running one of runner_tasks per run, the one named
+    by --task_filter. Every task carries the executor arguments of its own
+    job without the leading "--".
+    """
+    job_name = get_glue_job_name(
+        device_type=device_type, job_type="runner", table_name="pipeline", frequency=frequency
+    )
+    executor_file_prefix = cf.S3_ATHENA_QUERY_FILE_NAME.replace(".py", "/")
+    default_args = {
+        "--pipeline_tasks": json.dumps(runner_tasks),
+        "--task_filter": "",
+        "--s3_glue_asset_bucket": cf.S3_GLUE_ASSETS_BUCKET,
+        "--glue_runtime_sql_params": '{"exec_date":""}',
+        "--param_execution_date": "",
+        "--pipeline_name": pipeline_name,
+        "--glue_job_name": job_name,
+        "--step_execution_id": "default-exec-id",
+        "--start_dttm": "default-dttm",
+        # the runner imports the executor from its extra py files
+        "--extra-py-files": ",".join(
+            extra_py_files
+            + [
+                f"s3://{cf.S3_GLUE_ASSETS_BUCKET}/glue_job_scripts/"
+                f"{executor_file_prefix}{cf.S3_ATHENA_QUERY_FILE_NAME}"
+            ]
+        ),
+    }
+
+    script_name = cf.S3_PIPELINE_RUNNER_FILE_NAME
+    runner_glue_job, _ = glue_helpers.create_glue_job(
+        scope,
+        job_name=job_name,
+        timeout_mins=execution_profile["timeout_mins"],
+        max_concurrent_runs=execution_profile["max_concurrent_runs"],
+        job_type="pythonshell",
+        default_args=default_args,
+        reuse_iam_role=True,
+        glue_job_iam_role=task_glue_job_role,
+        scripts_source_bucket_name=cf.S3_GLUE_ASSETS_BUCKET,
+        pythonshell_dpu=execution_profile["dpu"],
+        script_name=script_name,
+        file_prefix=script_name.replace(".py", "/"),
+    )
+    return runner_glue_job
+
+
+def create_executor_lambda_step(
+        scope: Construct,
+        job_name: str,
+        default_args: dict,
+        retry: dict = None,
+        purge_only: bool = False,
+        callback: bool = False,
+        timeout_mins: int = None,
+) -> tasks.LambdaInvoke:
+    """
+    Runs the task in the athena executor lambda, the payload carries the
+    Glue job arguments without the leading "--". purge_only deletes the
+    destination partitions without running the SQL. callback submits the
+    SQL with the task token and the step waits, up to timeout_mins, for the
+    query state change handler to resume it.
+    """
+    payload = {
+        name[2:]: value
+        for name, value in default_args.items()
+        if name != "--extra-py-files"
+    }
+    payload.update(
+        {
+            "param_execution_date": JsonPath.string_at("$.date"),
+            "pipeline_type": JsonPath.string_at("$.pipeline_type"),
+            "glue_runtime_sql_params": JsonPath.string_at("$.glue_runtime_sql_params"),
+            "step_execution_id": JsonPath.string_at("$$.Execution.Id"),
+            "start_dttm": JsonPath.string_at("$.start_dttm"),
+            "env": JsonPath.string_at("$.env"),
+            # Glue arguments are strings, keep the same contract
+            "can_fetch_no_results": str(default_args["--can_fetch_no_results"]),
+            "purge_only": str(purge_only).lower(),
+        }
+    )
+    if callback:
+        payload["callback_task_token"] = JsonPath.task_token
+    return lambda_helpers.get_lambda_step(
+        scope,
+        lambda_name=cf.ATHENA_EXECUTOR_LAMBDA_NAME,
+        frequency="",
+        step_name=f"{job_name}-purge" if purge_only else f"{job_name}-step",
+        payload=sfn.TaskInput.from_object({"payload": payload}),
+        retry=retry,
+        integration_pattern=(
+            IntegrationPattern.WAIT_FOR_TASK_TOKEN
+            if callback
+            else IntegrationPattern.REQUEST_RESPONSE
+        ),
+        timeout_mins=timeout_mins,
+        no_retry_errors=[pipe_cfg.ATHENA_FATAL_ERROR],
+    )
+
+
+def get_native_athena_query(table_name: str) -> JsonPath:
+    """
+    SQL of a data-transform task rendered at synth time, the pipeline
+    constants are substituted and the exec_date parameters become
+    States.Format placeholders on the $.athena_range of the step input.
+    Jinja blocks are rendered for a full recompute, the incremental
+    parameters of the run are not available to the step.
+    """
+    sql_path = os.path.join(ATHENA_QUERY_EXEC_PATH, "scripts", "usghgemission", f"{table_name}.sql")
+    with open(sql_path) as sql_file:
+        sql = sql_file.read()
+
+    constants = {
+        "param_landing_db_name": cf.LANDING_DB_NAME,
+        "param_processed_db_name": cf.PROCESSED_DB_NAME,
+        "param_s3_landing_bucket_name": cf.S3_LANDING_BUCKET,
+    }
+    runtime_params = {
+        "param_execution_date": "$.date",
+        "param_execution_start_date": "$.athena_range.range.param_execution_start_date",
+        "param_execution_end_date": "$.athena_range.range.param_execution_end_date",
+    }
+    # the {{ param }} placeholders are left in place for substitute
+    try:
+        sql = Environment(undefined=StrictUndefined).from_string(sql).render(  # nosec
+            param_incremental_source_exec_date="",
+            param_changed_periods=[],
+            **{name: "{{ " + name + " }}" for name in {**constants, **runtime_params}},
+        )
+    except UndefinedError as ex:
+        raise ValueError(f"{sql_path} : {ex} , can not be rendered for the athena runtime")
+    # States.Format strings are single line, a -- comment would run to the end
+    sql = re.sub(SQL_LITERAL_OR_COMMENT, lambda match: match.group(1) or "", sql)
+    sql = sql.strip().rstrip(";").strip()
+    if ";" in re.sub(SQL_LITERAL_OR_COMMENT, "", sql):
+        raise ValueError(f"{sql_path} : athena runtime runs a single statement")
+    values = []
+
+    def substitute(match) -> str:
+        name = match.group(1)
+        if name in constants:
+            return constants[name]
+        if name in runtime_params:
+            values.append(JsonPath.string_at(runtime_params[name]))
+            return "{}"
+        raise ValueError(f"{sql_path} : {name} can not be rendered for the athena runtime")
+
+    sql = re.sub(r"\s*\n\s*", " ", sql)
+    sql = re.sub(r"{{\s*(\w+)\s*}}", substitute, sql)
+    return JsonPath.format(sql, *values)
+
+
+def create_native_athena_step(
+        scope: Construct,
+        job_name: str,
+        table_name: str,
+        db_name: dict,
+        default_args: dict,
+        retry: dict = None,
+) -> sfn.Parallel:
+    """
+    Partition purge in the executor lambda, then the SQL through the
+    Athena service integration, no job or function runs the query. The
+    steps run in a Parallel so $.athena_range does not leak downstream.
+    """
+    if retry is None:
+        retry = pipe_cfg.DEFAULT_EXECUTION_PROFILE["retry"]
+    purge_step = create_executor_lambda_step(
+        scope, job_name=job_name, default_args=default_args, retry=retry, purge_only=True
+    )
+    # Single exec_date runs are a range of one, set-based runs override it
+    range_defaults = sfn.Pass(
+        scope,
+        f"{job_name}-range-defaults",
+        parameters={
+            "param_execution_start_date.$": "$.date",
+            "param_execution_end_date.$": "$.date",
+        },
+        result_path="$.athena_range",
+    )
+    range_step = sfn.Pass(
+        scope,
+        f"{job_name}-range",
+        parameters={
+            "range.$": "States.JsonMerge($.athena_range, "
+            "States.StringToJson($.glue_runtime_sql_params), false)"
+        },
+        result_path="$.athena_range",
+    )
+    query_step = tasks.AthenaStartQueryExecution(
+        scope,
+        f"{job_name}-step",
+        query_string=get_native_athena_query(table_name=table_name),
+        query_execution_context=tasks.QueryExecutionContext(
+            database_name=db_name["exec_db"]
+        ),
+        # results location and encryption come from the pipeline workgroup
+        work_group=default_args["--athena_workgroup"],
+        integration_pattern=IntegrationPattern.RUN_JOB,
+        result_path=JsonPath.DISCARD,
+    )
+    # a failed query is not retried, its partial output is only purged by
+    # the step before it
+    query_step.add_retry(
+        max_attempts=retry["max_attempts"],
+        interval=Duration.seconds(retry["interval_seconds"]),
+        backoff_rate=retry["backoff_rate"],
+        max_delay=Duration.seconds(retry["max_delay_seconds"]),
+        jitter_strategy=sfn.JitterType.FULL if retry["jitter"] else sfn.JitterType.NONE,
+        errors=pipe_cfg.ATHENA_SUBMISSION_ERRORS,
+    )
+    return sfn.Parallel(scope, f"{job_name}-athena", result_path=JsonPath.DISCARD).branch(
+        sfn.Chain.start(purge_step).next(range_defaults).next(range_step).next(query_step)
+    )
 
 
 def create_parallel_snf_definition(
@@ -206,11 +444,20 @@ def create_parallel_snf_definition(
 
 
 def create_glue_step(
-        scope: Construct, glue_job_name: str
+        scope: Construct,
+        glue_job_name: str,
+        retry: dict = None,
+        step_name: str = None,
+        arguments: dict = None,
 ) -> tasks.GlueStartJobRun:  # noqa
+    """
+    step_name defaults to the job name, arguments are added to the run
+    arguments. Only the Glue errors of a run that did not start are
+    retried, the job retries a failed task itself.
+    """
     glue_step = tasks.GlueStartJobRun(
         scope,
-        f"{glue_job_name}-step",
+        f"{step_name or glue_job_name}-step",
         glue_job_name=glue_job_name,
         integration_pattern=IntegrationPattern.RUN_JOB,
         arguments=sfn.TaskInput.from_object(
@@ -221,14 +468,19 @@ def create_glue_step(
                 "--step_execution_id.$": "$$.Execution.Id",
                 "--start_dttm.$": "$.start_dttm",
                 "--env.$": "$.env",
+                **(arguments or {}),
             }
         ),
         result_path=JsonPath.DISCARD,
     )
-    errors = sfn.Errors()
+    if retry is None:
+        retry = pipe_cfg.DEFAULT_EXECUTION_PROFILE["retry"]
     glue_step = glue_step.add_retry(
-        max_attempts=pipe_cfg.GLUE_TASK_RETRY,
-        interval=Duration.seconds(pipe_cfg.WAITING_TIME_BEFORE_RETRY),
-        errors=[errors.ALL],  # noqa
+        max_attempts=retry["max_attempts"],
+        interval=Duration.seconds(retry["interval_seconds"]),
+        backoff_rate=retry["backoff_rate"],
+        max_delay=Duration.seconds(retry["max_delay_seconds"]),
+        jitter_strategy=sfn.JitterType.FULL if retry["jitter"] else sfn.JitterType.NONE,
+        errors=pipe_cfg.GLUE_SERVICE_ERRORS,
     )
     return glue_step
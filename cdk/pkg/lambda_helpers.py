@@ -1,6 +1,8 @@
 import subprocess as sp  # nosec
 import os
 from aws_cdk import (
+    aws_events as events,
+    aws_events_targets as targets,
     aws_lambda as lambda_,
     aws_stepfunctions as sfn,
     aws_stepfunctions_tasks as tasks,
@@ -39,15 +41,47 @@ def create_layer(
 def get_lambda_object(
     scope: Construct, pipeline_name: str, lambda_name: str
 ) -> IFunction:
-    lambda_object = lambda_.Function.from_function_arn(
+    object_id = lambda_name if pipeline_name == "" else f"{pipeline_name}-{lambda_name}"
+    # Several steps of a scope may invoke the same lambda
+    lambda_object = scope.node.try_find_child(object_id)
+    if lambda_object is None:
+        lambda_object = lambda_.Function.from_function_arn(
+            scope,
+            id=object_id,
+            function_arn=f"arn:aws:lambda:{cf.REGION}:{cf.ACCOUNT}:"
+            f"function:{lambda_name}",
+        )
+    return lambda_object
+
+
+def add_execution_complete_rule(
+    scope: Construct, rule_id: str, state_machine: sfn.IStateMachine
+) -> events.Rule:
+    """
+    Routes the terminal execution states of a pipeline state machine to the
+    execution complete lambda, executions of other state machines are not
+    ledger runs
+    """
+    rule = events.Rule(
         scope,
-        id=lambda_name
-        if pipeline_name == ""
-        else f"{pipeline_name}-{lambda_name}",  # noqa
-        function_arn=f"arn:aws:lambda:{cf.REGION}:{cf.ACCOUNT}:"
-        f"function:{lambda_name}",
+        rule_id,
+        event_pattern=events.EventPattern(
+            source=["aws.states"],
+            detail_type=["Step Functions Execution Status Change"],
+            detail={
+                "status": ["SUCCEEDED", "FAILED", "TIMED_OUT", "ABORTED"],
+                "stateMachineArn": [state_machine.state_machine_arn],
+            },
+        ),
     )
-    return lambda_object
+    rule.add_target(
+        targets.LambdaFunction(
+            get_lambda_object(
+                scope=scope, pipeline_name="", lambda_name=cf.EXECUTION_COMPLETE_LAMBDA_NAME
+            )
+        )
+    )
+    return rule
 
 
 def get_lambda_payload(
@@ -83,28 +117,54 @@ def get_lambda_payload(
 
 
 def get_lambda_step(
-    scope: Construct, lambda_name: str, frequency: str, pipeline_name: str = ""
+    scope: Construct,
+    lambda_name: str,
+    frequency: str,
+    pipeline_name: str = "",
+    payload: TaskInput = None,
+    retry: dict = None,
+    step_name: str = None,
+    integration_pattern: sfn.IntegrationPattern = sfn.IntegrationPattern.REQUEST_RESPONSE,
+    timeout_mins: int = None,
+    no_retry_errors: list = None,
 ) -> LambdaInvoke:
     lambda_object = get_lambda_object(
         scope=scope, pipeline_name=pipeline_name, lambda_name=lambda_name
     )
-    lambda_payload = get_lambda_payload(
+    lambda_payload = payload or get_lambda_payload(
         frequency=frequency,
         lambda_name=lambda_name,
         pipeline_name=pipeline_name,  # noqa
     )
     landing_step = tasks.LambdaInvoke(
         scope,
-        f"{frequency}-{lambda_name}",
+        step_name or f"{frequency}-{lambda_name}",
         lambda_function=lambda_object,
         payload=lambda_payload,
         result_path=JsonPath.DISCARD,
         retry_on_service_exceptions=False,
+        integration_pattern=integration_pattern,
+        task_timeout=(
+            sfn.Timeout.duration(Duration.minutes(timeout_mins)) if timeout_mins else None
+        ),
     )
     errors = sfn.Errors()
-    landing_step = landing_step.add_retry(
-        max_attempts=pcfg.LAMBDA_TASK_RETRY,
-        interval=Duration.seconds(pcfg.WAITING_TIME_BEFORE_RETRY),
-        errors=[errors.ALL],  # noqa
-    )
+    # Retriers apply in order, States.ALL comes last
+    for error in no_retry_errors or []:
+        landing_step = landing_step.add_retry(max_attempts=0, errors=[error])
+    if retry is None:
+        landing_step = landing_step.add_retry(
+            max_attempts=pcfg.LAMBDA_TASK_RETRY,
+            interval=Duration.seconds(pcfg.WAITING_TIME_BEFORE_RETRY),
+            errors=[errors.ALL],  # noqa
+        )
+    else:
+        landing_step = landing_step.add_retry(
+            max_attempts=retry["max_attempts"],
+            interval=Duration.seconds(retry["interval_seconds"]),
+            backoff_rate=retry["backoff_rate"],
+            max_delay=Duration.seconds(retry["max_delay_seconds"]),
+            jitter_strategy=sfn.JitterType.FULL if retry["jitter"] else sfn.JitterType.NONE,
+            errors=[errors.ALL],  # noqa
+        )
     return landing_step
@@ -0,0 +1,135 @@
+"""
+Rollups of a processed table along a grain hierarchy.
+
+A rollup declares the source table and its grain column, the additive
+measures, the measures derived from them and the grains above the source,
+each grain aggregating the one before it ( daily ==> monthly ==> yearly ).
+The insert SQL and the DDL of every grain are generated from the
+declaration by rollup_sql_generator.py and committed; the pipeline stacks
+fail the synth when the committed files drifted from the declaration.
+"""
+import os
+
+import config as cf
+
+GENERATED_HEADER = "-- Generated by cdk/rollup_sql_generator.py from {name}, do not edit"
+ROLLUP_SCRIPTS_PATH = os.path.join(
+    cf.PATH_SRC, "commons", "execute_athena_query", "scripts", "usghgemission"
+)
+ROLLUP_DDL_PATH = os.path.join(cf.PATH_ROOT, "ddl", "processed")
+# DDL files are written for the dev stage, same as the other ddl/ files
+DDL_PROCESSED_DB_NAME = "processed_db_dev"
+DDL_PROCESSED_BUCKET = "apg-processed-$CDK_DEFAULT_ACCOUNT-dev"
+
+
+def get_rollup_levels(rollup: dict) -> list:
+    """(parent table, parent grain column, grain) of every grain, lowest first"""
+    levels = []
+    parent_table, parent_column = rollup["source"], rollup["source_grain"]
+    for grain in rollup["grains"]:
+        levels.append((parent_table, parent_column, grain))
+        parent_table, parent_column = grain["table"], grain["column"]
+    return levels
+
+
+def get_rollup_tasks(rollup: dict, db_name: dict) -> list:
+    """Pipeline tasks of the grains, each reads the grain below it"""
+    return [
+        {
+            "db_name": db_name,
+            "tables": [grain["table"]],
+            "function": "job",
+            "reads": [f"{cf.PROCESSED_DB_NAME}.{parent_table}"],
+            "writes": [f"{cf.PROCESSED_DB_NAME}.{{table}}"],
+            "execution_profile": rollup.get("execution_profile", {}),
+        }
+        for parent_table, _, grain in get_rollup_levels(rollup)
+    ]
+
+
+def get_rollup_sql(rollup: dict, parent_table: str, parent_column: str, grain: dict) -> str:
+    """Insert of the grain from its parent, columns in the order of the DDL"""
+    grain_expression = grain["expression"].format(parent=parent_column)
+    aggregates = "".join(
+        f",\n\t\t{function}({measure}) as {measure}"
+        for measure, function in rollup["measures"].items()
+    )
+    derived = "".join(
+        f"\n\t({expression}) as {measure},"
+        for measure, expression in rollup.get("derived", {}).items()
+    )
+    measures = "".join(f"\n\t{measure}," for measure in rollup["measures"])
+    return (
+        f"{GENERATED_HEADER.format(name=rollup['name'])}\n"
+        f"insert into {{{{ param_processed_db_name }}}}.{grain['table']}\n"
+        f"with rolled_up as (\n"
+        f"\tselect exec_date,\n"
+        f"\t\t{grain_expression} as {grain['column']}{aggregates}\n"
+        f"\tfrom {{{{ param_processed_db_name }}}}.{parent_table}\n"
+        f"\twhere exec_date between date('{{{{ param_execution_start_date }}}}')\n"
+        f"\t\tand date('{{{{ param_execution_end_date }}}}')\n"
+        f"\tgroup by 1, 2\n"
+        f")\n"
+        f"select {grain['column']},{measures}{derived}\n"
+        f"\texec_date\n"
+        f"from rolled_up\n"
+    )
+
+
+def get_rollup_ddl(rollup: dict, grain: dict) -> str:
+    columns = [(grain["column"], grain["type"])] + [
+        (measure, rollup["measure_type"])
+        for measure in list(rollup["measures"]) + list(rollup.get("derived", {}))
+    ]
+    column_ddl = ",\n".join(f"  {name} {column_type}" for name, column_type in columns)
+    return (
+        f"{GENERATED_HEADER.format(name=rollup['name'])}\n"
+        f"CREATE EXTERNAL TABLE {DDL_PROCESSED_DB_NAME}.{grain['table']}(\n"
+        f"{column_ddl})\n"
+        f"  PARTITIONED BY (\n"
+        f"  exec_date date)\n"
+        f"ROW FORMAT SERDE \n"
+        f"  'org.apache.hadoop.hive.ql.io.parquet.serde.ParquetHiveSerDe' \n"
+        f"STORED AS INPUTFORMAT \n"
+        f"  'org.apache.hadoop.hive.ql.io.parquet.MapredParquetInputFormat' \n"
+        f"OUTPUTFORMAT \n"
+        f"  'org.apache.hadoop.hive.ql.io.parquet.MapredParquetOutputFormat'\n"
+        f"LOCATION\n"
+        f"  's3://{DDL_PROCESSED_BUCKET}/{DDL_PROCESSED_DB_NAME}/{grain['table']}'\n"
+    )
+
+
+def get_rollup_files(rollup: dict) -> dict:
+    """{file path: generated content} of every grain of the rollup"""
+    files = {}
+    for parent_table, parent_column, grain in get_rollup_levels(rollup):
+        files[os.path.join(ROLLUP_SCRIPTS_PATH, f"{grain['table']}.sql")] = get_rollup_sql(
+            rollup, parent_table=parent_table, parent_column=parent_column, grain=grain
+        )
+        files[os.path.join(ROLLUP_DDL_PATH, f"{grain['table']}.sql")] = get_rollup_ddl(
+            rollup, grain=grain
+        )
+    return files
+
+
+def get_rollup_drift(rollup: dict) -> list:
+    """Generated files missing or different from the committed ones"""
+    drifted = []
+    for path, content in get_rollup_files(rollup).items():
+        if not os.path.exists(path):
+            drifted.append(path)
+            continue
+        with open(path) as committed:
+            if committed.read() != content:
+                drifted.append(path)
+    return drifted
+
+
+def check_rollup_drift(rollup: dict):
+    """Raises ValueError when the committed SQL or DDL drifted from the declaration"""
+    drifted = get_rollup_drift(rollup)
+    if drifted:
+        raise ValueError(
+            f"Rollup {rollup['name']} files drifted from the declaration, run "
+            f"`python rollup_sql_generator.py --write` in the cdk directory : {drifted}"
+        )
@@ -0,0 +1,47 @@
+#!/usr/bin/env python3
+"""
+Generates the SQL and DDL of the rollups declared in the pipeline configs.
+
+Run from the cdk directory after changing a rollup declaration
+
+    python rollup_sql_generator.py --write
+
+and commit the generated files. --check only lists the files that drifted
+from the declarations and exits 1, the same check runs at synth.
+"""
+import argparse
+import os
+import sys
+
+import pipeline_stacks.usghgemission_monthly_config as monthly_cfg
+from pkg.rollup_helpers import get_rollup_drift, get_rollup_files
+
+ROLLUPS = [monthly_cfg.UTILITY_EMISSION_ROLLUP]
+
+
+def write_rollup_files():
+    for rollup in ROLLUPS:
+        for path, content in get_rollup_files(rollup).items():
+            with open(path, "w") as generated:
+                generated.write(content)
+            print(f"written {os.path.relpath(path)}")
+
+
+def check_rollup_files() -> bool:
+    drifted = [path for rollup in ROLLUPS for path in get_rollup_drift(rollup)]
+    for path in drifted:
+        print(f"drifted {os.path.relpath(path)}")
+    return not drifted
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    mode = parser.add_mutually_exclusive_group(required=True)
+    mode.add_argument("--write", action="store_true")
+    mode.add_argument("--check", action="store_true")
+    cli_args = parser.parse_args()
+
+    if cli_args.write:
+        write_rollup_files()
+    elif not check_rollup_files():
+        sys.exit(1)
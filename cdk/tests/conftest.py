@@ -0,0 +1,12 @@
+import os
+import sys
+
+# Run from cdk/ : python -m pytest tests. Modules import config, pkg.* and
+# pipeline_stacks.* from the app root like app.py does
+os.environ.setdefault("CDK_DEFAULT_ACCOUNT", "123456789012")
+os.environ.setdefault("CDK_DEFAULT_REGION", "us-east-1")
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+# pkg.glue_step_helpers and the pipeline stacks import each other, load the
+# stacks first as app.py does
+import pipeline_stacks  # noqa: E402,F401
@@ -0,0 +1,113 @@
+import pytest
+
+import pipeline_stacks.usghgemission_monthly_config as monthly_cfg
+from pipeline_stacks import pipeline_config as pipe_cfg
+from pkg.dag_helpers import (
+    PARALLEL,
+    SEQUENCE,
+    get_dag_nodes,
+    get_dag_schedule,
+    get_state_machine_timeout_mins,
+    map_schedule,
+)
+from pkg.execution_profiles import get_worst_case_mins
+
+RETRY = {"max_attempts": 2, "interval_seconds": 60, "backoff_rate": 2.0, "max_delay_seconds": 600}
+
+
+def get_task(table: str, reads: list, writes: list, function: str = "job") -> dict:
+    return {"tables": [table], "function": function, "reads": reads, "writes": writes}
+
+
+def get_schedule_ids(pipeline_tasks: list) -> dict:
+    return map_schedule(get_dag_schedule(get_dag_nodes(pipeline_tasks)), lambda node: node["id"])
+
+
+def test_monthly_schedule_chains_the_rollup_and_audits_after_their_writers():
+    schedule = get_schedule_ids(
+        monthly_cfg.UTILITY_EMISSION_MONTHLY + monthly_cfg.MONTHLY_AUDIT_TABLES
+    )
+
+    assert schedule == {
+        PARALLEL: [
+            {
+                SEQUENCE: [
+                    "job-utility_emissions_monthly",
+                    # yearly rolls up the monthly grain, its audit reads the same table
+                    {PARALLEL: ["job-utility_emissions_yearly", "audit-utility_emissions_monthly"]},
+                ]
+            },
+            # landing audits read no table a step writes
+            "audit-utility_data_in",
+            "audit-utility_data_oh",
+        ]
+    }
+
+
+def test_independent_steps_run_in_parallel():
+    schedule = get_schedule_ids(
+        [
+            get_task("a", reads=[], writes=["db.a"]),
+            get_task("b", reads=["db.a"], writes=["db.b"]),
+            get_task("c", reads=[], writes=["db.c"]),
+            get_task("d", reads=["db.b", "db.c"], writes=["db.d"]),
+        ]
+    )
+
+    assert schedule == {
+        SEQUENCE: [{PARALLEL: ["job-a", "job-c"]}, "job-b", "job-d"]
+    }
+
+
+def test_cycle_raises():
+    with pytest.raises(ValueError, match="Cycle in pipeline tasks.*job-a.*job-b"):
+        get_dag_schedule(
+            get_dag_nodes(
+                [
+                    get_task("a", reads=["db.b"], writes=["db.a"]),
+                    get_task("b", reads=["db.a"], writes=["db.b"]),
+                    get_task("c", reads=[], writes=["db.c"]),
+                ]
+            )
+        )
+
+
+def test_table_written_by_several_tasks_raises():
+    with pytest.raises(ValueError, match="written by several pipeline tasks.*db.a"):
+        get_dag_nodes(
+            [
+                get_task("a", reads=[], writes=["db.{table}"]),
+                get_task("b", reads=[], writes=["db.a"]),
+            ]
+        )
+
+
+def test_duplicate_task_raises():
+    with pytest.raises(ValueError, match="Duplicate pipeline tasks.*job-a"):
+        get_dag_nodes(
+            [get_task("a", reads=[], writes=["db.a"]), get_task("a", reads=[], writes=[])]
+        )
+
+
+def test_state_machine_timeout_is_the_worst_case_path():
+    glue_retry_mins = get_worst_case_mins(0, RETRY)
+    schedule = {
+        SEQUENCE: [
+            {"runtime": "glue", "timeout_mins": 30, "retry": RETRY},
+            {
+                PARALLEL: [
+                    {"runtime": "lambda", "timeout_mins": 10, "retry": RETRY},
+                    {"runtime": "runner", "timeout_mins": 15, "retry": RETRY},
+                ]
+            },
+        ]
+    }
+
+    # Glue steps only retry runs that did not start, lambda steps retry the
+    # whole task : 3 minutes of delays, 3 attempts of 10 minutes
+    assert glue_retry_mins == 3
+    assert get_state_machine_timeout_mins(schedule) == (
+        30 + glue_retry_mins
+        + max(10 * 3 + 3, 15 + glue_retry_mins)
+        + pipe_cfg.STATE_MACHINE_TIMEOUT_MARGIN_MINS
+    )
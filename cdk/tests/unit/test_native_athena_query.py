@@ -0,0 +1,78 @@
+import pytest
+from aws_cdk import App, Stack
+
+import config as cf
+from pkg import glue_step_helpers
+from pkg.glue_step_helpers import get_native_athena_query
+
+START_DATE = "$.athena_range.range.param_execution_start_date"
+END_DATE = "$.athena_range.range.param_execution_end_date"
+
+
+def render(table_name: str) -> str:
+    """States.Format intrinsic of the query, as written to the state machine"""
+    return Stack(App()).resolve(get_native_athena_query(table_name))
+
+
+@pytest.fixture
+def scripts_path(tmp_path, monkeypatch):
+    monkeypatch.setattr(glue_step_helpers, "ATHENA_QUERY_EXEC_PATH", str(tmp_path))
+    path = tmp_path / "scripts" / "usghgemission"
+    path.mkdir(parents=True)
+    return path
+
+
+def test_daily_script_renders_for_a_full_recompute():
+    query = render("utility_emissions_daily")
+
+    assert query.startswith(
+        f"States.Format('insert into {cf.PROCESSED_DB_NAME}.utility_emissions_daily with "
+    )
+    assert f"from {cf.LANDING_DB_NAME}.utility_data_oh " in query
+    # incremental blocks and their comment are dropped, one line for States.Format
+    assert "union all" not in query
+    assert "--" not in query
+    assert "\n" not in query
+    assert query.endswith(
+        f"select * from recomputed', {START_DATE}, {END_DATE}, {START_DATE}, {END_DATE})"
+    )
+
+
+def test_rollup_script_renders_from_the_grain_below():
+    query = render("utility_emissions_yearly")
+
+    assert (
+        f"from {cf.PROCESSED_DB_NAME}.utility_emissions_monthly where exec_date "
+        "between date(\\'{}\\') and date(\\'{}\\') group by 1, 2" in query
+    )
+    assert query.endswith(f"from rolled_up', {START_DATE}, {END_DATE})")
+
+
+def test_string_literals_are_kept(scripts_path):
+    (scripts_path / "literal.sql").write_text(
+        "select 'it''s -- not; a comment' as note, -- trailing comment\n"
+        "\tdate('{{ param_execution_date }}') as exec_date\n"
+        "from {{ param_processed_db_name }}.literal;\n"
+    )
+
+    assert render("literal") == (
+        "States.Format('select \\'it\\'\\'s -- not; a comment\\' as note, "
+        f"date(\\'{{}}\\') as exec_date from {cf.PROCESSED_DB_NAME}.literal', $.date)"
+    )
+
+
+def test_several_statements_raise(scripts_path):
+    (scripts_path / "two_statements.sql").write_text(
+        "delete from {{ param_processed_db_name }}.two_statements;\n"
+        "insert into {{ param_processed_db_name }}.two_statements select 1;\n"
+    )
+
+    with pytest.raises(ValueError, match="athena runtime runs a single statement"):
+        get_native_athena_query("two_statements")
+
+
+def test_unknown_parameter_raises(scripts_path):
+    (scripts_path / "unknown.sql").write_text("select '{{ param_audit_db }}'\n")
+
+    with pytest.raises(ValueError, match="can not be rendered for the athena runtime"):
+        get_native_athena_query("unknown")
@@ -0,0 +1,74 @@
+import os
+import re
+
+import rollup_sql_generator
+from pipeline_stacks.usghgemission_monthly_config import UTILITY_EMISSION_ROLLUP
+from pkg.rollup_helpers import (
+    ROLLUP_DDL_PATH,
+    ROLLUP_SCRIPTS_PATH,
+    get_rollup_files,
+    get_rollup_levels,
+)
+
+ROLLUP_FILES = get_rollup_files(UTILITY_EMISSION_ROLLUP)
+
+
+def get_script(table: str) -> str:
+    return ROLLUP_FILES[os.path.join(ROLLUP_SCRIPTS_PATH, f"{table}.sql")]
+
+
+def get_ddl(table: str) -> str:
+    return ROLLUP_FILES[os.path.join(ROLLUP_DDL_PATH, f"{table}.sql")]
+
+
+def get_select_columns(script: str) -> list:
+    """Output columns of the final select, the name after `as` for expressions"""
+    select = script.split("\nselect ", 1)[1].split("\nfrom rolled_up", 1)[0]
+    return [column.strip().split(" as ")[-1] for column in select.split(",\n")]
+
+
+def get_ddl_columns(ddl: str) -> list:
+    columns = ddl.split("(\n", 1)[1].split(")\n", 1)[0]
+    return [column.split()[0] for column in columns.split(",\n")]
+
+
+def test_each_grain_rolls_up_the_one_below():
+    levels = [
+        (parent_table, parent_column, grain["table"])
+        for parent_table, parent_column, grain in get_rollup_levels(UTILITY_EMISSION_ROLLUP)
+    ]
+
+    assert levels == [
+        ("utility_emissions_daily", "record_date", "utility_emissions_monthly"),
+        ("utility_emissions_monthly", "record_month", "utility_emissions_yearly"),
+    ]
+    monthly = get_script("utility_emissions_monthly")
+    yearly = get_script("utility_emissions_yearly")
+    assert "date_format(record_date, '%Y%m') as record_month" in monthly
+    assert "from {{ param_processed_db_name }}.utility_emissions_daily\n" in monthly
+    assert "substr(record_month, 1, 4) as record_year" in yearly
+    assert "from {{ param_processed_db_name }}.utility_emissions_monthly\n" in yearly
+
+
+def test_derived_measure_is_computed_from_the_rolled_up_measures():
+    for grain in UTILITY_EMISSION_ROLLUP["grains"]:
+        script = get_script(grain["table"])
+        aggregation, select = script.split("\nselect ", 1)
+
+        assert "co2_ton_total" not in aggregation
+        assert not re.search(r"sum\(\s*\(?co2_ton_total", script)
+        assert "(co2_ton_oh + co2_ton_in) as co2_ton_total" in select
+        assert "sum(co2_ton_oh) as co2_ton_oh" in aggregation
+
+
+def test_insert_columns_follow_the_ddl():
+    for grain in UTILITY_EMISSION_ROLLUP["grains"]:
+        ddl_columns = get_ddl_columns(get_ddl(grain["table"]))
+
+        assert ddl_columns == [grain["column"], "co2_ton_oh", "co2_ton_in", "co2_ton_total"]
+        # exec_date is the partition column, last of the insert
+        assert get_select_columns(get_script(grain["table"])) == ddl_columns + ["exec_date"]
+
+
+def test_committed_files_match_the_declaration():
+    assert rollup_sql_generator.check_rollup_files()
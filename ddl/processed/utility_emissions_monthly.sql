@@ -1,7 +1,8 @@
+-- Generated by cdk/rollup_sql_generator.py from UTILITY_EMISSION_ROLLUP, do not edit
 CREATE EXTERNAL TABLE processed_db_dev.utility_emissions_monthly(
-  record_month string, 
-  co2_ton_oh float, 
-  co2_ton_in float, 
+  record_month string,
+  co2_ton_oh float,
+  co2_ton_in float,
   co2_ton_total float)
   PARTITIONED BY (
   exec_date date)
@@ -12,4 +13,4 @@ STORED AS INPUTFORMAT
 OUTPUTFORMAT 
   'org.apache.hadoop.hive.ql.io.parquet.MapredParquetOutputFormat'
 LOCATION
-  's3://apg-processed-$CDK_DEFAULT_ACCOUNT-dev/processed_db_dev/utility_emissions_monthly'
\ No newline at end of file
+  's3://apg-processed-$CDK_DEFAULT_ACCOUNT-dev/processed_db_dev/utility_emissions_monthly'
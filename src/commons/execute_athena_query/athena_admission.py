@@ -0,0 +1,254 @@
+"""
+Athena admission control shared by every executor.
+
+A counting semaphore per workgroup, each holder leases a slot until it
+releases it or the lease expires ( crashed job or Lambda timeout ). The
+DynamoDB backend keeps one item per workgroup with the live holders and
+a version for optimistic writes, the local backend is an in-memory
+stand-in with the same semantics for local runs.
+
+Athena errors are classified as
+    THROTTLING : quota or rate limits, retried client-side with backoff
+    TRANSIENT  : service side failures, retried a few times
+    FATAL      : SQL, permission and data errors, never retried
+Only submission errors are retried here. A query that ran and failed may
+have written part of its output, it is left to the retry of the whole
+task, which purges the destination partitions first.
+"""
+import logging
+import os
+import random
+import re
+import threading
+import time
+import uuid
+
+import boto3
+from botocore.exceptions import ClientError
+
+logger = logging.getLogger(__name__)
+
+ERROR_THROTTLING = "THROTTLING"
+ERROR_TRANSIENT = "TRANSIENT"
+ERROR_FATAL = "FATAL"
+
+THROTTLING_ERROR_CODES = (
+    "TooManyRequestsException",
+    "ThrottlingException",
+    "LimitExceededException",
+)
+TRANSIENT_ERROR_CODES = ("InternalServerException", "ServiceUnavailableException")
+THROTTLING_REASON_PATTERN = re.compile(
+    r"TooManyRequests|Rate exceeded|Throttl|Slow ?Down|concurrent queries",
+    re.IGNORECASE,
+)
+TRANSIENT_REASON_PATTERN = re.compile(
+    r"INTERNAL_ERROR|GENERIC_INTERNAL_ERROR|ServiceUnavailable|Please try again|"
+    r"HIVE_CANNOT_OPEN_SPLIT|Connection reset|Read timed out",
+    re.IGNORECASE,
+)
+
+# A holder is assumed gone after its lease, longer than any single statement
+ADMISSION_LEASE_SECONDS = 3600
+# Wait for a slot this long before failing the step
+ADMISSION_MAX_WAIT_SECONDS = int(os.environ.get("ATHENA_ADMISSION_MAX_WAIT_SECONDS", "600"))
+BACKOFF_BASE_SECONDS = 2
+BACKOFF_MAX_SECONDS = 60
+MAX_TRANSIENT_RETRIES = 2
+
+
+class AthenaFatalError(Exception):
+    """Not retried by the executor nor by the step function"""
+
+
+def classify_athena_error(ex: Exception) -> str:
+    """THROTTLING, TRANSIENT or FATAL, from the API error code or the query failure reason"""
+    if isinstance(ex, ClientError):
+        code = ex.response.get("Error", {}).get("Code", "")
+        if code in THROTTLING_ERROR_CODES:
+            return ERROR_THROTTLING
+        if code in TRANSIENT_ERROR_CODES:
+            return ERROR_TRANSIENT
+    reason = str(ex)
+    if THROTTLING_REASON_PATTERN.search(reason):
+        return ERROR_THROTTLING
+    if TRANSIENT_REASON_PATTERN.search(reason):
+        return ERROR_TRANSIENT
+    return ERROR_FATAL
+
+
+def get_backoff_seconds(attempt: int) -> float:
+    """Exponential backoff with full jitter"""
+    return random.uniform(  # nosec
+        0, min(BACKOFF_MAX_SECONDS, BACKOFF_BASE_SECONDS * 2 ** attempt)
+    )
+
+
+def get_admission_controller(table_name: str, slots: int):
+    """Returns the controller for the configured backend ( dynamodb | local )"""
+    if os.environ.get("ATHENA_ADMISSION_BACKEND", "dynamodb").lower() == "local":
+        _LOCAL_CONTROLLER.slots = slots
+        return _LOCAL_CONTROLLER
+    return DynamoDBAdmissionController(table_name=table_name, slots=slots)
+
+
+class AdmissionController(object):
+    """
+    Slot workflow shared by all backends. Subclasses implement the
+    conditional primitives against their store.
+    """
+
+    def __init__(self, slots: int):
+        self.slots = slots
+
+    def acquire(self, workgroup: str) -> str:
+        """Blocks until a slot of the workgroup is free, returns the holder id"""
+        holder = uuid.uuid4().hex
+        started = time.time()
+        attempt = 0
+        while not self.try_acquire(workgroup, holder):
+            if time.time() - started > ADMISSION_MAX_WAIT_SECONDS:
+                raise Exception(
+                    f"No Athena slot of workgroup {workgroup} freed up in "
+                    f"{ADMISSION_MAX_WAIT_SECONDS}s ( {self.slots} slots )"
+                )
+            time.sleep(get_backoff_seconds(attempt))
+            attempt += 1
+        logger.info(f"Admitted {holder} in workgroup {workgroup} after {attempt} wait(s)")
+        return holder
+
+    def run(self, workgroup: str, start_query, keep_slot: bool = False):
+        """
+        Runs start_query() in a slot of the workgroup, retrying throttles
+        until ADMISSION_MAX_WAIT_SECONDS and transient errors
+        MAX_TRANSIENT_RETRIES times. Only the API errors of the submission
+        are retried, start_query must not wait on the query. Fatal errors
+        raise AthenaFatalError. keep_slot returns (result, holder) and leaves
+        the slot to the caller to release once the query is done.
+        """
+        started = time.time()
+        attempt = 0
+        transient_retries = 0
+        while True:
+            holder = self.acquire(workgroup)
+            try:
+                result = start_query()
+            except Exception as ex:
+                self.release(workgroup, holder)
+                error_class = classify_athena_error(ex)
+                logger.info(f"Athena error classified {error_class} : {ex}")
+                if error_class == ERROR_FATAL:
+                    raise AthenaFatalError(str(ex)) from ex
+                if not isinstance(ex, ClientError):
+                    raise
+                if error_class == ERROR_TRANSIENT:
+                    transient_retries += 1
+                    if transient_retries > MAX_TRANSIENT_RETRIES:
+                        raise
+                elif time.time() - started > ADMISSION_MAX_WAIT_SECONDS:
+                    raise
+                time.sleep(get_backoff_seconds(attempt))
+                attempt += 1
+                continue
+            if keep_slot:
+                return result, holder
+            self.release(workgroup, holder)
+            return result
+
+    def wait(self, workgroup: str, holder: str, wait_query):
+        """
+        Returns wait_query() for a query submitted with keep_slot and
+        releases its slot. A failed query is not retried, fatal failures
+        raise AthenaFatalError.
+        """
+        try:
+            return wait_query()
+        except Exception as ex:
+            if classify_athena_error(ex) == ERROR_FATAL:
+                raise AthenaFatalError(str(ex)) from ex
+            raise
+        finally:
+            self.release(workgroup, holder)
+
+    @staticmethod
+    def now() -> int:
+        return int(time.time())
+
+    def try_acquire(self, workgroup: str, holder: str) -> bool:
+        raise NotImplementedError
+
+    def release(self, workgroup: str, holder: str):
+        raise NotImplementedError
+
+
+class DynamoDBAdmissionController(AdmissionController):
+    """Slots backed by a DynamoDB table ( workgroup )"""
+
+    def __init__(self, table_name: str, slots: int):
+        super().__init__(slots=slots)
+        self.table = boto3.resource("dynamodb").Table(table_name)
+
+    def try_acquire(self, workgroup: str, holder: str) -> bool:
+        now = self.now()
+        item = self.table.get_item(Key={"workgroup": workgroup}, ConsistentRead=True).get(
+            "Item", {}
+        )
+        holders = {h: int(exp) for h, exp in item.get("holders", {}).items() if int(exp) > now}
+        if len(holders) >= self.slots:
+            return False
+        holders[holder] = now + ADMISSION_LEASE_SECONDS
+        version = int(item.get("version", 0))
+        try:
+            self.table.put_item(
+                Item={"workgroup": workgroup, "holders": holders, "version": version + 1},
+                ConditionExpression="attribute_not_exists(workgroup) OR version = :v",
+                ExpressionAttributeValues={":v": version},
+            )
+            return True
+        except ClientError as ex:
+            # Another holder wrote first, read again on the next attempt
+            if ex.response["Error"]["Code"] == "ConditionalCheckFailedException":
+                return False
+            raise
+
+    def release(self, workgroup: str, holder: str):
+        try:
+            self.table.update_item(
+                Key={"workgroup": workgroup},
+                UpdateExpression="REMOVE holders.#h ADD version :one",
+                ConditionExpression="attribute_exists(holders.#h)",
+                ExpressionAttributeNames={"#h": holder},
+                ExpressionAttributeValues={":one": 1},
+            )
+        except ClientError as ex:
+            # Lease expired and purged by another holder
+            if ex.response["Error"]["Code"] != "ConditionalCheckFailedException":
+                raise
+
+
+class LocalAdmissionController(AdmissionController):
+    """In-memory stand-in with the same semantics, for local runs"""
+
+    def __init__(self, slots: int):
+        super().__init__(slots=slots)
+        self.holders = {}
+        self.lock = threading.Lock()
+
+    def try_acquire(self, workgroup: str, holder: str) -> bool:
+        now = self.now()
+        with self.lock:
+            holders = {
+                h: exp for h, exp in self.holders.get(workgroup, {}).items() if exp > now
+            }
+            if len(holders) >= self.slots:
+                return False
+            holders[holder] = now + ADMISSION_LEASE_SECONDS
+            self.holders[workgroup] = holders
+            return True
+
+    def release(self, workgroup: str, holder: str):
+        with self.lock:
+            self.holders.get(workgroup, {}).pop(holder, None)
+
+
+_LOCAL_CONTROLLER = LocalAdmissionController(slots=1)
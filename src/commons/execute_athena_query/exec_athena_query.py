@@ -1,3 +1,10 @@
+"""
+Runs the SQL of a pipeline task in Athena.
+
+Runs as a Glue pythonshell job ( arguments through getResolvedOptions ) or
+as the athena executor lambda ( the same arguments in event["payload"] ),
+selected per task with "runtime" in the pipeline config.
+"""
 import json
 import os
 import sys
@@ -10,7 +17,19 @@ import awswrangler as wr
 from jinja2 import StrictUndefined, FileSystemLoader
 from jinja2.environment import Environment
 
+from athena_admission import (
+    ERROR_FATAL,
+    MAX_TRANSIENT_RETRIES,
+    AthenaFatalError,
+    classify_athena_error,
+    get_admission_controller,
+    get_backoff_seconds,
+)
+
 import re
+import threading
+import time
+from datetime import datetime, timedelta
 
 logging.basicConfig()
 logger = logging.getLogger(__name__)
@@ -18,98 +37,54 @@ logger.setLevel(logging.DEBUG)
 
 DATA_GRAIN_PARTITIONS = {"daily": "daily", "monthly": "monthly"}
 
-# """
-from awsglue.utils import getResolvedOptions  # noqa
-
-xtra_files_dir = os.environ["EXTRA_FILES_DIR"]
-
-args = getResolvedOptions(
-    sys.argv,
-    [
-        "s3_glue_asset_bucket",
-        "s3_sql_script_key",
-        "s3_sql_script_param_key",
-        "param_execution_date",
-        "glue_runtime_sql_params",
-        "glue_dest_table_props",
-        "glue_execution_db",
-        "glue_job_name",
-        "pipeline_name",
-        "task_type",
-        "step_execution_id",
-        "start_dttm",
-        "env",
-        "can_fetch_no_results",
-    ],
-)
-env = args["env"]
-step_execution_id = args["step_execution_id"]
-start_dttm = args["start_dttm"]
-task_type = args["task_type"]
-glue_job_name = args["glue_job_name"]
-pipeline_name = args["pipeline_name"]
-s3_glue_asset_bucket = args["s3_glue_asset_bucket"]
-s3_sql_script_key = args["s3_sql_script_key"]
-s3_sql_script_param_key = args["s3_sql_script_param_key"].format(
-    param_exec_date=args["param_execution_date"]
-)
+ARGUMENT_NAMES = [
+    "s3_glue_asset_bucket",
+    "s3_sql_script_key",
+    "s3_sql_script_param_key",
+    "param_execution_date",
+    "glue_runtime_sql_params",
+    "glue_dest_table_props",
+    "glue_execution_db",
+    "glue_job_name",
+    "pipeline_name",
+    "task_type",
+    "step_execution_id",
+    "start_dttm",
+    "env",
+    "can_fetch_no_results",
+    "athena_admission_table",
+    "athena_admission_slots",
+    "athena_workgroup",
+    "athena_result_reuse_max_age_mins",
+]
+
+READ_QUERY_PATTERN = re.compile(r"^\s*(select|with)\b", re.IGNORECASE)
+
+# j2 macros are packaged next to the script in the lambda
+LAMBDA_MACROS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "macros")
 
-logger.info(f"Using param config from {s3_sql_script_param_key}")
-
-glue_runtime_sql_params = (
-    json.loads(args["glue_runtime_sql_params"])
-    if len(args["glue_runtime_sql_params"]) > 0
-    else {}
-)
-s3_sql_script_path = f"s3://{s3_glue_asset_bucket}/{s3_sql_script_key}"
-s3_sql_script_param_path = f"s3://{s3_glue_asset_bucket}/{s3_sql_script_param_key}"
-glue_execution_db = args["glue_execution_db"]
-can_fetch_no_results = args["can_fetch_no_results"]
-
-param_execution_date = glue_runtime_sql_params["param_execution_date"]
-param_landing_db_name = glue_runtime_sql_params["param_landing_db_name"]
-param_processed_db_name = glue_runtime_sql_params["param_processed_db_name"]
-param_s3_landing_bucket_name = glue_runtime_sql_params["param_s3_landing_bucket_name"]  # noqa
-
-glue_dest_table_props = (
-    json.loads(args["glue_dest_table_props"])
-    if len(args["glue_dest_table_props"]) > 0
-    else {}
-)
+max_rows_per_file_s3 = 50000
 
-param_paths = s3_sql_script_param_key.split(",")
-s3_sql_script_param_path = []
-for param_path in param_paths:
-    if len(param_path.strip()) > 0:
-        s3_sql_script_param_path.append(
-            f"s3://{s3_glue_asset_bucket}/{param_path.strip()}"
-        )
+# Callback runs, the token item outlives any step function task timeout
+CALLBACK_TOKEN_TTL_SECONDS = 2 * 24 * 3600
+ATHENA_TERMINAL_STATES = ["SUCCEEDED", "FAILED", "CANCELLED"]
 
-dest_table = {}
-if len(glue_dest_table_props) > 0:
-    """
-    Overwrite data = Yes can indicate following scenarios
-        1. Overwrite partition when partition is given
-        2. If partition is not given, overwrites entire table data
-    """
-    dest_table["table_name"] = glue_dest_table_props["table_name"]
-    dest_table["overwrite_data"] = (
-        True if glue_dest_table_props["overwrite_data"].lower() == "yes" else False
-    )
-    dest_table["table_bucket"] = glue_dest_table_props["table_bucket"]
-    dest_table["table_db"] = glue_dest_table_props["table_db"]
-    dest_table["table_partition"] = glue_dest_table_props["table_partition"]
+# One S3 client per process, pipeline_runner tasks share it across threads
+_s3_client = None
+_s3_client_lock = threading.Lock()
 
-else:
-    logger.info("glue_dest_table_props is missing")
 
-max_rows_per_file_s3 = 50000
-rendered_s3_sql_path = ""
+def get_s3_client():
+    global _s3_client
+    with _s3_client_lock:
+        if _s3_client is None:
+            _s3_client = boto3.client("s3")
+    return _s3_client
 
 
 def get_objects_in_s3_path(bucket_name: str, bucket_path: str) -> list:
     print("In get_objects_in_s3_path...")
-    s3 = boto3.client("s3")
+    s3 = get_s3_client()
     paginator = s3.get_paginator("list_objects_v2")
     pages = paginator.paginate(Bucket=bucket_name, Prefix=bucket_path)
     s3_objects = []
@@ -132,7 +107,7 @@ def delete_objects_from_s3_path(bucket_name: str, bucket_prefix: str) -> int:
 
     k = 0
     if len(bucket_prefix.strip()) > 0:
-        s3 = boto3.client("s3")
+        s3 = get_s3_client()
         objects_to_delete = get_objects_in_s3_path(
             bucket_name=bucket_name, bucket_path=bucket_prefix
         )
@@ -149,12 +124,11 @@ def delete_objects_from_s3_path(bucket_name: str, bucket_prefix: str) -> int:
 def get_s3_file_content(s3_path: str) -> str:
     print("In get_s3_file_content...")
     try:
-        s3 = boto3.resource("s3")
         o = urlparse(s3_path)
         bucket = o.netloc
         key = o.path
-        obj = s3.Object(bucket, key.lstrip("/"))
-        file_content = obj.get()["Body"].read().decode("utf-8")
+        obj = get_s3_client().get_object(Bucket=bucket, Key=key.lstrip("/"))
+        file_content = obj["Body"].read().decode("utf-8")
         return file_content
     except ClientError as ex:
         if ex.response["Error"]["Code"] == "NoSuchKey":
@@ -164,73 +138,31 @@ def get_s3_file_content(s3_path: str) -> str:
             raise
 
 
-def templatize_query_j2(sql_script_path: str, sql_params_path: [str]) -> (str, dict):
-    logger.info("In templatize_query_j2...")
-    sql = get_s3_file_content(sql_script_path)
-    render_params = {}
-    rendered_sql = ""
+def s3_upload_file(dest_bucket: str, dest_prefix: str, content: str) -> str:
+    print("In s3_upload_file...")
+    rendered_sql_upload_path = f"s3://{dest_bucket}/{dest_prefix}"
+    s3 = get_s3_client()
+    s3.put_object(Bucket=dest_bucket, Key=dest_prefix, Body=content)
+    return rendered_sql_upload_path
 
-    if task_type == "audit":
-        for param_path in sql_params_path:
-            param = json.loads(get_s3_file_content(param_path))
-            if len(param) > 0:
-                render_params.update(param)
 
-    render_params.update(glue_runtime_sql_params)
-    if task_type == "audit":
-        render_params["globals"]["param_exec_date"] = render_params[
-            "param_execution_date"
-        ]
-        render_params["globals"]["param_processed_db_name"] = render_params[
-            "param_processed_db_name"
-        ]
-        audit_meta = {
-            "param_audit_db": f"audit_db_{render_params['globals']['param_stage'].lower()}",
-            "param_audit_table": "audit",
-        }
-        j2_sql = Environment(  # nosec
-            loader=FileSystemLoader(xtra_files_dir),
-            undefined=StrictUndefined,
-            lstrip_blocks=True,
-        ).from_string(sql)
-        rendered_sql = j2_sql.render(
-            configs=render_params["configs"],
-            globals=render_params["globals"],
-            table_select_period_pattern=render_params["table_select_period_pattern"],
-            table_level_where=render_params["table_level_filter"],
-            audit=audit_meta,
-        )
-    else:
-        sql = get_s3_file_content(sql_script_path)
-        interested_params = {"param_execution_date": param_execution_date \
-            , "param_landing_db_name": param_landing_db_name \
-            , "param_processed_db_name": param_processed_db_name \
-            , "param_s3_landing_bucket_name": param_s3_landing_bucket_name}  # noqa
-
-        for key in interested_params:
-            sql = sql.replace("{{ " + key + " }}", interested_params[key])
-        rendered_sql = sql
-    return rendered_sql, render_params
-
-
-def parameterize_query(sql_script_path: str, sql_params_path: str) -> str:
-    logger.info("In parameterize_query...")
-    sql = get_s3_file_content(sql_script_path)
-    params = get_s3_file_content(sql_params_path)
-    params_dict = json.loads(params)
-    params_dict.update(glue_runtime_sql_params)
-    logger.info(f"The params file at {sql_params_path} is empty") if len(
-        params_dict
-    ) < 1 else None
-    if len(sql.strip()) > 5:
-        for param_key, param_value in params_dict.items():
-            sql = sql.replace(param_key, param_value.strip())
-    else:
-        raise Exception(f"Empty SQL file : {sql_script_path}")
-    return sql
-
-
-def check_query_results(query_status: dict) -> bool:
+def check_potential_sql_injection_patterns(value: str) -> bool:
+    """Check for suspicious SQL patterns."""
+    dangerous_patterns = [
+        r'DROP\s+TABLE',  # DROP attacks
+        r'DELETE\s+FROM',  # DELETE attacks
+        r'EXEC\s*\(',  # EXEC attacks
+        r'EXECUTE\s*\(',  # EXECUTE attacks
+        r'xp_cmdshell',  # Command execution
+        r'sys\.',  # System table access
+        r'information_schema\.',  # Information schema access
+    ]
+
+    return any(re.search(pattern, value, re.IGNORECASE)
+               for pattern in dangerous_patterns)
+
+
+def check_query_results(query_status: dict, can_fetch_no_results) -> bool:
     """Validate if Athena query yielded any result"""
     logger.info("In check_query_results")
     query_zero_result = (
@@ -248,148 +180,458 @@ def check_query_results(query_status: dict) -> bool:
     return True
 
 
-def start_query_execution(sql_qry: str) -> Union[str, dict[str, Any]]:
-    logger.info("In start_query_execution")
-    logger.info(
-        f"Running Statement in {glue_execution_db} database: {rendered_s3_sql_path} "
-    )
-    query_exec_status = wr.athena.start_query_execution(
-        sql=sql_qry, database=glue_execution_db, wait=True
-    )
-    logger.info(f"ATHENA RESPONSE start_query_execution = {query_exec_status}")
-    if task_type != "audit":
-        check_query_results(query_exec_status)
-    return query_exec_status
-
+def get_callback_table():
+    return boto3.resource("dynamodb").Table(os.environ["ATHENA_CALLBACK_TABLE"])
 
-def s3_upload_file(dest_bucket: str, dest_prefix: str, content: str) -> str:
-    print("In s3_upload_file...")
-    rendered_sql_upload_path = f"s3://{dest_bucket}/{dest_prefix}"
-    s3 = boto3.client("s3")
-    s3.put_object(Bucket=dest_bucket, Key=dest_prefix, Body=content)
-    return rendered_sql_upload_path
 
+def complete_query_callback(query_execution_id: str) -> bool:
+    """
+    Sends the result of a terminal query to the step function waiting on
+    it. The token item is claimed with its delete so the state change
+    handler and the submitting executor never both send. Returns False
+    when there is no token, the query was not submitted with a callback
+    or is already completed.
+    """
+    logger.info(f"In complete_query_callback {query_execution_id}")
+    token = get_callback_table().delete_item(
+        Key={"query_execution_id": query_execution_id}, ReturnValues="ALL_OLD"
+    ).get("Attributes")
+    if token is None:
+        return False
+
+    get_admission_controller(
+        table_name=token["athena_admission_table"], slots=int(token["athena_admission_slots"])
+    ).release(token["athena_workgroup"], token["admission_holder"])
+
+    query_status = boto3.client("athena").get_query_execution(
+        QueryExecutionId=query_execution_id
+    )["QueryExecution"]
+    state = query_status["Status"]["State"]
+    sfn = boto3.client("stepfunctions")
+    try:
+        if state != "SUCCEEDED":
+            reason = query_status["Status"].get("StateChangeReason", "")
+            error = Exception(f"Query {query_execution_id} {state} : {reason}")
+            # Same error name as a fatal failure of a waiting run
+            if classify_athena_error(error) == ERROR_FATAL:
+                raise AthenaFatalError(str(error))
+            raise error
+        if token["task_type"] != "audit":
+            check_query_results(query_status, can_fetch_no_results=token["can_fetch_no_results"])
+    except Exception as e:
+        logger.info(f"Failing task {token['glue_job_name']} : {e}")
+        sfn.send_task_failure(
+            taskToken=token["task_token"],
+            error="AthenaFatalError" if isinstance(e, AthenaFatalError) else "AthenaQueryFailed",
+            cause=str(e)[:32768],
+        )
+        return True
+
+    sfn.send_task_success(
+        taskToken=token["task_token"],
+        output=json.dumps(
+            {
+                "rendered_sql": token["rendered_sql"],
+                "query_execution_id": query_execution_id,
+                "state": state,
+            }
+        ),
+    )
+    return True
 
-def get_data_grain_partition():
-    # DATA_GRAIN_PARTITIONS
-    if pipeline_name.lower().find("tank") >= 0:
-        if glue_runtime_sql_params["monthly"].lower() == "true":
-            return [DATA_GRAIN_PARTITIONS["daily"], DATA_GRAIN_PARTITIONS["monthly"]]
-        else:
-            return [DATA_GRAIN_PARTITIONS["daily"]]
-    else:
-        raise Exception("invalid partitions in get_data_grain_partition")
-
-
-def update_partition_values(partitions: dict, params: dict) -> (dict, bool):
-    logger.info("In update_partition_values...")
-    multiple_sub_partitions = False
-    for partition in partitions:
-        if task_type == "audit":
-            if "pipeline" in partition:
-                partitions["pipeline"] = params["globals"]["param_pipeline_name"]
-            if "exec_date" in partition:
-                partitions["exec_date"] = params["globals"]["param_exec_date"]
-            if "table_name" in partition:
-                partitions["table_name"] = params["globals"]["param_audited_table_name"]
-            if "time_grain" in partition:
-                partitions["time_grain"] = params["globals"]["param_grain"]
-        else:
-            if "exec_date" in partition:
-                partitions["exec_date"] = params["param_execution_date"]
-            if "data_grain" in partition:
-                partitions["data_grain"] = get_data_grain_partition()
-                multiple_sub_partitions = True
 
-    return partitions, multiple_sub_partitions
+class AthenaQueryExecutor(object):
+    def __init__(
+            self, args: dict, xtra_files_dir: str, shared: dict = None, boto3_session=None
+    ):
+        """
+        shared holds the S3 files and Jinja environments of the tasks of a
+        pipeline_runner process, a single task run keeps its own
+        """
+        self.xtra_files_dir = xtra_files_dir
+        self.shared = shared if shared is not None else {}
+        self.shared.setdefault("files", {})
+        self.shared.setdefault("jinja_envs", {})
+        self.boto3_session = boto3_session
+        # Step function task token of a callback run, the last statement is
+        # submitted and the completion handler resumes the step
+        self.callback_task_token = args.get("callback_task_token")
+        # Every executor queues on the same per workgroup slots
+        self.athena_workgroup = args["athena_workgroup"]
+        self.result_reuse_max_age_mins = int(args["athena_result_reuse_max_age_mins"])
+        self.athena_admission_table = args["athena_admission_table"]
+        self.admission = get_admission_controller(
+            table_name=args["athena_admission_table"],
+            slots=int(args["athena_admission_slots"]),
+        )
+        self.env = args["env"]
+        self.step_execution_id = args["step_execution_id"]
+        self.start_dttm = args["start_dttm"]
+        self.task_type = args["task_type"]
+        self.glue_job_name = args["glue_job_name"]
+        self.pipeline_name = args["pipeline_name"]
+        self.s3_glue_asset_bucket = args["s3_glue_asset_bucket"]
+        self.s3_sql_script_key = args["s3_sql_script_key"]
+        s3_sql_script_param_key = args["s3_sql_script_param_key"].format(
+            param_exec_date=args["param_execution_date"]
+        )
 
+        logger.info(f"Using param config from {s3_sql_script_param_key}")
 
-def construct_partition_path(partitions: dict, params: dict) -> list:
-    logger.info("In construct_partition_path...")
-    partition_path = []
-    prefix = ""
-    partitions_with_value, is_sub_partitions = update_partition_values(
-        partitions=partitions, params=params
-    )
-    # for partition in partitions_with_value.items():
-    if task_type == "data-transform":
-        for partition_key, partition_value in partitions_with_value.items():
-            if is_sub_partitions:
-                if type(partition_value).__name__ == "list":
-                    for sub_part in partition_value:
-                        partition_path.append(f"{prefix}{partition_key}={sub_part}/")
-                else:
-                    prefix = f"{partition_key}={partition_value}/"
-            else:
-                partition_path.append(f"{partition_key}={partition_value}/")
-    elif task_type == "audit":
-        audit_partition_path = ""
-        for partition_key, partition_value in partitions_with_value.items():
-            audit_partition_path = (
-                    audit_partition_path + f"{partition_key}={partition_value}/"
-            )
-        partition_path.append(audit_partition_path)
-    return partition_path
+        self.glue_runtime_sql_params = (
+            json.loads(args["glue_runtime_sql_params"])
+            if len(args["glue_runtime_sql_params"]) > 0
+            else {}
+        )
+        self.s3_sql_script_path = f"s3://{self.s3_glue_asset_bucket}/{self.s3_sql_script_key}"
+        self.glue_execution_db = args["glue_execution_db"]
+        self.can_fetch_no_results = args["can_fetch_no_results"]
+
+        self.param_execution_date = self.glue_runtime_sql_params["param_execution_date"]
+        # Set-based runs produce every exec_date partition of the range in one
+        # statement, a single date run is a range of one
+        self.param_execution_start_date = self.glue_runtime_sql_params.get(
+            "param_execution_start_date", self.param_execution_date
+        )
+        self.param_execution_end_date = self.glue_runtime_sql_params.get(
+            "param_execution_end_date", self.param_execution_start_date
+        )
+        # Incremental runs recompute param_changed_periods and carry the other
+        # periods forward from the outputs of param_incremental_source_exec_date
+        self.param_incremental_source_exec_date = self.glue_runtime_sql_params.get(
+            "param_incremental_source_exec_date", ""
+        )
+        self.param_changed_periods = [
+            period
+            for period in self.glue_runtime_sql_params.get("param_changed_periods", "").split(",")
+            if period
+        ]
+        if (
+            self.param_incremental_source_exec_date
+            and self.param_execution_start_date != self.param_execution_end_date
+        ):
+            logger.info("Incremental recompute is for single exec_date runs, running in full")
+            self.param_incremental_source_exec_date = ""
+            self.param_changed_periods = []
+        self.param_landing_db_name = self.glue_runtime_sql_params["param_landing_db_name"]
+        self.param_processed_db_name = self.glue_runtime_sql_params["param_processed_db_name"]
+        self.param_s3_landing_bucket_name = self.glue_runtime_sql_params["param_s3_landing_bucket_name"]  # noqa
+
+        self.glue_dest_table_props = (
+            json.loads(args["glue_dest_table_props"])
+            if len(args["glue_dest_table_props"]) > 0
+            else {}
+        )
 
+        param_paths = s3_sql_script_param_key.split(",")
+        self.s3_sql_script_param_path = []
+        for param_path in param_paths:
+            if len(param_path.strip()) > 0:
+                self.s3_sql_script_param_path.append(
+                    f"s3://{self.s3_glue_asset_bucket}/{param_path.strip()}"
+                )
 
-def read_sql_query(sql_qry_select):
-    print("In read_sql_query")
-    df_temp = wr.athena.read_sql_query(sql_qry_select, database=glue_execution_db)  # noqa
-    return df_temp
+        self.dest_table = {}
+        if len(self.glue_dest_table_props) > 0:
+            """
+            Overwrite data = Yes can indicate following scenarios
+                1. Overwrite partition when partition is given
+                2. If partition is not given, overwrites entire table data
+            """
+            self.dest_table["table_name"] = self.glue_dest_table_props["table_name"]
+            self.dest_table["overwrite_data"] = (
+                True if self.glue_dest_table_props["overwrite_data"].lower() == "yes" else False
+            )
+            self.dest_table["table_bucket"] = self.glue_dest_table_props["table_bucket"]
+            self.dest_table["table_db"] = self.glue_dest_table_props["table_db"]
+            self.dest_table["table_partition"] = self.glue_dest_table_props["table_partition"]
 
+        else:
+            logger.info("glue_dest_table_props is missing")
 
-def compact_and_write_to_parquet(df_selected):
-    print("In compact_and_write_to_parquet")
-    write_mode = (
-        "overwrite_partitions"
-        if glue_dest_table_props["overwrite_data"].lower() == "yes"
-        else "append"
-    )
-    list_of_files_output = wr.s3.to_parquet(
-        df=df_selected,
-        dataset=True,
-        partition_cols=list(dest_table["table_partition"].keys()),
-        max_rows_by_file=max_rows_per_file_s3,
-        mode=write_mode,
-        database=dest_table["table_db"],
-        table=dest_table["table_name"],
-    )
-    return list_of_files_output
+        self.rendered_s3_sql_path = ""
 
+    def get_file_content(self, s3_path: str) -> str:
+        if s3_path not in self.shared["files"]:
+            self.shared["files"][s3_path] = get_s3_file_content(s3_path)
+        return self.shared["files"][s3_path]
 
-def check_potential_sql_injection_patterns(value: str) -> bool:
-    """Check for suspicious SQL patterns."""
-    dangerous_patterns = [
-        r'DROP\s+TABLE',  # DROP attacks
-        r'DELETE\s+FROM',  # DELETE attacks
-        r'EXEC\s*\(',  # EXEC attacks
-        r'EXECUTE\s*\(',  # EXECUTE attacks
-        r'xp_cmdshell',  # Command execution
-        r'sys\.',  # System table access
-        r'information_schema\.',  # Information schema access
-    ]
+    def get_jinja_env(self) -> Environment:
+        if self.xtra_files_dir not in self.shared["jinja_envs"]:
+            self.shared["jinja_envs"][self.xtra_files_dir] = Environment(  # nosec
+                loader=FileSystemLoader(self.xtra_files_dir),
+                undefined=StrictUndefined,
+                lstrip_blocks=True,
+            )
+        return self.shared["jinja_envs"][self.xtra_files_dir]
+
+    def get_execution_dates(self) -> list:
+        """Every exec_date from param_execution_start_date to param_execution_end_date"""
+        start_date = datetime.strptime(self.param_execution_start_date, "%Y-%m-%d").date()
+        end_date = datetime.strptime(self.param_execution_end_date, "%Y-%m-%d").date()
+        if end_date < start_date:
+            raise Exception(
+                f"param_execution_end_date {end_date} is before "
+                f"param_execution_start_date {start_date}"
+            )
+        return [
+            (start_date + timedelta(days=i)).strftime("%Y-%m-%d")
+            for i in range((end_date - start_date).days + 1)
+        ]
 
-    return any(re.search(pattern, value, re.IGNORECASE)
-               for pattern in dangerous_patterns)
+    def templatize_query_j2(self, sql_script_path: str, sql_params_path: [str]) -> (str, dict):
+        logger.info("In templatize_query_j2...")
+        sql = self.get_file_content(sql_script_path)
+        render_params = {}
+        rendered_sql = ""
+
+        if self.task_type == "audit":
+            for param_path in sql_params_path:
+                param = json.loads(self.get_file_content(param_path))
+                if len(param) > 0:
+                    render_params.update(param)
+
+        render_params.update(self.glue_runtime_sql_params)
+        if self.task_type == "audit":
+            render_params["globals"]["param_exec_date"] = render_params[
+                "param_execution_date"
+            ]
+            render_params["globals"]["param_processed_db_name"] = render_params[
+                "param_processed_db_name"
+            ]
+            audit_meta = {
+                "param_audit_db": f"audit_db_{render_params['globals']['param_stage'].lower()}",
+                "param_audit_table": "audit",
+            }
+            j2_sql = self.get_jinja_env().from_string(sql)
+            rendered_sql = j2_sql.render(
+                configs=render_params["configs"],
+                globals=render_params["globals"],
+                table_select_period_pattern=render_params["table_select_period_pattern"],
+                table_level_where=render_params["table_level_filter"],
+                audit=audit_meta,
+            )
+        else:
+            interested_params = {"param_execution_date": self.param_execution_date \
+                , "param_execution_start_date": self.param_execution_start_date \
+                , "param_execution_end_date": self.param_execution_end_date \
+                , "param_landing_db_name": self.param_landing_db_name \
+                , "param_processed_db_name": self.param_processed_db_name \
+                , "param_s3_landing_bucket_name": self.param_s3_landing_bucket_name}  # noqa
+
+            for key in interested_params:
+                sql = sql.replace("{{ " + key + " }}", interested_params[key])
+            if "{%" in sql:
+                # Templates branching between a full and an incremental run
+                sql = self.get_jinja_env().from_string(sql).render(
+                    param_incremental_source_exec_date=self.param_incremental_source_exec_date,
+                    param_changed_periods=self.param_changed_periods,
+                )
+            rendered_sql = sql
+        return rendered_sql, render_params
+
+    def parameterize_query(self, sql_script_path: str, sql_params_path: str) -> str:
+        logger.info("In parameterize_query...")
+        sql = self.get_file_content(sql_script_path)
+        params = self.get_file_content(sql_params_path)
+        params_dict = json.loads(params)
+        params_dict.update(self.glue_runtime_sql_params)
+        logger.info(f"The params file at {sql_params_path} is empty") if len(
+            params_dict
+        ) < 1 else None
+        if len(sql.strip()) > 5:
+            for param_key, param_value in params_dict.items():
+                sql = sql.replace(param_key, param_value.strip())
+        else:
+            raise Exception(f"Empty SQL file : {sql_script_path}")
+        return sql
 
+    def check_query_results(self, query_status: dict) -> bool:
+        return check_query_results(query_status, can_fetch_no_results=self.can_fetch_no_results)
 
-def default_exec_sql(sql_qrys: str, render_params: dict) -> Union[str, dict[str, Any]]:
-    logger.info("In default_exec_sql")
-    exec_summary = None
+    def start_query_execution(self, sql_qry: str) -> Union[str, dict[str, Any]]:
+        logger.info("In start_query_execution")
+        logger.info(
+            f"Running Statement in {self.glue_execution_db} database: {self.rendered_s3_sql_path} "
+        )
+        # Submitted and waited on apart, a failed query is never resubmitted
+        # on top of its partial output
+        query_execution_id, admission_holder = self.admission.run(
+            self.athena_workgroup, lambda: self.submit_query(sql_qry), keep_slot=True
+        )
+        query_exec_status = self.admission.wait(
+            self.athena_workgroup,
+            admission_holder,
+            lambda: wr.athena.wait_query(
+                query_execution_id=query_execution_id, boto3_session=self.boto3_session
+            ),
+        )
+        logger.info(f"ATHENA RESPONSE start_query_execution = {query_exec_status}")
+        if self.task_type != "audit":
+            self.check_query_results(query_exec_status)
+        return query_exec_status
+
+    def submit_query(self, sql_qry: str) -> str:
+        """
+        StartQueryExecution, read queries use Athena query result reuse of a
+        run of the same SQL within the max age, DML never does
+        """
+        query_params = {
+            "QueryString": sql_qry,
+            "QueryExecutionContext": {"Database": self.glue_execution_db},
+            "WorkGroup": self.athena_workgroup,
+        }
+        if READ_QUERY_PATTERN.match(sql_qry) and self.result_reuse_max_age_mins > 0:
+            query_params["ResultReuseConfiguration"] = {
+                "ResultReuseByAgeConfiguration": {
+                    "Enabled": True,
+                    "MaxAgeInMinutes": self.result_reuse_max_age_mins,
+                }
+            }
+        athena_client = (self.boto3_session or boto3).client("athena")
+        return athena_client.start_query_execution(**query_params)["QueryExecutionId"]
+
+    def submit_query_execution(self, sql_qry: str) -> dict:
+        logger.info("In submit_query_execution")
+        # The slot is held until the completion releases it
+        query_execution_id, admission_holder = self.admission.run(
+            self.athena_workgroup, lambda: self.submit_query(sql_qry), keep_slot=True
+        )
+        get_callback_table().put_item(
+            Item={
+                "query_execution_id": query_execution_id,
+                "athena_workgroup": self.athena_workgroup,
+                "athena_admission_table": self.athena_admission_table,
+                "athena_admission_slots": self.admission.slots,
+                "admission_holder": admission_holder,
+                "task_token": self.callback_task_token,
+                "task_type": self.task_type,
+                "can_fetch_no_results": self.can_fetch_no_results,
+                "glue_job_name": self.glue_job_name,
+                "rendered_sql": self.rendered_s3_sql_path,
+                "expires_at": int(datetime.now().timestamp()) + CALLBACK_TOKEN_TTL_SECONDS,
+            }
+        )
+        logger.info(f"Submitted {query_execution_id}, the step resumes on its state change")
+        # A query done before its token was stored got no state change to act on
+        query_state = boto3.client("athena").get_query_execution(
+            QueryExecutionId=query_execution_id
+        )["QueryExecution"]["Status"]["State"]
+        if query_state in ATHENA_TERMINAL_STATES:
+            complete_query_callback(query_execution_id)
+        return {"QueryExecutionId": query_execution_id, "Status": {"State": query_state}}
+
+    def get_data_grain_partition(self):
+        # DATA_GRAIN_PARTITIONS
+        if self.pipeline_name.lower().find("tank") >= 0:
+            if self.glue_runtime_sql_params["monthly"].lower() == "true":
+                return [DATA_GRAIN_PARTITIONS["daily"], DATA_GRAIN_PARTITIONS["monthly"]]
+            else:
+                return [DATA_GRAIN_PARTITIONS["daily"]]
+        else:
+            raise Exception("invalid partitions in get_data_grain_partition")
+
+    def update_partition_values(self, partitions: dict, params: dict) -> (dict, bool):
+        logger.info("In update_partition_values...")
+        multiple_sub_partitions = False
+        for partition in partitions:
+            if self.task_type == "audit":
+                if "pipeline" in partition:
+                    partitions["pipeline"] = params["globals"]["param_pipeline_name"]
+                if "exec_date" in partition:
+                    partitions["exec_date"] = params["globals"]["param_exec_date"]
+                if "table_name" in partition:
+                    partitions["table_name"] = params["globals"]["param_audited_table_name"]
+                if "time_grain" in partition:
+                    partitions["time_grain"] = params["globals"]["param_grain"]
+            else:
+                if "exec_date" in partition:
+                    partitions["exec_date"] = params["param_execution_date"]
+                if "data_grain" in partition:
+                    partitions["data_grain"] = self.get_data_grain_partition()
+                    multiple_sub_partitions = True
+
+        return partitions, multiple_sub_partitions
+
+    def construct_partition_path(self, partitions: dict, params: dict) -> list:
+        logger.info("In construct_partition_path...")
+        partition_path = []
+        prefix = ""
+        partitions_with_value, is_sub_partitions = self.update_partition_values(
+            partitions=partitions, params=params
+        )
+        # for partition in partitions_with_value.items():
+        if self.task_type == "data-transform":
+            for partition_key, partition_value in partitions_with_value.items():
+                if is_sub_partitions:
+                    if type(partition_value).__name__ == "list":
+                        for sub_part in partition_value:
+                            partition_path.append(f"{prefix}{partition_key}={sub_part}/")
+                    else:
+                        prefix = f"{partition_key}={partition_value}/"
+                else:
+                    partition_path.append(f"{partition_key}={partition_value}/")
+        elif self.task_type == "audit":
+            audit_partition_path = ""
+            for partition_key, partition_value in partitions_with_value.items():
+                audit_partition_path = (
+                        audit_partition_path + f"{partition_key}={partition_value}/"
+                )
+            partition_path.append(audit_partition_path)
+        return partition_path
+
+    def read_sql_query(self, sql_qry_select):
+        print("In read_sql_query")
+        df_temp = wr.athena.read_sql_query(
+            sql_qry_select,
+            database=self.glue_execution_db,
+            workgroup=self.athena_workgroup,
+            boto3_session=self.boto3_session,
+        )
+        return df_temp
+
+    def compact_and_write_to_parquet(self, df_selected):
+        print("In compact_and_write_to_parquet")
+        write_mode = (
+            "overwrite_partitions"
+            if self.glue_dest_table_props["overwrite_data"].lower() == "yes"
+            else "append"
+        )
+        list_of_files_output = wr.s3.to_parquet(
+            df=df_selected,
+            dataset=True,
+            partition_cols=list(self.dest_table["table_partition"].keys()),
+            max_rows_by_file=max_rows_per_file_s3,
+            mode=write_mode,
+            database=self.dest_table["table_db"],
+            table=self.dest_table["table_name"],
+            boto3_session=self.boto3_session,
+        )
+        return list_of_files_output
 
-    def clean_up_partition():
-        logger.info("In default_exec_sql -> clean_up_partition")
+    def clean_up_partition(self, render_params: dict):
+        logger.info("In clean_up_partition")
         logger.info(
             "Destination table exists and query execution "
             "will insert and overwrite with new data"
         )
+        dest_table = self.dest_table
         table_paths = []
         if len(dest_table["table_partition"]) > 0:
             # fmt: off
-            if (task_type == 'data-transform' and len(dest_table['table_partition']) <= 2) or \
-                    (task_type == 'audit' and len(dest_table['table_partition']) == 4):
-                partition_path = construct_partition_path(partitions=dest_table['table_partition'],  # noqa
-                                                          params=render_params)
+            if (self.task_type == 'data-transform' and len(dest_table['table_partition']) <= 2) or \
+                    (self.task_type == 'audit' and len(dest_table['table_partition']) == 4):
+                if self.task_type == 'data-transform':
+                    # One set of partitions per exec_date of a set-based run
+                    partition_path = [
+                        path
+                        for exec_date in self.get_execution_dates()
+                        for path in self.construct_partition_path(partitions=dict(dest_table['table_partition']),  # noqa
+                                                                  params={**render_params, "param_execution_date": exec_date})  # noqa
+                    ]
+                else:
+                    partition_path = self.construct_partition_path(partitions=dest_table['table_partition'],  # noqa
+                                                                   params=render_params)
                 # fmt: on
                 for partition in partition_path:
                     table_paths.append(
@@ -397,8 +639,8 @@ def default_exec_sql(sql_qrys: str, render_params: dict) -> Union[str, dict[str,
                     )
             else:
                 raise Exception(
-                    f"Received table = {glue_dest_table_props['table_name']} with "
-                    f"task type = {task_type} and "
+                    f"Received table = {self.glue_dest_table_props['table_name']} with "
+                    f"task type = {self.task_type} and "
                     f"{len(dest_table['table_partition'])} partitions ="
                     f" {dest_table['table_partition']} \n"
                     f"Currently partitions for data-transform can be max 2 levels "
@@ -416,19 +658,25 @@ def default_exec_sql(sql_qrys: str, render_params: dict) -> Union[str, dict[str,
                 f"s3://{dest_table['table_bucket']}/{table_path}"
             )
 
-    if "overwrite_data" in dest_table:
-        if dest_table["overwrite_data"]:
-            clean_up_partition()
+    def default_exec_sql(self, sql_qrys: str, render_params: dict) -> Union[str, dict[str, Any]]:
+        logger.info("In default_exec_sql")
+        exec_summary = None
 
-    for sql_query in sql_qrys.split(";"):
-        sql_query = sql_query.strip()
-        if sql_query != "":
+        if "overwrite_data" in self.dest_table:
+            if self.dest_table["overwrite_data"]:
+                self.clean_up_partition(render_params=render_params)
+
+        sql_queries = [q.strip() for q in sql_qrys.split(";") if q.strip() != ""]
+        for i, sql_query in enumerate(sql_queries):
             if check_potential_sql_injection_patterns(sql_query):
                 raise Exception(
                     f"Potential SQL injection detected in query: {sql_query}"
                 )
 
-            exec_summary = start_query_execution(sql_query)
+            if self.callback_task_token and i == len(sql_queries) - 1:
+                return self.submit_query_execution(sql_query)
+
+            exec_summary = self.start_query_execution(sql_query)
             logger.info(
                 f"Execution Summary : \n"
                 f"EXECUTION ID  : {exec_summary['QueryExecutionId']}  \n"
@@ -436,45 +684,120 @@ def default_exec_sql(sql_qrys: str, render_params: dict) -> Union[str, dict[str,
                 f"STATISTICS    : {exec_summary['Statistics']} \n"
             )
 
-    return exec_summary
+        return exec_summary
 
+    def exec_sql(
+            self, sql_qrys: str, render_params: dict, compact_results: bool = False
+    ) -> Union[str, dict[str, Any]]:
+        return self.default_exec_sql(sql_qrys=sql_qrys, render_params=render_params)
 
-def exec_sql(
-        sql_qrys: str, render_params: dict, compact_results: bool = False
-) -> Union[str, dict[str, Any]]:
-    return default_exec_sql(sql_qrys=sql_qrys, render_params=render_params)
+    def exec_athena_script(self, sql_script_path: str, sql_params_path: [str]):
+        logger.info("In exec_athena_script...")
+        try:
+            template_rendered_query, render_params = self.templatize_query_j2(
+                sql_script_path=sql_script_path, sql_params_path=sql_params_path
+            )
 
+            upload_rendered_sql_path = ""
+            step_execution_id = self.step_execution_id
+            # fmt: off
+            step_exec_id = step_execution_id[step_execution_id.rfind(":") + 1:len(step_execution_id)]  # noqa
+            # fmt: on
+            path_prefix_1 = f"pipeline_executions/{self.pipeline_name}"
+            path_prefix_2 = f"{self.start_dttm}-{step_exec_id}/" f"{self.glue_job_name}_rendered.sql"
+            if self.task_type == "audit":
+                upload_rendered_sql_path = f"{path_prefix_1}/{render_params['globals']['param_exec_date']}/{path_prefix_2}"  # noqa
+            else:
+                upload_rendered_sql_path = f"{path_prefix_1}/{self.param_execution_date}/{path_prefix_2}"  # noqa
+            self.rendered_s3_sql_path = s3_upload_file(  # noqa
+                dest_bucket=self.s3_glue_asset_bucket,
+                dest_prefix=upload_rendered_sql_path,
+                content=template_rendered_query,
+            )
 
-def exec_athena_script(sql_script_path: str, sql_params_path: [str]):
-    logger.info("In exec_athena_script...")
-    try:
-        template_rendered_query, render_params = templatize_query_j2(
-            sql_script_path=sql_script_path, sql_params_path=sql_params_path
-        )
+            exec_summary = self.exec_sql(  # noqa
+                template_rendered_query,
+                render_params=render_params,
+            )
+            return exec_summary
+        except Exception as e:
+            logger.debug(e)
+            raise
 
-        upload_rendered_sql_path = ""
-        # fmt: off
-        step_exec_id = step_execution_id[step_execution_id.rfind(":") + 1:len(step_execution_id)]  # noqa
-        # fmt: on
-        path_prefix_1 = f"pipeline_executions/{pipeline_name}"
-        path_prefix_2 = f"{start_dttm}-{step_exec_id}/" f"{glue_job_name}_rendered.sql"
-        if task_type == "audit":
-            upload_rendered_sql_path = f"{path_prefix_1}/{render_params['globals']['param_exec_date']}/{path_prefix_2}"  # noqa
-        else:
-            upload_rendered_sql_path = f"{path_prefix_1}/{param_execution_date}/{path_prefix_2}"  # noqa
-        rendered_s3_sql_path = s3_upload_file(  # noqa
-            dest_bucket=s3_glue_asset_bucket,
-            dest_prefix=upload_rendered_sql_path,
-            content=template_rendered_query,
-        )
+    def execute(self):
+        return self.exec_athena_script(self.s3_sql_script_path, self.s3_sql_script_param_path)
 
-        exec_summary = exec_sql(  # noqa
-            template_rendered_query,
-            render_params=render_params,
-        )
-    except Exception as e:
-        logger.debug(e)
-        raise
+    def purge(self) -> bool:
+        """
+        Purge ahead of a query run by the Step Functions Athena integration,
+        data-transform partitions come from the runtime params alone
+        """
+        logger.info("In purge")
+        if self.dest_table.get("overwrite_data"):
+            self.clean_up_partition(render_params=self.glue_runtime_sql_params)
+            return True
+        return False
+
+
+def lambda_handler(event, context):
+    """
+    Athena executor lambda, event["payload"] carries the Glue job arguments
+    without the leading "--". purge_only = "true" only purges the destination
+    partitions of a native Athena step. With a callback_task_token the SQL
+    is submitted and the step resumes on the query state change.
+    """
+    print(f"Athena executor payload = {event}")
+    args = event["payload"]
+    missing = [name for name in ARGUMENT_NAMES if name not in args]
+    if missing:
+        raise Exception(f"Missing executor arguments {missing}")
+    executor = AthenaQueryExecutor(args=args, xtra_files_dir=LAMBDA_MACROS_DIR)
+    if args.get("purge_only", "false").lower() == "true":
+        return {"purged": executor.purge()}
+    exec_summary = executor.execute() or {}
+    return {
+        "rendered_sql": executor.rendered_s3_sql_path,
+        "query_execution_id": exec_summary.get("QueryExecutionId"),
+        "state": exec_summary.get("Status", {}).get("State"),
+    }
+
+
+def query_state_change_handler(event, context):
+    """
+    EventBridge "Athena Query State Change" on a terminal state, resumes
+    the step function of a callback run
+    """
+    logger.debug(f"Athena query state change = {event}")
+    detail = event["detail"]
+    if detail["currentState"] not in ATHENA_TERMINAL_STATES:
+        return {"completed": False}
+    return {"completed": complete_query_callback(detail["queryExecutionId"])}
 
 
-exec_athena_script(s3_sql_script_path, s3_sql_script_param_path)
+def run_glue_task(args: dict, xtra_files_dir: str):
+    """
+    Glue job entry. The step only retries runs that did not start, failed
+    runs are retried here as a whole, so the destination is purged again,
+    fatal errors excepted.
+    """
+    attempt = 0
+    while True:
+        try:
+            return AthenaQueryExecutor(args=args, xtra_files_dir=xtra_files_dir).execute()
+        except AthenaFatalError:
+            raise
+        except Exception:
+            if attempt >= MAX_TRANSIENT_RETRIES:
+                raise
+            logger.exception(f"Task {args['glue_job_name']} attempt {attempt + 1} failed")
+            time.sleep(get_backoff_seconds(attempt))
+            attempt += 1
+
+
+if __name__ == "__main__":
+    from awsglue.utils import getResolvedOptions  # noqa
+
+    run_glue_task(
+        args=getResolvedOptions(sys.argv, ARGUMENT_NAMES),
+        xtra_files_dir=os.environ["EXTRA_FILES_DIR"],
+    )
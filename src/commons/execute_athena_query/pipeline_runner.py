@@ -0,0 +1,167 @@
+"""
+Runs a task of a pipeline in one Glue pythonshell job shared by all tasks.
+
+--pipeline_tasks holds the tasks of the pipeline DAG, every task with the
+executor arguments of its own Glue job ( without the leading "--" ) and
+its retry policy. Every run executes the task named by --task_filter,
+the state machine has one step per task and schedules them.
+
+The task is retried here with its policy, Athena fatal errors excepted,
+the step itself only retries runs that did not start. Its status is
+written to the glue asset bucket next to the rendered SQL, a run of a
+task that already succeeded for the execution is skipped.
+"""
+import json
+import logging
+import os
+import random
+import sys
+import time
+
+import boto3
+
+from athena_admission import AthenaFatalError
+from exec_athena_query import (
+    ARGUMENT_NAMES,
+    AthenaQueryExecutor,
+    get_s3_file_content,
+    s3_upload_file,
+)
+
+logging.basicConfig()
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+
+RUNNER_ARGUMENT_NAMES = [
+    "pipeline_tasks",
+    "task_filter",
+    "s3_glue_asset_bucket",
+    "pipeline_name",
+    "glue_job_name",
+    "param_execution_date",
+    "glue_runtime_sql_params",
+    "step_execution_id",
+    "start_dttm",
+    "env",
+]
+
+# Arguments of the step, the same for every task of the run
+RUN_ARGUMENT_NAMES = [
+    "param_execution_date",
+    "glue_runtime_sql_params",
+    "step_execution_id",
+    "start_dttm",
+    "env",
+]
+
+
+class PipelineRunner(object):
+    def __init__(self, args: dict, xtra_files_dir: str):
+        self.args = args
+        self.xtra_files_dir = xtra_files_dir
+        self.tasks = {task["job_name"]: task for task in json.loads(args["pipeline_tasks"])}
+        self.task_filter = args["task_filter"]
+        self.shared = {}
+
+        step_execution_id = args["step_execution_id"]
+        # fmt: off
+        step_exec_id = step_execution_id[step_execution_id.rfind(":") + 1:]
+        # fmt: on
+        self.status_key = (
+            f"pipeline_executions/{args['pipeline_name']}/{args['param_execution_date']}/"
+            f"{args['start_dttm']}-{step_exec_id}/{args['task_filter']}_status.json"
+        )
+
+    def get_previous_status(self) -> dict:
+        logger.info("In get_previous_status")
+        return json.loads(
+            get_s3_file_content(f"s3://{self.args['s3_glue_asset_bucket']}/{self.status_key}")
+        )
+
+    def write_status(self, status: dict):
+        logger.info("In write_status")
+        s3_upload_file(
+            dest_bucket=self.args["s3_glue_asset_bucket"],
+            dest_prefix=self.status_key,
+            content=json.dumps(status, indent=4),
+        )
+
+    def get_task_args(self, task: dict) -> dict:
+        task_args = dict(task["args"])
+        task_args.update({name: self.args[name] for name in RUN_ARGUMENT_NAMES})
+        missing = [name for name in ARGUMENT_NAMES if name not in task_args]
+        if missing:
+            raise Exception(f"Missing arguments {missing} of task {task['job_name']}")
+        return task_args
+
+    def get_retry_delay(self, retry: dict, attempt: int) -> float:
+        """Same backoff as the Step Functions retry of a task step"""
+        delay = min(
+            retry["interval_seconds"] * retry["backoff_rate"] ** (attempt - 1),
+            retry["max_delay_seconds"],
+        )
+        return random.uniform(0, delay) if retry["jitter"] else delay  # nosec
+
+    def run_task(self, task: dict) -> dict:
+        logger.info(f"In run_task {task['job_name']}")
+        retry = task["retry"]
+        started = time.time()
+        status = {"state": "FAILED", "attempts": 0}
+        while status["attempts"] <= retry["max_attempts"]:
+            if status["attempts"] > 0:
+                time.sleep(self.get_retry_delay(retry, status["attempts"]))
+            status["attempts"] += 1
+            try:
+                executor = AthenaQueryExecutor(
+                    args=self.get_task_args(task),
+                    xtra_files_dir=self.xtra_files_dir,
+                    shared=self.shared,
+                    boto3_session=boto3.Session(),
+                )
+                exec_summary = executor.execute() or {}
+                status.update(
+                    {
+                        "state": "SUCCEEDED",
+                        "rendered_sql": executor.rendered_s3_sql_path,
+                        "query_execution_id": exec_summary.get("QueryExecutionId"),
+                        "error": None,
+                    }
+                )
+                break
+            except AthenaFatalError as e:
+                logger.exception(f"Task {task['job_name']} failed, not retried")
+                status.update({"error": str(e), "fatal": True})
+                break
+            except Exception as e:
+                logger.exception(f"Task {task['job_name']} attempt {status['attempts']} failed")
+                status["error"] = str(e)
+        status["seconds"] = round(time.time() - started, 1)
+        return status
+
+    def run(self) -> dict:
+        logger.info("In run")
+        if self.task_filter not in self.tasks:
+            raise Exception(f"Unknown task {self.task_filter}, tasks : {list(self.tasks)}")
+        status = self.get_previous_status()
+        if status.get("state") == "SUCCEEDED":
+            logger.info(f"Task {self.task_filter} succeeded in a previous run, skipping")
+            return status
+        status = self.run_task(self.tasks[self.task_filter])
+        self.write_status(status)
+        logger.info(f"Task status : {json.dumps(status, indent=4)}")
+        if status["state"] != "SUCCEEDED":
+            error = AthenaFatalError if status.get("fatal") else Exception
+            raise error(
+                f"Task {self.task_filter} failed, see s3://{self.args['s3_glue_asset_bucket']}/"
+                f"{self.status_key}"
+            )
+        return status
+
+
+if __name__ == "__main__":
+    from awsglue.utils import getResolvedOptions  # noqa
+
+    PipelineRunner(
+        args=getResolvedOptions(sys.argv, RUNNER_ARGUMENT_NAMES),
+        xtra_files_dir=os.environ["EXTRA_FILES_DIR"],
+    ).run()
@@ -1,22 +1,59 @@
+{% set incremental = param_incremental_source_exec_date != "" %}
+{% set changed_dates %}{% for period in param_changed_periods %}date('{{ period }}'){{ ", " if not loop.last }}{% endfor %}{% endset %}
+{% macro changed_periods_filter() %}
+{% if incremental and param_changed_periods %}
+		and date(operating_datetime_utc) in ({{ changed_dates }})
+		and operating_datetime_utc >= timestamp '{{ param_changed_periods[0] }} 00:00:00'
+		and operating_datetime_utc < date_add('day', 1, timestamp '{{ param_changed_periods[-1] }} 00:00:00')
+{% elif incremental %}
+		and false
+{% endif %}
+{% endmacro %}
 insert into {{ param_processed_db_name }}.utility_emissions_daily
 with oh_emissions as (
-	select date(operating_datetime_utc) as record_date,
+	select exec_date,
+		date(operating_datetime_utc) as record_date,
 		sum(co2_mass_tons) as co2_ton
 	from {{ param_landing_db_name }}.utility_data_oh
-	where exec_date=date('{{ param_execution_date }}')
-	group by 1
+	where exec_date between date('{{ param_execution_start_date }}')
+		and date('{{ param_execution_end_date }}')
+{{ changed_periods_filter() }}
+	group by 1, 2
 ),
 in_emissions as (
-	select date(operating_datetime_utc) as record_date,
+	select exec_date,
+		date(operating_datetime_utc) as record_date,
 		sum(co2_mass_tons) as co2_ton
 	from {{ param_landing_db_name }}.utility_data_in
-	where exec_date=date('{{ param_execution_date }}')
-	group by 1
+	where exec_date between date('{{ param_execution_start_date }}')
+		and date('{{ param_execution_end_date }}')
+{{ changed_periods_filter() }}
+	group by 1, 2
+),
+recomputed as (
+	select coalesce(oh.record_date, rr.record_date) as record_date,
+		oh.co2_ton as co2_ton_oh,
+		rr.co2_ton as co2_ton_in,
+		(oh.co2_ton + rr.co2_ton) as co2_ton_total,
+		coalesce(oh.exec_date, rr.exec_date) as exec_date
+	from oh_emissions oh
+		full outer join in_emissions rr on oh.exec_date = rr.exec_date
+		and oh.record_date = rr.record_date
 )
-select coalesce(oh.record_date, rr.record_date) as record_date,
-	oh.co2_ton as co2_ton_oh,
-	rr.co2_ton as co2_ton_in,
-	(oh.co2_ton + rr.co2_ton) as co2_ton_total,
+{% if incremental %}
+-- Periods whose landing rows did not change since the source exec_date
+select * from recomputed
+union all
+select record_date,
+	co2_ton_oh,
+	co2_ton_in,
+	co2_ton_total,
 	date('{{ param_execution_date }}') as exec_date
-from oh_emissions oh
-	full outer join in_emissions rr on oh.record_date = rr.record_date
\ No newline at end of file
+from {{ param_processed_db_name }}.utility_emissions_daily
+where exec_date = date('{{ param_incremental_source_exec_date }}')
+{% if param_changed_periods %}
+	and (record_date is null or record_date not in ({{ changed_dates }}))
+{% endif %}
+{% else %}
+select * from recomputed
+{% endif %}
@@ -1,21 +1,18 @@
-insert into {{ param_processed_db_name }}.utility_emissions_monthly with oh_emissions as (
-		select date_format(operating_datetime_utc, '%Y%m') as record_month,
-			sum(co2_mass_tons) as co2_ton
-		from {{ param_landing_db_name }}.utility_data_oh
-		where exec_date = date('{{ param_execution_date }}')
-		group by 1
-	),
-	in_emissions as (
-		select date_format(operating_datetime_utc, '%Y%m') as record_month,
-			sum(co2_mass_tons) as co2_ton
-		from {{ param_landing_db_name }}.utility_data_in
-		where exec_date = date('{{ param_execution_date }}')
-		group by 1
-	)
-select coalesce(oh.record_month, rr.record_month) as record_month,
-	oh.co2_ton as co2_ton_oh,
-	rr.co2_ton as co2_ton_in,
-	(oh.co2_ton + rr.co2_ton) as co2_ton_total,
-	date('{{ param_execution_date }}') as exec_date
-from oh_emissions oh
-	full outer join in_emissions rr on oh.record_month = rr.record_month
\ No newline at end of file
+-- Generated by cdk/rollup_sql_generator.py from UTILITY_EMISSION_ROLLUP, do not edit
+insert into {{ param_processed_db_name }}.utility_emissions_monthly
+with rolled_up as (
+	select exec_date,
+		date_format(record_date, '%Y%m') as record_month,
+		sum(co2_ton_oh) as co2_ton_oh,
+		sum(co2_ton_in) as co2_ton_in
+	from {{ param_processed_db_name }}.utility_emissions_daily
+	where exec_date between date('{{ param_execution_start_date }}')
+		and date('{{ param_execution_end_date }}')
+	group by 1, 2
+)
+select record_month,
+	co2_ton_oh,
+	co2_ton_in,
+	(co2_ton_oh + co2_ton_in) as co2_ton_total,
+	exec_date
+from rolled_up
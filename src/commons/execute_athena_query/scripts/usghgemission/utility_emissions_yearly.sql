@@ -0,0 +1,18 @@
+-- Generated by cdk/rollup_sql_generator.py from UTILITY_EMISSION_ROLLUP, do not edit
+insert into {{ param_processed_db_name }}.utility_emissions_yearly
+with rolled_up as (
+	select exec_date,
+		substr(record_month, 1, 4) as record_year,
+		sum(co2_ton_oh) as co2_ton_oh,
+		sum(co2_ton_in) as co2_ton_in
+	from {{ param_processed_db_name }}.utility_emissions_monthly
+	where exec_date between date('{{ param_execution_start_date }}')
+		and date('{{ param_execution_end_date }}')
+	group by 1, 2
+)
+select record_year,
+	co2_ton_oh,
+	co2_ton_in,
+	(co2_ton_oh + co2_ton_in) as co2_ton_total,
+	exec_date
+from rolled_up
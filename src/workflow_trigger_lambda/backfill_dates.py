@@ -0,0 +1,221 @@
+#!/usr/bin/python3
+"""
+The Lambda function is responsible for expanding a backfill date range
+into one state machine input per exec_date, and for summarising the
+per date results of the backfill state machine's Distributed Map.
+
+The exec_dates of the range are held in the execution ledger until the
+backfill execution completes, see the execution complete lambda
+"""
+import json
+from datetime import date, datetime, timedelta
+
+import boto3
+
+import config as cfg
+from common.execution_ledger import get_execution_ledger
+from common.log_utils import setup_logger
+
+
+def handler(event, context):
+    """
+    Lambda function is responsible for the following,
+        1. {"payload": {"state_machine_parameter": ..., "execution": ...,
+           "backfill": {"start_date": ..., "end_date": ..., "monthly": "auto",
+           "set_based": "false", "dependents": "true"}}} holds the exec_dates
+           of the range in the execution ledger, or fails when one of them is
+           in flight, and returns {"dates": [...]}, the input the pipeline
+           state machine gets from the trigger for every exec_date of the
+           range. set_based "true" returns one input per
+           BACKFILL_SET_BASED_MAX_DAYS dates instead, the tasks transform
+           the whole sub range in one query. dependents "false" does not
+           backfill the depends_on pipelines once the range succeeded
+        2. {"payload": {"summarize": [...]}} returns the succeeded and
+           failed exec_dates of the map results
+    """
+    ex = BackfillDates(event=event, context=context, cnf=cfg)
+    if "summarize" in event["payload"]:
+        return ex.summarize()
+    return ex.expand_dates()
+
+
+class BackfillDates(object):
+    def __init__(self, event, context, cnf):
+        self.log = setup_logger()
+        self.event = event
+        self.context = context
+        self.cnf = cnf
+        self.payload = event["payload"]
+        self.backfill = self.payload.get("backfill", {})
+        self.ledger = get_execution_ledger(cnf)
+
+    def get_workflow(self, parameter_name: str) -> (dict, dict):
+        """Pipeline and workflow started through the given SSM parameter"""
+        self.log.info("In get_workflow module")
+        for pipeline_props in self.cnf.DATA_PIPELINE.values():
+            for workflow in pipeline_props["workflows"]:
+                if workflow["param_store_state_machine_name"] == parameter_name:
+                    return pipeline_props, workflow
+        raise Exception(f"No pipeline workflow uses state machine {parameter_name}")
+
+    def get_statemachine_arn(self, parameter_name: str) -> str:
+        self.log.info("In get_statemachine_arn module")
+        ssm = boto3.client("ssm")
+        parameter = ssm.get_parameter(Name=parameter_name, WithDecryption=True)
+        return (
+            f"arn:aws:states:{self.cnf.REGION}:{self.cnf.ACCOUNT}:stateMachine:"
+            f"{parameter['Parameter']['Value']}"
+        )
+
+    def hold_dates(self, parameter_name: str, pipeline_props: dict):
+        """
+        Holds the exec_dates of the range in the execution ledger until the
+        backfill execution completes, deliveries for them are recorded as
+        reruns meanwhile. Refuses the range while any of them is in flight.
+        """
+        self.log.info("In hold_dates module")
+        conflicts = self.ledger.hold_backfill(
+            state_machine=self.get_statemachine_arn(parameter_name=parameter_name),
+            exec_dates=[exec_date.strftime("%Y-%m-%d") for exec_date in self.get_exec_dates()],
+            backfill_execution=self.payload["execution"],
+            # what the execution complete lambda needs to backfill the dependents
+            backfill={"pipeline_type": pipeline_props["type"], "input": self.backfill},
+        )
+        if conflicts:
+            raise Exception(
+                f"Backfill refused, exec_date(s) {', '.join(conflicts)} are in flight in "
+                f"the execution ledger, retry once they complete or narrow the range"
+            )
+
+    def get_exec_dates(self) -> list:
+        self.log.info("In get_exec_dates module")
+        start_date = datetime.strptime(self.backfill["start_date"], "%Y-%m-%d").date()
+        end_date = datetime.strptime(
+            self.backfill.get("end_date", self.backfill["start_date"]), "%Y-%m-%d"
+        ).date()
+        days = (end_date - start_date).days + 1
+        if days < 1 or days > self.cnf.BACKFILL_MAX_DAYS:
+            raise Exception(
+                f"Backfill range {start_date} to {end_date} must cover 1 to "
+                f"{self.cnf.BACKFILL_MAX_DAYS} days"
+            )
+        return [start_date + timedelta(days=i) for i in range(days)]
+
+    def get_monthly_flag(self, exec_date: date) -> str:
+        """
+        "auto" runs the monthly tasks for the exec_dates falling on the
+        monthly schedule day, "true" / "false" force them for every date
+        """
+        monthly = self.backfill.get("monthly", "auto").lower()
+        if monthly in ("true", "false"):
+            return monthly
+        return "true" if exec_date.day == self.cnf.MONTHLY_RUN_ON_DAY_SCHEDULE else "false"
+
+    def get_date_ranges(self, pipeline_props: dict) -> list:
+        """(first, last) exec_date of every state machine input"""
+        self.log.info("In get_date_ranges module")
+        exec_dates = self.get_exec_dates()
+        if str(self.backfill.get("set_based", "false")).lower() != "true":
+            return [(exec_date, exec_date) for exec_date in exec_dates]
+        if not pipeline_props.get("set_based_backfill", False):
+            raise Exception(
+                f"Pipeline {pipeline_props['type']} does not support set-based backfills"
+            )
+        size = self.cnf.BACKFILL_SET_BASED_MAX_DAYS
+        return [
+            (exec_dates[i], exec_dates[min(i + size, len(exec_dates)) - 1])
+            for i in range(0, len(exec_dates), size)
+        ]
+
+    def get_date_payload(
+        self,
+        pipeline_props: dict,
+        workflow: dict,
+        exec_date: date,
+        start_dttm: str,
+        end_date: date = None,
+    ) -> dict:
+        """
+        Same shape as the trigger's get_step_function_input, exec_date to
+        end_date is the exec_date range of a set-based run
+        """
+        str_exec_date = exec_date.strftime("%Y-%m-%d")
+        monthly = self.get_monthly_flag(exec_date)
+        step_payload = {"date": str_exec_date, "pipeline_type": pipeline_props["type"]}
+        step_payload.update(pipeline_props.get("step_function_payloads", {}))
+        glue_runtime_sql_params = dict(pipeline_props.get("glue_runtime_sql_params", {}))
+        glue_runtime_sql_params["param_execution_date"] = str_exec_date
+        if end_date is not None:
+            glue_runtime_sql_params["param_execution_start_date"] = str_exec_date
+            glue_runtime_sql_params["param_execution_end_date"] = end_date.strftime(
+                "%Y-%m-%d"
+            )
+        glue_runtime_sql_params["frequency"] = workflow["cadence"]
+        glue_runtime_sql_params["monthly"] = monthly
+        step_payload["glue_runtime_sql_params"] = json.dumps(glue_runtime_sql_params)
+        step_payload["monthly"] = monthly
+        step_payload["yearly"] = "false"
+        step_payload["frequency"] = workflow["cadence"]
+        step_payload["start_dttm"] = start_dttm
+        step_payload["env"] = self.cnf.STAGE
+        # Map iterations are not ledger runs, see execution_complete lambda
+        step_payload["backfill"] = "true"
+        return step_payload
+
+    def expand_dates(self) -> dict:
+        """Driver module of the date expansion"""
+        self.log.info("Started Backfill Dates")
+        pipeline_props, workflow = self.get_workflow(
+            parameter_name=self.payload["state_machine_parameter"]
+        )
+        self.hold_dates(
+            parameter_name=self.payload["state_machine_parameter"], pipeline_props=pipeline_props
+        )
+        start_dttm = datetime.now().strftime("%Y%m%d%H%M%S")
+        dates = [
+            self.get_date_payload(
+                pipeline_props=pipeline_props,
+                workflow=workflow,
+                exec_date=first_date,
+                start_dttm=start_dttm,
+                end_date=last_date if last_date != first_date else None,
+            )
+            for first_date, last_date in self.get_date_ranges(pipeline_props)
+        ]
+        self.log.info(
+            f"Backfill of {pipeline_props['type']} expanded to {len(dates)} input(s)"
+        )
+        return {"dates": dates}
+
+    def summarize(self) -> dict:
+        """Driver module of the result summary"""
+        self.log.info("Started Backfill Summary")
+        summary = {"succeeded": [], "failed": []}
+        for result in self.payload["summarize"] or []:
+            if result.get("status") == "SUCCEEDED":
+                summary["succeeded"].append(result["exec_date"])
+            else:
+                summary["failed"].append(result)
+        summary["succeeded"].sort()
+        summary["failed"].sort(key=lambda result: result.get("exec_date", ""))
+        summary["succeeded_count"] = len(summary["succeeded"])
+        summary["failed_count"] = len(summary["failed"])
+        self.log.info(
+            f"Backfill succeeded = {summary['succeeded_count']}, "
+            f"failed = {summary['failed_count']}"
+        )
+        return summary
+
+
+if __name__ == "__main__":
+    """Run Lambda Function locally"""
+    from pprint import pprint as pp
+
+    PAYLOAD = {
+        "payload": {
+            "state_machine_parameter": "/pipeline/sm-usghg-emission-factor-daily",
+            "execution": "local-backfill",
+            "backfill": {"start_date": "2024-01-01", "end_date": "2024-01-03"},
+        }
+    }
+    pp(handler(PAYLOAD, {}))
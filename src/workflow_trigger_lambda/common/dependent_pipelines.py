@@ -0,0 +1,169 @@
+"""
+Completion of a pipeline for an exec_date.
+
+The {pipeline}.completed marker is written and the pipelines declaring
+depends_on for it are registered in the execution ledger for the same
+exec_date. The execution complete lambda completes a pipeline when its
+execution succeeds, the workflow trigger when the fingerprint fast path
+keeps the outputs of an unchanged delivery without an execution.
+
+A succeeded backfill starts the backfill state machines of the depends_on
+pipelines over the same range, unless its input sets dependents "false".
+"""
+import json
+
+import boto3
+
+from common.execution_ledger import DECISION_START, STATUS_FAILED
+from common.incremental_recompute import INCREMENTAL_SQL_PARAMS, INCREMENTAL_TABLES_KEY
+
+
+class DependentPipelines(object):
+    def __init__(self, cnf, ledger, run_starter, log):
+        self.cnf = cnf
+        self.ledger = ledger
+        self.run_starter = run_starter
+        self.log = log
+        self.s3 = boto3.client("s3")
+        self.ssm = boto3.client("ssm")
+        self.step_function = boto3.client("stepfunctions")
+
+    def get_pipeline(self, pipeline_type: str) -> (str, dict):
+        for control_file, pipeline_props in self.cnf.DATA_PIPELINE.items():
+            if pipeline_props["type"] == pipeline_type:
+                return control_file, pipeline_props
+        return None, None
+
+    def get_statemachine_arn(self, parameter_name: str) -> str:
+        self.log.info("In get_statemachine_arn module")
+        parameter = self.ssm.get_parameter(Name=parameter_name, WithDecryption=True)
+        return (
+            f"arn:aws:states:{self.cnf.REGION}:{self.cnf.ACCOUNT}:stateMachine:"
+            f"{parameter['Parameter']['Value']}"
+        )
+
+    def create_completed_marker(self, pipeline_props: dict, exec_date: str) -> str:
+        """Marker formerly written by the done file lambda as the last state"""
+        self.log.info("In create_completed_marker module")
+        key = (
+            f"{pipeline_props['incoming_path']}/{exec_date}/"
+            f"{pipeline_props['type']}.completed"
+        )
+        self.s3.put_object(Bucket=self.cnf.S3_LANDING_BUCKET_NAME, Key=key, Body=b"")
+        self.log.info(f"Created s3://{self.cnf.S3_LANDING_BUCKET_NAME}/{key}")
+        return key
+
+    def get_dependent_payload(
+        self, upstream_input: dict, pipeline_props: dict, workflow: dict
+    ) -> dict:
+        """
+        Upstream payload with the dependent's own pipeline settings, the
+        exec_date and computed runtime parameters are carried over as is,
+        the incremental parameters of the upstream run excepted
+        """
+        self.log.info("In get_dependent_payload module")
+        step_payload = dict(upstream_input)
+        step_payload.pop(INCREMENTAL_TABLES_KEY, None)
+        step_payload["pipeline_type"] = pipeline_props["type"]
+        step_payload.update(pipeline_props.get("step_function_payloads", {}))
+        glue_runtime_sql_params = json.loads(
+            upstream_input.get("glue_runtime_sql_params", "{}")
+        )
+        for name in INCREMENTAL_SQL_PARAMS:
+            glue_runtime_sql_params.pop(name, None)
+        glue_runtime_sql_params.update(pipeline_props.get("glue_runtime_sql_params", {}))
+        glue_runtime_sql_params["frequency"] = workflow["cadence"]
+        step_payload["glue_runtime_sql_params"] = json.dumps(glue_runtime_sql_params)
+        step_payload["frequency"] = workflow["cadence"]
+        return step_payload
+
+    def start_dependents(
+        self, upstream_pipeline: str, upstream_input: dict, event_token: str, fingerprint: str
+    ) -> list:
+        self.log.info("In start_dependents module")
+        responses = []
+        exec_date = upstream_input["date"]
+        for control_file, pipeline_props in self.cnf.DATA_PIPELINE.items():
+            if upstream_pipeline not in pipeline_props.get("depends_on", []):
+                continue
+            if pipeline_props["trigger_statemachine"].lower() != "true":
+                continue
+            for workflow in pipeline_props["workflows"]:
+                state_machine = self.get_statemachine_arn(
+                    parameter_name=workflow["param_store_state_machine_name"]
+                )
+                step_payload = self.get_dependent_payload(
+                    upstream_input=upstream_input,
+                    pipeline_props=pipeline_props,
+                    workflow=workflow,
+                )
+                decision = self.ledger.register(
+                    state_machine=state_machine,
+                    exec_date=exec_date,
+                    payload=step_payload,
+                    event_token=event_token,
+                    fingerprint=fingerprint,
+                )
+                self.log.info(f"Dependent {control_file} for {exec_date} : {decision}")
+                if decision != DECISION_START:
+                    responses.append({"exec_date": exec_date, "status": decision})
+                    continue
+                response = self.run_starter.start_run(
+                    state_machine=state_machine,
+                    run={"exec_date": exec_date, "payload": step_payload},
+                )
+                responses.append(response)
+                if response["status"] == STATUS_FAILED:
+                    # The dependent holds its slot, queued dates behind it start instead
+                    responses.extend(
+                        self.run_starter.complete_and_start_next(
+                            state_machine=state_machine,
+                            exec_date=exec_date,
+                            status=STATUS_FAILED,
+                        )
+                    )
+        return responses
+
+    def complete(
+        self, pipeline_type: str, upstream_input: dict, event_token: str, fingerprint: str
+    ) -> list:
+        """Marks pipeline_type completed for the input's exec_date and starts its dependents"""
+        self.log.info("In complete module")
+        upstream_pipeline, pipeline_props = self.get_pipeline(pipeline_type)
+        if upstream_pipeline is None:
+            return []
+        self.create_completed_marker(
+            pipeline_props=pipeline_props, exec_date=upstream_input["date"]
+        )
+        return self.start_dependents(
+            upstream_pipeline=upstream_pipeline,
+            upstream_input=upstream_input,
+            event_token=event_token,
+            fingerprint=fingerprint,
+        )
+
+    def start_dependent_backfills(self, pipeline_type: str, backfill: dict) -> list:
+        """Backfills the pipelines depending on pipeline_type over the same range"""
+        self.log.info("In start_dependent_backfills module")
+        upstream_pipeline, _ = self.get_pipeline(pipeline_type)
+        if upstream_pipeline is None or str(backfill.get("dependents", "true")).lower() != "true":
+            return []
+        responses = []
+        for control_file, pipeline_props in self.cnf.DATA_PIPELINE.items():
+            if upstream_pipeline not in pipeline_props.get("depends_on", []):
+                continue
+            dependent_backfill = dict(backfill)
+            if not pipeline_props.get("set_based_backfill", False):
+                dependent_backfill["set_based"] = "false"
+            for workflow in pipeline_props["workflows"]:
+                response = self.step_function.start_execution(
+                    stateMachineArn=self.get_statemachine_arn(
+                        parameter_name=f"{workflow['param_store_state_machine_name']}-backfill"
+                    ),
+                    input=json.dumps(dependent_backfill),
+                )
+                self.log.info(f"Dependent backfill {control_file} : {response['executionArn']}")
+                responses.append(
+                    {"pipeline": pipeline_props["type"], "execution": response["executionArn"]}
+                )
+        return responses
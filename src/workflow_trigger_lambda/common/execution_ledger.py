@@ -0,0 +1,683 @@
+"""
+Execution ledger keyed by (state machine, exec_date).
+
+Every trigger registers its run through a conditional write, so duplicate
+S3 events coalesce into one run and dates arriving while another run is
+active are queued. A single `#ACTIVE` item per state machine holds the
+exec_date currently running, which makes status lookups a key read, and
+`#LAST_SUCCESS` keeps the input fingerprint of the latest successful run
+and the digest of the period fingerprints it started on.
+The active slot is leased: a slot whose execution was never started or
+never reported completion is reclaimed once the lease expires, and the
+run holding it is closed as ABANDONED.
+
+The same table tracks the ingest stage under `INGEST#<db>.<table>` keys,
+one marker per landing table partition, so a partition shared by several
+pipelines is copied and registered once per exec_date. `READY#<pipeline>`
+keys hold the incoming files received so far for each exec_date folder.
+
+A changed delivery for an exec_date with a run in flight is recorded on
+that run as its `rerun_event`, and replayed once the run completes.
+
+A backfill execution holds the runs of its exec_dates as BACKFILL for its
+whole duration, so deliveries for them are recorded as reruns rather than
+started alongside it. Its `#BACKFILL` item, keyed by the execution, lists
+the held exec_dates to release on its completion.
+"""
+import json
+import threading
+from datetime import datetime, timedelta
+
+import boto3
+from boto3.dynamodb.conditions import Attr, Key
+from botocore.exceptions import ClientError
+
+ACTIVE_SORT_KEY = "#ACTIVE"
+LAST_SUCCESS_SORT_KEY = "#LAST_SUCCESS"
+
+STATUS_PENDING = "PENDING"
+STATUS_QUEUED = "QUEUED"
+STATUS_RUNNING = "RUNNING"
+STATUS_SUCCEEDED = "SUCCEEDED"
+STATUS_FAILED = "FAILED"
+# Delivery identical to the last success, handled by the fingerprint fast path
+STATUS_UNCHANGED = "UNCHANGED"
+# Run whose active slot lease expired before its completion was recorded
+STATUS_ABANDONED = "ABANDONED"
+# Run of an exec_date held by a backfill execution until it completes
+STATUS_BACKFILL = "BACKFILL"
+
+IN_FLIGHT_STATUSES = (STATUS_PENDING, STATUS_QUEUED, STATUS_RUNNING, STATUS_BACKFILL)
+TERMINAL_STATUSES = (
+    STATUS_SUCCEEDED,
+    STATUS_FAILED,
+    STATUS_UNCHANGED,
+    STATUS_ABANDONED,
+    "TIMED_OUT",
+    "ABORTED",
+)
+
+INGEST_KEY_PREFIX = "INGEST#"
+STATUS_INGESTING = "INGESTING"
+STATUS_INGESTED = "INGESTED"
+# Partition registered on another exec_date's files by the fingerprint fast path
+STATUS_ALIASED = "ALIASED"
+# An INGESTING marker older than this is considered abandoned ( Lambda timeout )
+INGEST_LEASE_SECONDS = 900
+
+BACKFILL_SORT_KEY = "#BACKFILL"
+
+READINESS_KEY_PREFIX = "READY#"
+# Window in which concurrent completions of the same delivery write one .done
+DONE_FILE_CLAIM_SECONDS = 60
+
+# Lease of the active slot between its acquisition and start_execution ( Lambda timeout )
+ACTIVE_START_LEASE_SECONDS = 900
+# Lease of the active slot of a started execution, above the state machine timeouts
+ACTIVE_RUN_LEASE_SECONDS = 24 * 3600
+
+# Status of the response of start_run callables, see complete_and_start_next
+RUN_STARTED = "STARTED"
+
+DECISION_START = "START"
+DECISION_QUEUED = "QUEUED"
+DECISION_DUPLICATE = "DUPLICATE"
+
+
+def get_execution_ledger(cnf):
+    """Returns the ledger for the configured backend ( dynamodb | local )"""
+    if cnf.EXECUTION_LEDGER_BACKEND.lower() == "local":
+        return _LOCAL_LEDGER
+    return DynamoDBExecutionLedger(table_name=cnf.EXECUTION_LEDGER_TABLE_NAME)
+
+
+class ExecutionLedger(object):
+    """
+    Ledger workflow shared by all backends. Subclasses implement the
+    conditional primitives against their store.
+    """
+
+    def register(
+        self,
+        state_machine: str,
+        exec_date: str,
+        payload: dict,
+        event_token: str = "",
+        fingerprint: str = "",
+    ) -> str:
+        """
+        Records a run request and returns
+            START     ==> caller owns the active slot and starts the execution
+            QUEUED    ==> another date is active, run starts on its completion
+            DUPLICATE ==> same (state machine, exec_date) already in flight
+        """
+        item = {
+            "state_machine": state_machine,
+            "exec_date": exec_date,
+            "status": STATUS_PENDING,
+            "payload": json.dumps(payload, default=str),
+            "event_token": event_token,
+            "fingerprint": fingerprint,
+            "updated_at": self.now(),
+        }
+        if not self.put_run_if_new(item):
+            return DECISION_DUPLICATE
+
+        if self.acquire_active(state_machine, exec_date):
+            self.update_run(state_machine, exec_date, status=STATUS_RUNNING)
+            return DECISION_START
+
+        self.update_run(state_machine, exec_date, status=STATUS_QUEUED)
+        # The active run may have completed between the first attempt and
+        # the QUEUED write, in which case nobody would pick this date up.
+        if self.acquire_active(state_machine, exec_date):
+            self.update_run(state_machine, exec_date, status=STATUS_RUNNING)
+            return DECISION_START
+        return DECISION_QUEUED
+
+    def acquire_active(self, state_machine: str, exec_date: str) -> bool:
+        """
+        Takes the active slot when it is free or its lease expired. The run
+        holding an expired slot is closed as ABANDONED.
+        """
+        acquired, stale_exec_date = self.put_active_if_free(
+            state_machine,
+            exec_date,
+            now=self.now(),
+            lease_expires=self.get_expiry(ACTIVE_START_LEASE_SECONDS),
+        )
+        if acquired and stale_exec_date not in (None, exec_date):
+            stale_run = self.get_run(state_machine, stale_exec_date)
+            if stale_run is not None and stale_run.get("status") in IN_FLIGHT_STATUSES:
+                self.update_run(state_machine, stale_exec_date, status=STATUS_ABANDONED)
+        return acquired
+
+    def mark_started(self, state_machine: str, exec_date: str, execution_arn: str):
+        self.update_run(state_machine, exec_date, execution_arn=execution_arn)
+        # The execution runs past the start lease, the slot is released on completion
+        self.extend_active(
+            state_machine, exec_date, lease_expires=self.get_expiry(ACTIVE_RUN_LEASE_SECONDS)
+        )
+
+    def complete(self, state_machine: str, exec_date: str, status: str) -> (dict, None):
+        """
+        Records the terminal status, releases the active slot and claims the
+        oldest queued date. Returns the claimed run for the caller to start.
+        """
+        run = self.get_run(state_machine, exec_date)
+        if run is not None:
+            self.update_run(state_machine, exec_date, status=status)
+            if status == STATUS_SUCCEEDED and run.get("fingerprint"):
+                self.update_run(
+                    state_machine,
+                    LAST_SUCCESS_SORT_KEY,
+                    fingerprint=run["fingerprint"],
+                    source_exec_date=exec_date,
+                    period_fingerprints_digest=run.get("period_fingerprints_digest", ""),
+                )
+        self.release_active(state_machine, exec_date)
+        return self.claim_next_queued(state_machine)
+
+    def complete_and_start_next(
+        self, state_machine: str, exec_date: str, status: str, start_run
+    ) -> list:
+        """
+        complete() and starts the claimed run with start_run(run), which
+        returns a response whose status is RUN_STARTED on success. A claimed
+        run that fails to start is closed as FAILED and the next queued date
+        is claimed, so the slot is never left with a run nobody started.
+        Returns the start responses.
+        """
+        responses = []
+        next_run = self.complete(state_machine, exec_date, status)
+        while next_run is not None:
+            response = start_run(next_run)
+            responses.append(response)
+            if response["status"] == RUN_STARTED:
+                break
+            next_run = self.complete(state_machine, next_run["exec_date"], STATUS_FAILED)
+        return responses
+
+    def record_unchanged(
+        self,
+        state_machine: str,
+        exec_date: str,
+        event_token: str,
+        fingerprint: str,
+        decision: str,
+        source_exec_date: str,
+        aliased_partitions: list = None,
+    ) -> bool:
+        """
+        Logs a fast path decision as a terminal run. Returns False when the
+        exec_date already has a run in flight.
+        """
+        return self.put_run_if_new(
+            {
+                "state_machine": state_machine,
+                "exec_date": exec_date,
+                "status": STATUS_UNCHANGED,
+                "event_token": event_token,
+                "fingerprint": fingerprint,
+                "fingerprint_decision": decision,
+                "source_exec_date": source_exec_date,
+                "aliased_partitions": json.dumps(aliased_partitions or []),
+                "updated_at": self.now(),
+            }
+        )
+
+    def request_rerun(self, state_machine: str, exec_date: str, event: dict) -> bool:
+        """
+        Records the S3 event of a changed delivery on the run in flight for
+        exec_date, to replay on its completion. Returns False when the run is
+        no longer in flight, the caller then handles the delivery itself.
+        """
+        self.update_run(state_machine, exec_date, rerun_event=json.dumps(event))
+        return self.is_in_flight(state_machine, exec_date)
+
+    def get_rerun_event(self, state_machine: str, exec_date: str) -> (dict, None):
+        run = self.get_run(state_machine, exec_date)
+        if run is None or not run.get("rerun_event"):
+            return None
+        return json.loads(run["rerun_event"])
+
+    def is_held_by(self, run: dict, backfill_execution: str) -> bool:
+        return (
+            run is not None
+            and run["status"] == STATUS_BACKFILL
+            and run["event_token"] == backfill_execution
+        )
+
+    def hold_backfill(
+        self, state_machine: str, exec_dates: list, backfill_execution: str, backfill: dict
+    ) -> list:
+        """
+        Holds the runs of exec_dates for a backfill execution until its
+        completion. Returns the exec_dates in flight instead, nothing is
+        held then. A retried hold of the same execution is a no-op.
+        """
+        held = []
+        conflicts = []
+        for exec_date in exec_dates:
+            if self.is_held_by(self.get_run(state_machine, exec_date), backfill_execution):
+                continue
+            if self.put_run_if_new(
+                {
+                    "state_machine": state_machine,
+                    "exec_date": exec_date,
+                    "status": STATUS_BACKFILL,
+                    "payload": json.dumps({}),
+                    "event_token": backfill_execution,
+                    "fingerprint": "",
+                    "updated_at": self.now(),
+                }
+            ):
+                held.append(exec_date)
+            else:
+                conflicts.append(exec_date)
+        if conflicts:
+            for exec_date in held:
+                self.update_run(state_machine, exec_date, status=STATUS_ABANDONED)
+            return conflicts
+        self.update_run(
+            backfill_execution,
+            BACKFILL_SORT_KEY,
+            held_state_machine=state_machine,
+            exec_dates=json.dumps(exec_dates),
+            backfill=json.dumps(backfill),
+        )
+        return []
+
+    def release_backfill(self, backfill_execution: str, status: str) -> (dict, None):
+        """
+        Closes the runs a backfill execution still holds with its status.
+        Returns its #BACKFILL item with the exec_dates released by this call
+        as `released_exec_dates`, None for executions that are no backfill.
+        """
+        hold = self.get_item(backfill_execution, BACKFILL_SORT_KEY)
+        if hold is None:
+            return None
+        hold["released_exec_dates"] = []
+        for exec_date in json.loads(hold["exec_dates"]):
+            run = self.get_run(hold["held_state_machine"], exec_date)
+            if self.is_held_by(run, backfill_execution):
+                self.update_run(hold["held_state_machine"], exec_date, status=status)
+                hold["released_exec_dates"].append(exec_date)
+        return hold
+
+    def get_last_success(self, state_machine: str) -> (dict, None):
+        return self.get_item(state_machine, LAST_SUCCESS_SORT_KEY)
+
+    @staticmethod
+    def get_ingest_key(database: str, table: str) -> str:
+        return f"{INGEST_KEY_PREFIX}{database}.{table}"
+
+    def get_ingest_marker(self, database: str, table: str, exec_date: str) -> (dict, None):
+        return self.get_item(self.get_ingest_key(database, table), exec_date)
+
+    def acquire_ingest(
+        self, database: str, table: str, exec_date: str, fingerprint: str, event_token: str
+    ) -> bool:
+        """
+        Claims the ingest of a landing table partition. Returns False while
+        another invocation holds an unexpired claim on it.
+        """
+        lease_expires = self.get_expiry(INGEST_LEASE_SECONDS)
+        return self.put_ingest_if_idle(
+            {
+                "state_machine": self.get_ingest_key(database, table),
+                "exec_date": exec_date,
+                "status": STATUS_INGESTING,
+                "fingerprint": fingerprint,
+                "event_token": event_token,
+                "lease_expires": lease_expires,
+                "updated_at": self.now(),
+            }
+        )
+
+    def release_ingest(self, database: str, table: str, exec_date: str, status: str):
+        self.update_run(self.get_ingest_key(database, table), exec_date, status=status)
+
+    def add_received_file(self, pipeline: str, exec_date: str, file_name: str) -> set:
+        """Records an incoming file and returns all files received for the date"""
+        return self.add_to_set(
+            f"{READINESS_KEY_PREFIX}{pipeline}", exec_date, "received_files", file_name
+        )
+
+    def claim_done_file(self, pipeline: str, exec_date: str) -> bool:
+        """True for the single caller allowed to write the .done file now"""
+        claimed_until = self.get_expiry(DONE_FILE_CLAIM_SECONDS)
+        return self.claim_until(
+            f"{READINESS_KEY_PREFIX}{pipeline}", exec_date, "done_claimed_until", claimed_until
+        )
+
+    def claim_next_queued(self, state_machine: str) -> (dict, None):
+        queued = sorted(
+            self.list_queued_runs(state_machine), key=lambda run: run["exec_date"]
+        )
+        if not queued:
+            return None
+        run = queued[0]
+        if not self.acquire_active(state_machine, run["exec_date"]):
+            # Another invocation owns the slot and will drain the queue
+            return None
+        self.update_run(state_machine, run["exec_date"], status=STATUS_RUNNING)
+        run["status"] = STATUS_RUNNING
+        run["payload"] = json.loads(run["payload"])
+        return run
+
+    def is_in_flight(self, state_machine: str, exec_date: str) -> bool:
+        run = self.get_run(state_machine, exec_date)
+        return run is not None and run["status"] in IN_FLIGHT_STATUSES
+
+    def get_active(self, state_machine: str) -> (dict, None):
+        active = self.get_item(state_machine, ACTIVE_SORT_KEY)
+        if active is None or "active_exec_date" not in active:
+            return None
+        return self.get_run(state_machine, active["active_exec_date"])
+
+    def get_run(self, state_machine: str, exec_date: str) -> (dict, None):
+        return self.get_item(state_machine, exec_date)
+
+    @staticmethod
+    def now() -> str:
+        return datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%SZ")
+
+    @staticmethod
+    def get_expiry(seconds: int) -> str:
+        return (datetime.utcnow() + timedelta(seconds=seconds)).strftime("%Y-%m-%dT%H:%M:%SZ")
+
+    # Store primitives
+    def put_run_if_new(self, item: dict) -> bool:
+        raise NotImplementedError
+
+    def put_active_if_free(
+        self, state_machine: str, exec_date: str, now: str, lease_expires: str
+    ) -> (bool, str):
+        """Returns whether the slot was taken and the exec_date it held before"""
+        raise NotImplementedError
+
+    def extend_active(self, state_machine: str, exec_date: str, lease_expires: str) -> bool:
+        raise NotImplementedError
+
+    def release_active(self, state_machine: str, exec_date: str) -> bool:
+        raise NotImplementedError
+
+    def update_run(self, state_machine: str, exec_date: str, **attributes):
+        raise NotImplementedError
+
+    def get_item(self, state_machine: str, sort_key: str) -> (dict, None):
+        raise NotImplementedError
+
+    def list_queued_runs(self, state_machine: str) -> list:
+        raise NotImplementedError
+
+    def put_ingest_if_idle(self, item: dict) -> bool:
+        raise NotImplementedError
+
+    def add_to_set(self, partition_key: str, sort_key: str, attribute: str, value: str) -> set:
+        raise NotImplementedError
+
+    def claim_until(self, partition_key: str, sort_key: str, attribute: str, until: str) -> bool:
+        raise NotImplementedError
+
+
+class DynamoDBExecutionLedger(ExecutionLedger):
+    """Ledger backed by a DynamoDB table ( state_machine, exec_date )"""
+
+    def __init__(self, table_name: str):
+        self.table = boto3.resource("dynamodb").Table(table_name)
+
+    @staticmethod
+    def is_condition_failure(ex: ClientError) -> bool:
+        return ex.response["Error"]["Code"] == "ConditionalCheckFailedException"
+
+    def put_run_if_new(self, item: dict) -> bool:
+        try:
+            self.table.put_item(
+                Item=item,
+                ConditionExpression=Attr("exec_date").not_exists()
+                | (
+                    Attr("status").is_in(list(TERMINAL_STATUSES))
+                    & Attr("event_token").ne(item["event_token"])
+                ),
+            )
+            return True
+        except ClientError as ex:
+            if self.is_condition_failure(ex):
+                return False
+            raise
+
+    def put_ingest_if_idle(self, item: dict) -> bool:
+        try:
+            self.table.put_item(
+                Item=item,
+                ConditionExpression=Attr("exec_date").not_exists()
+                | Attr("status").ne(STATUS_INGESTING)
+                | Attr("lease_expires").lt(item["updated_at"]),
+            )
+            return True
+        except ClientError as ex:
+            if self.is_condition_failure(ex):
+                return False
+            raise
+
+    def put_active_if_free(
+        self, state_machine: str, exec_date: str, now: str, lease_expires: str
+    ) -> (bool, str):
+        try:
+            response = self.table.update_item(
+                Key={"state_machine": state_machine, "exec_date": ACTIVE_SORT_KEY},
+                UpdateExpression="SET active_exec_date = :d, lease_expires = :l, updated_at = :t",
+                ConditionExpression="attribute_not_exists(active_exec_date) OR lease_expires < :t",
+                ExpressionAttributeValues={":d": exec_date, ":l": lease_expires, ":t": now},
+                ReturnValues="ALL_OLD",
+            )
+            return True, response.get("Attributes", {}).get("active_exec_date")
+        except ClientError as ex:
+            if self.is_condition_failure(ex):
+                return False, None
+            raise
+
+    def extend_active(self, state_machine: str, exec_date: str, lease_expires: str) -> bool:
+        try:
+            self.table.update_item(
+                Key={"state_machine": state_machine, "exec_date": ACTIVE_SORT_KEY},
+                UpdateExpression="SET lease_expires = :l, updated_at = :t",
+                ConditionExpression="active_exec_date = :d",
+                ExpressionAttributeValues={":d": exec_date, ":l": lease_expires, ":t": self.now()},
+            )
+            return True
+        except ClientError as ex:
+            if self.is_condition_failure(ex):
+                return False
+            raise
+
+    def release_active(self, state_machine: str, exec_date: str) -> bool:
+        try:
+            self.table.update_item(
+                Key={"state_machine": state_machine, "exec_date": ACTIVE_SORT_KEY},
+                UpdateExpression="REMOVE active_exec_date SET updated_at = :t",
+                ConditionExpression="active_exec_date = :d",
+                ExpressionAttributeValues={":d": exec_date, ":t": self.now()},
+            )
+            return True
+        except ClientError as ex:
+            if self.is_condition_failure(ex):
+                return False
+            raise
+
+    def update_run(self, state_machine: str, exec_date: str, **attributes):
+        attributes["updated_at"] = self.now()
+        names = {f"#{k}": k for k in attributes}
+        values = {f":{k}": v for k, v in attributes.items()}
+        self.table.update_item(
+            Key={"state_machine": state_machine, "exec_date": exec_date},
+            UpdateExpression="SET " + ", ".join(f"#{k} = :{k}" for k in attributes),
+            ExpressionAttributeNames=names,
+            ExpressionAttributeValues=values,
+        )
+
+    def add_to_set(self, partition_key: str, sort_key: str, attribute: str, value: str) -> set:
+        response = self.table.update_item(
+            Key={"state_machine": partition_key, "exec_date": sort_key},
+            UpdateExpression="ADD #a :v SET updated_at = :t",
+            ExpressionAttributeNames={"#a": attribute},
+            ExpressionAttributeValues={":v": {value}, ":t": self.now()},
+            ReturnValues="ALL_NEW",
+        )
+        return set(response["Attributes"][attribute])
+
+    def claim_until(self, partition_key: str, sort_key: str, attribute: str, until: str) -> bool:
+        now = self.now()
+        try:
+            self.table.update_item(
+                Key={"state_machine": partition_key, "exec_date": sort_key},
+                UpdateExpression="SET #a = :u, updated_at = :t",
+                ConditionExpression="attribute_not_exists(#a) OR #a < :t",
+                ExpressionAttributeNames={"#a": attribute},
+                ExpressionAttributeValues={":u": until, ":t": now},
+            )
+            return True
+        except ClientError as ex:
+            if self.is_condition_failure(ex):
+                return False
+            raise
+
+    def get_item(self, state_machine: str, sort_key: str) -> (dict, None):
+        response = self.table.get_item(
+            Key={"state_machine": state_machine, "exec_date": sort_key},
+            ConsistentRead=True,
+        )
+        return response.get("Item")
+
+    def list_queued_runs(self, state_machine: str) -> list:
+        runs = []
+        query_args = {
+            "KeyConditionExpression": Key("state_machine").eq(state_machine),
+            "FilterExpression": Attr("status").eq(STATUS_QUEUED),
+            "ConsistentRead": True,
+        }
+        while True:
+            response = self.table.query(**query_args)
+            runs.extend(response["Items"])
+            if "LastEvaluatedKey" not in response:
+                return runs
+            query_args["ExclusiveStartKey"] = response["LastEvaluatedKey"]
+
+
+class LocalExecutionLedger(ExecutionLedger):
+    """In-memory stand-in with the same conditional semantics, for local runs and tests"""
+
+    def __init__(self):
+        self.items = {}
+        self.lock = threading.Lock()
+
+    def put_run_if_new(self, item: dict) -> bool:
+        key = (item["state_machine"], item["exec_date"])
+        with self.lock:
+            existing = self.items.get(key)
+            if existing is not None and not (
+                existing["status"] in TERMINAL_STATUSES
+                and existing["event_token"] != item["event_token"]
+            ):
+                return False
+            self.items[key] = dict(item)
+            return True
+
+    def put_ingest_if_idle(self, item: dict) -> bool:
+        key = (item["state_machine"], item["exec_date"])
+        with self.lock:
+            existing = self.items.get(key)
+            if (
+                existing is not None
+                and existing.get("status") == STATUS_INGESTING
+                and existing["lease_expires"] >= item["updated_at"]
+            ):
+                return False
+            self.items[key] = dict(item)
+            return True
+
+    def put_active_if_free(
+        self, state_machine: str, exec_date: str, now: str, lease_expires: str
+    ) -> (bool, str):
+        key = (state_machine, ACTIVE_SORT_KEY)
+        with self.lock:
+            active = self.items.setdefault(
+                key, {"state_machine": state_machine, "exec_date": ACTIVE_SORT_KEY}
+            )
+            if "active_exec_date" in active and active["lease_expires"] >= now:
+                return False, None
+            previous = active.get("active_exec_date")
+            active["active_exec_date"] = exec_date
+            active["lease_expires"] = lease_expires
+            active["updated_at"] = now
+            return True, previous
+
+    def extend_active(self, state_machine: str, exec_date: str, lease_expires: str) -> bool:
+        key = (state_machine, ACTIVE_SORT_KEY)
+        with self.lock:
+            active = self.items.get(key, {})
+            if active.get("active_exec_date") != exec_date:
+                return False
+            active["lease_expires"] = lease_expires
+            active["updated_at"] = self.now()
+            return True
+
+    def release_active(self, state_machine: str, exec_date: str) -> bool:
+        key = (state_machine, ACTIVE_SORT_KEY)
+        with self.lock:
+            active = self.items.get(key, {})
+            if active.get("active_exec_date") != exec_date:
+                return False
+            del active["active_exec_date"]
+            active["updated_at"] = self.now()
+            return True
+
+    def update_run(self, state_machine: str, exec_date: str, **attributes):
+        attributes["updated_at"] = self.now()
+        with self.lock:
+            self.items.setdefault(
+                (state_machine, exec_date),
+                {"state_machine": state_machine, "exec_date": exec_date},
+            ).update(attributes)
+
+    def add_to_set(self, partition_key: str, sort_key: str, attribute: str, value: str) -> set:
+        with self.lock:
+            item = self.items.setdefault(
+                (partition_key, sort_key),
+                {"state_machine": partition_key, "exec_date": sort_key},
+            )
+            item.setdefault(attribute, set()).add(value)
+            item["updated_at"] = self.now()
+            return set(item[attribute])
+
+    def claim_until(self, partition_key: str, sort_key: str, attribute: str, until: str) -> bool:
+        now = self.now()
+        with self.lock:
+            item = self.items.setdefault(
+                (partition_key, sort_key),
+                {"state_machine": partition_key, "exec_date": sort_key},
+            )
+            if item.get(attribute, "") >= now:
+                return False
+            item[attribute] = until
+            item["updated_at"] = now
+            return True
+
+    def get_item(self, state_machine: str, sort_key: str) -> (dict, None):
+        with self.lock:
+            item = self.items.get((state_machine, sort_key))
+            return dict(item) if item is not None else None
+
+    def list_queued_runs(self, state_machine: str) -> list:
+        with self.lock:
+            return [
+                dict(item)
+                for (sm, sort_key), item in self.items.items()
+                if sm == state_machine
+                and item.get("status") == STATUS_QUEUED
+            ]
+
+
+_LOCAL_LEDGER = LocalExecutionLedger()
@@ -0,0 +1,119 @@
+"""
+Incremental recompute parameters of a run, resolved when the run starts.
+
+The trigger only records the landing tables of the delivery on the payload
+( `incremental_tables` ). A queued run may start long after its delivery,
+so the periods to recompute and the exec_date to carry the others from
+are taken against the `#LAST_SUCCESS` of the state machine at start time.
+
+Every run records the digest of the period fingerprints it started on,
+`#LAST_SUCCESS` keeps the one of its run. A source exec_date whose landing
+fingerprints changed since its run ( re-ingested or purged ) no longer
+matches its outputs and the run recomputes in full.
+"""
+import hashlib
+import json
+
+import boto3
+from botocore.exceptions import ClientError
+
+from common.period_fingerprint import PERIOD_FINGERPRINTS_FILE_NAME, get_changed_periods
+
+INCREMENTAL_TABLES_KEY = "incremental_tables"
+INCREMENTAL_SQL_PARAMS = ["param_incremental_source_exec_date", "param_changed_periods"]
+
+
+class IncrementalRecompute(object):
+    def __init__(self, cnf, ledger, log):
+        self.cnf = cnf
+        self.ledger = ledger
+        self.log = log
+        self.s3 = boto3.client("s3")
+
+    def get_period_fingerprints(self, table: dict, exec_date: str) -> (dict, None):
+        """Period fingerprints of the table's landing partition of exec_date"""
+        key = (
+            f"{self.cnf.LANDING_DB_NAME}/{table['table_name']}/exec_date={exec_date}/"
+            f"{PERIOD_FINGERPRINTS_FILE_NAME}"
+        )
+        try:
+            response = self.s3.get_object(Bucket=table["dest_bucket"], Key=key)
+        except ClientError as ex:
+            if ex.response["Error"]["Code"] in ("NoSuchKey", "404"):
+                return None
+            raise
+        return json.loads(response["Body"].read())
+
+    def get_fingerprints(self, tables: list, exec_date: str) -> (dict, None):
+        """{table name: period fingerprints}, None when a table has none"""
+        fingerprints = {}
+        for table in tables:
+            fingerprints[table["table_name"]] = self.get_period_fingerprints(table, exec_date)
+            if fingerprints[table["table_name"]] is None:
+                self.log.info(f"No period fingerprints of {table['table_name']} for {exec_date}")
+                return None
+        return fingerprints
+
+    @staticmethod
+    def get_digest(fingerprints: dict) -> str:
+        return hashlib.sha256(json.dumps(fingerprints, sort_keys=True).encode()).hexdigest()
+
+    def get_sql_params(self, state_machine: str, exec_date: str, tables: list) -> dict:
+        """
+        Periods to recompute against the last exec_date the workflow
+        succeeded on, whose outputs the other periods are carried from.
+        Empty, for a full recompute, unless every table has period
+        fingerprints for both exec_dates and the source's are still the
+        ones its run started on. Records the digest of exec_date's.
+        """
+        self.log.info("In get_sql_params module")
+        current = self.get_fingerprints(tables, exec_date)
+        self.ledger.update_run(
+            state_machine,
+            exec_date,
+            period_fingerprints_digest=self.get_digest(current) if current else "",
+        )
+        last_success = self.ledger.get_last_success(state_machine=state_machine)
+        # The run purges its own partition, it can not carry from it
+        if current is None or last_success is None or last_success["source_exec_date"] == exec_date:
+            return {}
+        source_exec_date = last_success["source_exec_date"]
+        previous = self.get_fingerprints(tables, source_exec_date)
+        if previous is None:
+            return {}
+        if self.get_digest(previous) != last_success.get("period_fingerprints_digest"):
+            self.log.info(
+                f"Landing of {source_exec_date} changed since its run, full recompute"
+            )
+            return {}
+
+        changed_periods = set()
+        for table_name in sorted(current):
+            changed_periods.update(get_changed_periods(current[table_name], previous[table_name]))
+        if (
+            "null" in changed_periods
+            or len(changed_periods) > self.cnf.INCREMENTAL_MAX_CHANGED_PERIODS
+        ):
+            self.log.info(f"{len(changed_periods)} changed periods, full recompute")
+            return {}
+        self.log.info(
+            f"Incremental recompute of {sorted(changed_periods)}, other periods "
+            f"carried from {source_exec_date}"
+        )
+        return {
+            "param_incremental_source_exec_date": source_exec_date,
+            "param_changed_periods": ",".join(sorted(changed_periods)),
+        }
+
+    def apply(self, state_machine: str, exec_date: str, step_payload: dict):
+        """Adds the incremental parameters to the payload of a run about to start"""
+        tables = step_payload.get(INCREMENTAL_TABLES_KEY)
+        if not tables:
+            return
+        glue_runtime_sql_params = json.loads(step_payload["glue_runtime_sql_params"])
+        for name in INCREMENTAL_SQL_PARAMS:
+            glue_runtime_sql_params.pop(name, None)
+        glue_runtime_sql_params.update(
+            self.get_sql_params(state_machine=state_machine, exec_date=exec_date, tables=tables)
+        )
+        step_payload["glue_runtime_sql_params"] = json.dumps(glue_runtime_sql_params)
@@ -0,0 +1,122 @@
+"""
+Key-range sidecar index of a landing partition.
+
+For every file written by the layout conversion in the key order
+( LAYOUT_SORT_ORDER "key" ) the index keeps the min/max of the key columns
+per row group, taken from the footer statistics at write time. It is
+stored next to the data files under a name starting with "_", which Athena
+skips when reading the partition.
+
+A point lookup ( plant, unit, hour ) reads the index first and restricts
+the query to the candidate files with a "$path" predicate, the row group
+statistics and bloom filters of those files do the rest.
+
+    python key_index.py --bucket <landing bucket> \
+        --prefix landing_db_dev/utility_data_oh/exec_date=2024-11-08 \
+        --filter plant_id_eia=2828 --filter emissions_unit_id_epa=1
+"""
+import argparse
+import datetime
+import json
+
+import boto3
+
+KEY_INDEX_FILE_NAME = "_key_index.json"
+
+
+def get_stat_value(value):
+    """JSON friendly statistics value, timestamps as Athena timestamp literals"""
+    if isinstance(value, (datetime.datetime, datetime.date)):
+        return value.isoformat(sep=" ") if isinstance(value, datetime.datetime) else str(value)
+    if isinstance(value, bytes):
+        return value.decode("utf-8", errors="replace")
+    return value
+
+
+def get_row_group_key_ranges(metadata, key_columns: list) -> list:
+    """min/max of key_columns per row group of a written file's FileMetaData"""
+    column_index = {
+        metadata.schema.column(i).name: i for i in range(metadata.num_columns)
+    }
+    row_groups = []
+    for i in range(metadata.num_row_groups):
+        row_group = metadata.row_group(i)
+        key_ranges = {"row_group": i, "num_rows": row_group.num_rows}
+        for column in key_columns:
+            if column not in column_index:
+                continue
+            stats = row_group.column(column_index[column]).statistics
+            if stats is not None and stats.has_min_max:
+                key_ranges[column] = [get_stat_value(stats.min), get_stat_value(stats.max)]
+        row_groups.append(key_ranges)
+    return row_groups
+
+
+def build_key_index(key_columns: list, files: list) -> dict:
+    """files holds {"path", "num_rows", "row_groups"} entries of the partition"""
+    return {
+        "key_columns": key_columns,
+        "created_at": datetime.datetime.utcnow().isoformat(),
+        "files": sorted(files, key=lambda f: f["path"]),
+    }
+
+
+def in_range(key_range: list, value) -> bool:
+    """Filter values come as strings from the CLI, compared as the statistics type"""
+    low, high = key_range
+    value = type(low)(value) if isinstance(low, (int, float)) else str(value)
+    return low <= value <= high
+
+
+def find_candidates(index: dict, filters: dict) -> list:
+    """
+    Files and row groups whose key ranges may hold rows matching every
+    filter ( column ==> value ). Columns without statistics never prune.
+    """
+    candidates = []
+    for file in index["files"]:
+        row_groups = [
+            row_group["row_group"]
+            for row_group in file["row_groups"]
+            if all(
+                in_range(row_group[column], value)
+                for column, value in filters.items()
+                if column in row_group
+            )
+        ]
+        if row_groups:
+            candidates.append({"path": file["path"], "row_groups": row_groups})
+    return candidates
+
+
+def get_path_predicate(candidates: list) -> str:
+    """Athena predicate reading only the candidate files"""
+    if not candidates:
+        return "false"
+    paths = ", ".join(f"'{candidate['path']}'" for candidate in candidates)
+    return f'"$path" IN ({paths})'
+
+
+def load_key_index(bucket: str, prefix: str) -> dict:
+    response = boto3.client("s3").get_object(
+        Bucket=bucket, Key=f"{prefix.rstrip('/')}/{KEY_INDEX_FILE_NAME}"
+    )
+    return json.loads(response["Body"].read())
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Candidate files of a point lookup")
+    parser.add_argument("--bucket", required=True)
+    parser.add_argument("--prefix", required=True, help="partition prefix of the table")
+    parser.add_argument(
+        "--filter", action="append", default=[], help="column=value, repeatable"
+    )
+    cli_args = parser.parse_args()
+
+    key_index = load_key_index(bucket=cli_args.bucket, prefix=cli_args.prefix)
+    lookup = dict(f.split("=", 1) for f in cli_args.filter)
+    matches = find_candidates(key_index, lookup)
+    total_files = len(key_index["files"])
+    print(json.dumps(matches, indent=4))
+    print(f"-- {len(matches)} of {total_files} files")
+    print(get_path_predicate(matches))
@@ -0,0 +1,198 @@
+"""
+Landing layout conversion of incoming Parquet files.
+
+The incoming file is read in record batches through a seekable S3 input
+file, so only the batches in flight are held in memory. Rows are buffered
+up to sort_buffer_rows, sorted on the sort columns ( by hour, or by plant
+and unit, see LAYOUT_SORT_ORDER ) and written as row groups of row_group_rows, zstd
+compressed with dictionary encoding of the low-cardinality columns and
+bloom filters on the key columns. The output rolls over to a new file once
+it passes target_file_bytes. The per-period fingerprints of the rows are
+computed on the way, for the incremental recompute of the pipelines.
+
+Sorting is exact within a buffer. Deliveries of a single exec_date fit
+one buffer, larger files are written as sorted runs, whose row groups
+still carry narrow min/max statistics.
+"""
+import fnmatch
+import logging
+import os
+
+from common.key_index import get_row_group_key_ranges
+from common.period_fingerprint import PeriodFingerprinter
+
+try:
+    import pyarrow as pa
+    import pyarrow.fs as pafs
+    import pyarrow.parquet as pq
+except ImportError:  # pragma: no cover - provided by the AWS SDK for pandas layer
+    pa = None
+    pafs = None
+    pq = None
+
+
+class ParquetLayoutRewriter(object):
+    def __init__(
+        self,
+        region: str,
+        sort_columns: list,
+        dictionary_columns: list,
+        bloom_filter_columns: list = None,
+        bloom_filter_ndv: int = 16 * 1024,
+        bloom_filter_fpp: float = 0.05,
+        row_group_rows: int = 1024 * 1024,
+        sort_buffer_rows: int = 4 * 1024 * 1024,
+        target_file_bytes: int = 256 * 1024 * 1024,
+        compression: str = "zstd",
+        period_column: str = None,
+    ):
+        self.log = logging.getLogger()
+        if pq is None:
+            raise RuntimeError(
+                "pyarrow is required for the landing layout conversion. "
+                "Attach the AWS SDK for pandas layer or disable LAYOUT_REWRITE_ENABLED"
+            )
+        self.fs = pafs.S3FileSystem(region=region)
+        self.sort_columns = sort_columns
+        self.dictionary_columns = dictionary_columns
+        self.bloom_filter_columns = bloom_filter_columns or []
+        self.bloom_filter_options = {
+            "ndv": bloom_filter_ndv,
+            "fpp": bloom_filter_fpp,
+        }
+        self.bloom_filter_supported = True
+        self.row_group_rows = row_group_rows
+        self.sort_buffer_rows = max(sort_buffer_rows, row_group_rows)
+        self.target_file_bytes = target_file_bytes
+        self.compression = compression
+        self.period_column = period_column
+
+    def get_dictionary_columns(self, schema) -> list:
+        """Schema columns matching any of the dictionary_columns patterns"""
+        return [
+            name
+            for name in schema.names
+            if any(fnmatch.fnmatch(name, pattern) for pattern in self.dictionary_columns)
+        ]
+
+    @staticmethod
+    def get_part_key(dest_key: str, part: int) -> str:
+        """The first file keeps the destination key, the next ones are numbered"""
+        if part == 0:
+            return dest_key
+        stem, ext = os.path.splitext(dest_key)
+        return f"{stem}-part-{part:04d}{ext}"
+
+    def sort_buffer(self, batches: list):
+        table = pa.Table.from_batches(batches)
+        sort_keys = [
+            (column, "ascending")
+            for column in self.sort_columns
+            if column in table.schema.names
+        ]
+        return table.sort_by(sort_keys) if sort_keys else table
+
+    def open_writer(self, sink, schema):
+        options = {
+            "compression": self.compression,
+            "use_dictionary": self.get_dictionary_columns(schema),
+            "write_statistics": True,
+        }
+        bloom_filter_columns = [c for c in self.bloom_filter_columns if c in schema.names]
+        if bloom_filter_columns and self.bloom_filter_supported:
+            try:
+                return pq.ParquetWriter(
+                    sink,
+                    schema,
+                    bloom_filter_options={
+                        column: self.bloom_filter_options for column in bloom_filter_columns
+                    },
+                    **options,
+                )
+            except TypeError:
+                # pyarrow of the layer predates bloom filter writing
+                self.log.info("pyarrow can not write bloom filters, writing without")
+                self.bloom_filter_supported = False
+        return pq.ParquetWriter(sink, schema, **options)
+
+    def close_part(self, part: dict, result: dict):
+        """Closes the open part and records the key ranges of its row groups"""
+        if part["writer"] is not None:
+            part["writer"].close()
+            part["sink"].close()
+            metadata = part["writer"].writer.metadata
+            result["files"].append(
+                {
+                    "key": result["dest_keys"][-1],
+                    "num_rows": metadata.num_rows,
+                    "row_groups": get_row_group_key_ranges(metadata, self.sort_columns),
+                }
+            )
+        part["sink"], part["writer"] = None, None
+
+    def write_buffer(
+        self, part: dict, batches: list, schema, dest_bucket: str, dest_key: str, result: dict
+    ):
+        """Writes the sorted buffer to the open part, rolling over past the target size"""
+        if part["writer"] is None:
+            key = self.get_part_key(dest_key, len(result["dest_keys"]))
+            part["sink"] = self.fs.open_output_stream(f"{dest_bucket}/{key}")
+            part["writer"] = self.open_writer(part["sink"], schema)
+            result["dest_keys"].append(key)
+        table = self.sort_buffer(batches)
+        if "fingerprinter" in part:
+            part["fingerprinter"].update(table)
+        part["writer"].write_table(table, row_group_size=self.row_group_rows)
+        result["num_rows"] += table.num_rows
+        result["num_row_groups"] += -(-table.num_rows // self.row_group_rows)
+        if part["sink"].tell() >= self.target_file_bytes:
+            self.close_part(part, result)
+
+    def rewrite(self, src_bucket: str, src_key: str, dest_bucket: str, dest_key: str) -> dict:
+        """
+        Rewrites s3://src_bucket/src_key into one or more files starting at
+        s3://dest_bucket/dest_key and returns the keys, row counts, the
+        key ranges of every written file and the period fingerprints
+        """
+        self.log.info(f"In rewrite module : s3://{src_bucket}/{src_key}")
+        result = {"dest_keys": [], "num_rows": 0, "num_row_groups": 0, "files": []}
+        with self.fs.open_input_file(f"{src_bucket}/{src_key}") as source:
+            parquet_file = pq.ParquetFile(source)
+            schema = parquet_file.schema_arrow
+            missing = [c for c in self.sort_columns if c not in schema.names]
+            if missing:
+                self.log.info(f"{src_key} has no {missing} column(s), not sorted on them")
+
+            part = {"sink": None, "writer": None}
+            if self.period_column:
+                part["fingerprinter"] = PeriodFingerprinter(self.period_column)
+            buffered, buffered_rows = [], 0
+            for batch in parquet_file.iter_batches(batch_size=self.row_group_rows):
+                buffered.append(batch)
+                buffered_rows += batch.num_rows
+                if buffered_rows >= self.sort_buffer_rows:
+                    self.write_buffer(part, buffered, schema, dest_bucket, dest_key, result)
+                    buffered, buffered_rows = [], 0
+            if buffered_rows:
+                self.write_buffer(part, buffered, schema, dest_bucket, dest_key, result)
+            self.close_part(part, result)
+            if self.period_column:
+                result["period_fingerprints"] = part["fingerprinter"].get_fingerprints()
+
+            if not result["dest_keys"]:
+                # Empty deliveries still land as a file with the schema
+                pq.write_table(
+                    schema.empty_table(),
+                    f"{dest_bucket}/{dest_key}",
+                    filesystem=self.fs,
+                    compression=self.compression,
+                )
+                result["dest_keys"].append(dest_key)
+                result["files"].append({"key": dest_key, "num_rows": 0, "row_groups": []})
+
+        self.log.info(
+            f"Rewrote s3://{src_bucket}/{src_key} : {result['num_rows']} rows in "
+            f"{result['num_row_groups']} row groups, files = {result['dest_keys']}"
+        )
+        return result
+
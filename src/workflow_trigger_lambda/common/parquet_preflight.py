@@ -0,0 +1,177 @@
+"""
+Pre-flight validation of incoming Parquet files.
+
+Only the footer of each file is fetched, with ranged GETs against the end
+of the object. The footer carries the schema, the row count and the
+row-group statistics, which is enough to reject a malformed or
+schema-drifted file before it is copied or a state machine is started.
+"""
+import logging
+import struct
+
+import boto3
+from botocore.exceptions import ClientError
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # pragma: no cover - provided by the AWS SDK for pandas layer
+    pa = None
+    pq = None
+
+PARQUET_MAGIC = b"PAR1"
+# 4 byte little-endian footer length followed by the magic
+FOOTER_TAIL_BYTES = 8
+
+# Glue ( hive ) column type ==> accepted Arrow type prefixes
+HIVE_TO_ARROW_TYPES = {
+    "tinyint": ("int8",),
+    "smallint": ("int8", "int16"),
+    "int": ("int8", "int16", "int32"),
+    "bigint": ("int8", "int16", "int32", "int64"),
+    "float": ("float", "halffloat"),
+    "double": ("float", "double", "halffloat"),
+    "string": ("string", "large_string", "dictionary<values=string"),
+    "boolean": ("bool",),
+    "date": ("date32", "date64"),
+    "timestamp": ("timestamp",),
+}
+
+
+class ParquetPreflight(object):
+    def __init__(self, footer_read_bytes: int = 64 * 1024, stats_columns: list = None):
+        self.log = logging.getLogger()
+        self.s3 = boto3.client("s3")
+        self.glue = boto3.client("glue")
+        self.footer_read_bytes = footer_read_bytes
+        self.stats_columns = stats_columns or []
+        self.table_columns = {}
+
+    def get_range(self, bucket: str, key: str, start: int, end: int) -> bytes:
+        response = self.s3.get_object(Bucket=bucket, Key=key, Range=f"bytes={start}-{end}")
+        return response["Body"].read()
+
+    def read_footer(self, bucket: str, key: str, size: int):
+        """
+        Returns the file's FileMetaData. The tail read is sized to cover
+        most footers in a single request; larger footers need one more.
+        """
+        self.log.info(f"In read_footer module : s3://{bucket}/{key}")
+        if size < len(PARQUET_MAGIC) + FOOTER_TAIL_BYTES:
+            raise ValueError(f"{key} is too small to be a parquet file ({size} bytes)")
+
+        tail_start = max(0, size - self.footer_read_bytes)
+        tail = self.get_range(bucket, key, tail_start, size - 1)
+        if tail[-4:] != PARQUET_MAGIC:
+            raise ValueError(f"{key} does not end with the parquet magic bytes")
+
+        footer_length = struct.unpack("<I", tail[-FOOTER_TAIL_BYTES:-4])[0]
+        footer_start = size - FOOTER_TAIL_BYTES - footer_length
+        if footer_start < len(PARQUET_MAGIC):
+            raise ValueError(f"{key} declares a footer longer than the file")
+        if footer_start < tail_start:
+            tail = self.get_range(bucket, key, footer_start, tail_start - 1) + tail
+            tail_start = footer_start
+
+        footer = tail[footer_start - tail_start:]
+        # The reader only looks at the end of the buffer, so the header magic
+        # plus the footer is a valid stand-in for the whole file
+        return pq.read_metadata(pa.BufferReader(PARQUET_MAGIC + footer))
+
+    def get_table_columns(self, database: str, table: str) -> dict:
+        if (database, table) not in self.table_columns:
+            response = self.glue.get_table(DatabaseName=database, Name=table)
+            self.table_columns[(database, table)] = {
+                column["Name"].lower(): column["Type"].lower()
+                for column in response["Table"]["StorageDescriptor"]["Columns"]
+            }
+        return self.table_columns[(database, table)]
+
+    def validate_schema(self, metadata, expected_columns: dict) -> list:
+        errors = []
+        file_columns = {
+            field.name.lower(): str(field.type)
+            for field in metadata.schema.to_arrow_schema()
+        }
+        for name, hive_type in expected_columns.items():
+            if name not in file_columns:
+                errors.append(f"missing column {name} ({hive_type})")
+                continue
+            accepted = HIVE_TO_ARROW_TYPES.get(hive_type.split("(")[0])
+            if accepted and not file_columns[name].startswith(accepted):
+                errors.append(
+                    f"column {name} is {file_columns[name]}, table expects {hive_type}"
+                )
+        extra_columns = sorted(set(file_columns) - set(expected_columns))
+        if extra_columns:
+            self.log.info(f"Columns not in table schema are ignored : {extra_columns}")
+        return errors
+
+    def get_row_group_stats(self, metadata) -> list:
+        column_index = {
+            metadata.schema.column(i).name: i for i in range(metadata.num_columns)
+        }
+        row_groups = []
+        for i in range(metadata.num_row_groups):
+            row_group = metadata.row_group(i)
+            stats = {
+                "num_rows": row_group.num_rows,
+                "total_byte_size": row_group.total_byte_size,
+            }
+            for column in self.stats_columns:
+                if column not in column_index:
+                    continue
+                column_stats = row_group.column(column_index[column]).statistics
+                if column_stats is not None and column_stats.has_min_max:
+                    stats[column] = {
+                        "min": str(column_stats.min),
+                        "max": str(column_stats.max),
+                    }
+            row_groups.append(stats)
+        return row_groups
+
+    def verify_checksum(self, head: dict, expected_md5: str = "") -> list:
+        """
+        Compares the producer supplied MD5 ( registered file config or the
+        `md5` object metadata ) with the ETag of single part uploads. S3
+        already validated any additional checksum sent with the upload.
+        """
+        expected_md5 = (expected_md5 or head.get("Metadata", {}).get("md5", "")).lower()
+        etag = head["ETag"].strip('"')
+        if not expected_md5:
+            if not any(k.startswith("Checksum") for k in head):
+                self.log.info("No checksum supplied by producer, skipping verification")
+            return []
+        if "-" in etag:
+            self.log.info("Multipart upload ETag is not an MD5, skipping verification")
+            return []
+        if etag.lower() != expected_md5:
+            return [f"MD5 mismatch, expected {expected_md5} and S3 has {etag}"]
+        return []
+
+    def inspect(
+        self, bucket: str, key: str, database: str, table: str, expected_md5: str = ""
+    ) -> dict:
+        """Validates a single file and returns its row counts and errors"""
+        self.log.info(f"In inspect module : s3://{bucket}/{key}")
+        if pq is None:
+            raise RuntimeError(
+                "pyarrow is required for pre-flight validation. "
+                "Attach the AWS SDK for pandas layer or disable PREFLIGHT_VALIDATION_ENABLED"
+            )
+        result = {"key": key, "num_rows": 0, "num_row_groups": 0, "errors": []}
+        try:
+            head = self.s3.head_object(Bucket=bucket, Key=key, ChecksumMode="ENABLED")
+            result["errors"].extend(self.verify_checksum(head, expected_md5))
+            metadata = self.read_footer(bucket, key, head["ContentLength"])
+        except (ClientError, ValueError, OSError) as ex:
+            result["errors"].append(f"unreadable parquet footer : {ex}")
+            return result
+
+        result["num_rows"] = metadata.num_rows
+        result["num_row_groups"] = metadata.num_row_groups
+        result["row_groups"] = self.get_row_group_stats(metadata)
+        result["errors"].extend(
+            self.validate_schema(metadata, self.get_table_columns(database, table))
+        )
+        return result
@@ -0,0 +1,142 @@
+"""
+Per-period fingerprints of a landing snapshot.
+
+Every row is hashed from all its column values and the row hashes are
+summed per period ( the UTC date of the period column ), so the
+fingerprint of a period does not depend on the order or the files the
+rows came in. Two snapshots of a table hold the same rows for a period
+when the row count and digest of the period match.
+
+Fingerprints are computed by the layout conversion while it streams the
+rows and stored next to the data files of the partition under a name
+starting with "_", which Athena skips.
+"""
+import hashlib
+
+try:
+    import numpy as np
+    import pyarrow as pa
+    import pyarrow.compute as pc
+except ImportError:  # pragma: no cover - provided by the AWS SDK for pandas layer
+    np = None
+    pa = None
+    pc = None
+
+PERIOD_FINGERPRINTS_FILE_NAME = "_period_fingerprints.json"
+DIGEST_MASK = 2 ** 64 - 1
+NULL_HASH = 0x9E3779B97F4A7C15
+
+
+def splitmix64(values):
+    """Bit mixer over uint64 arrays, wraps around like the reference"""
+    with np.errstate(over="ignore"):
+        values = values + np.uint64(0x9E3779B97F4A7C15)
+        values = (values ^ (values >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+        values = (values ^ (values >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+        return values ^ (values >> np.uint64(31))
+
+
+def hash_value(value) -> int:
+    return int.from_bytes(
+        hashlib.blake2b(str(value).encode("utf-8"), digest_size=8).digest(), "little"
+    )
+
+
+def get_column_hashes(column) -> "np.ndarray":
+    """uint64 hash of every value of an Arrow column, nulls hash to NULL_HASH"""
+    column = column.combine_chunks() if isinstance(column, pa.ChunkedArray) else column
+    column_type = column.type
+    if pa.types.is_dictionary(column_type):
+        column = column.dictionary_decode()
+        column_type = column.type
+    is_null = column.is_null().to_numpy(zero_copy_only=False)
+
+    if pa.types.is_floating(column_type):
+        values = pc.fill_null(column.cast(pa.float64()), 0.0).to_numpy()
+        hashes = values.view(np.uint64)
+    elif (
+        pa.types.is_integer(column_type)
+        or pa.types.is_boolean(column_type)
+        or pa.types.is_temporal(column_type)
+    ):
+        # Dates and timestamps hash their unit counts, the schema fixes the unit
+        if pa.types.is_temporal(column_type):
+            column = column.view(pa.int64() if column_type.bit_width == 64 else pa.int32())
+        values = pc.fill_null(column.cast(pa.int64()), 0).to_numpy()
+        hashes = values.view(np.uint64)
+    else:
+        # Strings and the rest, hashed once per distinct value
+        encoded = pc.fill_null(column.cast(pa.string()), "").dictionary_encode()
+        dictionary = np.array(
+            [hash_value(value) for value in encoded.dictionary.to_pylist()], dtype=np.uint64
+        )
+        hashes = dictionary[encoded.indices.to_numpy(zero_copy_only=False)]
+    return np.where(is_null, np.uint64(NULL_HASH), splitmix64(hashes))
+
+
+class PeriodFingerprinter(object):
+    def __init__(self, period_column: str):
+        self.period_column = period_column
+        self.periods = {}
+
+    def get_row_hashes(self, table) -> "np.ndarray":
+        """Combines the column hashes in column name order"""
+        row_hashes = np.zeros(table.num_rows, dtype=np.uint64)
+        for i, name in enumerate(sorted(table.schema.names)):
+            column_hashes = get_column_hashes(table.column(name))
+            with np.errstate(over="ignore"):
+                row_hashes = splitmix64(row_hashes ^ (column_hashes + np.uint64(i + 1)))
+        return row_hashes
+
+    def get_row_periods(self, table) -> tuple:
+        """Distinct periods and the index of every row's period in them"""
+        column = table.column(self.period_column)
+        if pa.types.is_timestamp(column.type) or pa.types.is_date(column.type):
+            column = column.cast(pa.date32())
+        column = pc.fill_null(column.cast(pa.string()), "null").combine_chunks()
+        encoded = column.dictionary_encode()
+        return encoded.dictionary.to_pylist(), encoded.indices.to_numpy(zero_copy_only=False)
+
+    def update(self, table):
+        """Adds the rows of an Arrow table"""
+        if table.num_rows == 0 or self.period_column not in table.schema.names:
+            return
+        periods, inverse = self.get_row_periods(table)
+        digests = np.zeros(len(periods), dtype=np.uint64)
+        np.add.at(digests, inverse, self.get_row_hashes(table))
+        counts = np.bincount(inverse, minlength=len(periods))
+        for period, digest, count in zip(periods, digests, counts):
+            merge_period(self.periods, period, int(count), int(digest))
+
+    def get_fingerprints(self) -> dict:
+        return {
+            period: {"num_rows": entry["num_rows"], "digest": f"{entry['digest']:016x}"}
+            for period, entry in sorted(self.periods.items())
+        }
+
+
+def merge_period(periods: dict, period: str, num_rows: int, digest: int):
+    entry = periods.setdefault(period, {"num_rows": 0, "digest": 0})
+    entry["num_rows"] += num_rows
+    entry["digest"] = (entry["digest"] + digest) & DIGEST_MASK
+
+
+def merge_fingerprints(fingerprints: list) -> dict:
+    """Fingerprints of the files of a partition ==> fingerprints of the partition"""
+    periods = {}
+    for file_fingerprints in fingerprints:
+        for period, entry in file_fingerprints.items():
+            merge_period(periods, period, entry["num_rows"], int(entry["digest"], 16))
+    return {
+        period: {"num_rows": entry["num_rows"], "digest": f"{entry['digest']:016x}"}
+        for period, entry in sorted(periods.items())
+    }
+
+
+def get_changed_periods(current: dict, previous: dict) -> list:
+    """Periods added, removed or holding different rows between two snapshots"""
+    return sorted(
+        period
+        for period in set(current) | set(previous)
+        if current.get(period) != previous.get(period)
+    )
@@ -0,0 +1,62 @@
+"""
+Matching of incoming objects against `registered_incoming_files`.
+
+A registered file is identified either by `prefixes` ( legacy, substring
+match, exactly one file ) or by a shard `pattern` ( fnmatch on the file
+name ) with `expected_count` or `min_count`. All shards of a registered
+file land in the same table partition.
+"""
+import json
+import os
+from fnmatch import fnmatch
+
+
+# Parsed pipeline_meta files, kept for the life of the Lambda container
+_REGISTERED_FILES_CACHE = {}
+
+
+def load_registered_files(pipeline_meta_path: str) -> list:
+    if pipeline_meta_path not in _REGISTERED_FILES_CACHE:
+        with open(pipeline_meta_path) as meta_file:
+            _REGISTERED_FILES_CACHE[pipeline_meta_path] = json.load(meta_file)[
+                "registered_incoming_files"
+            ]
+    return _REGISTERED_FILES_CACHE[pipeline_meta_path]
+
+
+def describe_registered_file(registered_file: dict) -> str:
+    return registered_file.get("pattern") or registered_file["prefixes"]
+
+
+def match_registered_file(registered_file: dict, object_keys: list) -> list:
+    """Returns every incoming object key belonging to the registered file"""
+    if registered_file.get("pattern"):
+        return sorted(
+            key
+            for key in object_keys
+            if fnmatch(os.path.basename(key), registered_file["pattern"])
+        )
+    return sorted(key for key in object_keys if key.find(registered_file["prefixes"]) >= 0)
+
+
+def get_expected_count(registered_file: dict) -> (int, int):
+    """Returns (minimum, maximum) shard count, maximum is None when open ended"""
+    if "expected_count" in registered_file:
+        count = int(registered_file["expected_count"])
+        return count, count
+    if "min_count" in registered_file:
+        return int(registered_file["min_count"]), None
+    return 1, 1
+
+
+def check_shard_count(registered_file: dict, matched_keys: list) -> (str, None):
+    """Returns None when the shard count is as expected, else the reason"""
+    minimum, maximum = get_expected_count(registered_file)
+    count = len(matched_keys)
+    if count < minimum or (maximum is not None and count > maximum):
+        expected = f"{minimum}" if minimum == maximum else f"at least {minimum}"
+        return (
+            f"{describe_registered_file(registered_file)} matched {count} "
+            f"file(s), expected {expected}"
+        )
+    return None
@@ -0,0 +1,60 @@
+"""
+Starts the runs the execution ledger hands over.
+
+A run claimed from the queue owns the active slot of its state machine,
+so it must either start or be closed. Both the workflow trigger and the
+execution complete Lambda go through QueuedRunStarter for that.
+"""
+import json
+from datetime import datetime
+
+import boto3
+from botocore.exceptions import ClientError
+
+from common.execution_ledger import RUN_STARTED, STATUS_FAILED
+
+
+class QueuedRunStarter(object):
+    def __init__(self, ledger, log, incremental_recompute=None):
+        self.ledger = ledger
+        self.log = log
+        # resolves the incremental parameters of a run when it starts
+        self.incremental_recompute = incremental_recompute
+        self.step_function = boto3.client("stepfunctions")
+
+    def start_run(self, state_machine: str, run: dict) -> dict:
+        """Starts a run holding the active slot, {"exec_date", "status"}"""
+        self.log.info("In start_run module")
+        step_payload = run["payload"]
+        step_payload["start_dttm"] = datetime.now().strftime("%Y%m%d%H%M%S")
+        try:
+            if self.incremental_recompute is not None:
+                self.incremental_recompute.apply(
+                    state_machine=state_machine,
+                    exec_date=run["exec_date"],
+                    step_payload=step_payload,
+                )
+            response = self.step_function.start_execution(
+                stateMachineArn=state_machine,
+                input=json.dumps(step_payload, indent=4),
+            )
+        except ClientError as ex:
+            self.log.error(f"Failed to start {run['exec_date']} : {ex}")
+            return {"exec_date": run["exec_date"], "status": STATUS_FAILED}
+        self.ledger.mark_started(
+            state_machine=state_machine,
+            exec_date=run["exec_date"],
+            execution_arn=response["executionArn"],
+        )
+        self.log.info(f"Started exec_date {run['exec_date']} : {response['executionArn']}")
+        return {"exec_date": run["exec_date"], "status": RUN_STARTED}
+
+    def complete_and_start_next(self, state_machine: str, exec_date: str, status: str) -> list:
+        """Closes exec_date and starts queued dates until one starts"""
+        self.log.info("In complete_and_start_next module")
+        return self.ledger.complete_and_start_next(
+            state_machine=state_machine,
+            exec_date=exec_date,
+            status=status,
+            start_run=lambda run: self.start_run(state_machine=state_machine, run=run),
+        )
@@ -35,14 +35,89 @@ INCOMING_FOLDER_NAME = "incoming"
 ALL_INGESTION_DIR_NAME = "all_ef_files"
 
 SUFFIX_FILES_TO_OMIT = [".done", ".completed"]
+# .done notifications go to the workflow trigger, never to readiness tracking,
+# nor do .completed ones ( READINESS_TRACKED_SUFFIXES of the cdk config )
+READINESS_UNTRACKED_SUFFIXES = [".done"]
+
+# Parallel S3 copies of incoming files ( shards ) into the landing tables
+COPY_MAX_WORKERS = 8
+
+# BACKFILL MODE OF THE DONE FILE LAMBDA
+BACKFILL_MAX_WORKERS = 8
+BACKFILL_MAX_DAYS = 366
+# exec_dates per Glue run in set-based backfills ( set_based_backfill pipelines )
+BACKFILL_SET_BASED_MAX_DAYS = 31
+
+# PRE-FLIGHT VALIDATION OF INCOMING PARQUET FILES ( footer only )
+PREFLIGHT_VALIDATION_ENABLED = (
+    os.environ.get("PREFLIGHT_VALIDATION_ENABLED", "true").lower() == "true"
+)
+PREFLIGHT_FOOTER_READ_BYTES = 64 * 1024
+PREFLIGHT_STATS_COLUMNS = ["operating_datetime_utc"]
+
+# LANDING LAYOUT CONVERSION of incoming parquet files, instead of a plain copy
+#   sorted on LAYOUT_SORT_COLUMNS, zstd, dictionary encoded LAYOUT_DICTIONARY_COLUMNS
+#   and bloom filters on LAYOUT_BLOOM_FILTER_COLUMNS, with a key-range index
+#   ( _key_index.json ) of the row groups per partition in the key order
+LAYOUT_REWRITE_ENABLED = os.environ.get("LAYOUT_REWRITE_ENABLED", "false").lower() == "true"
+# Row order of the rewritten files
+#   time ==> hours first, row groups cover a narrow time range so time predicates
+#            and the changed periods filter of the incremental recompute prune
+#            them, plant and unit lookups prune on the bloom filters
+#   key  ==> plant and unit first, key lookups prune on min/max and the key-range
+#            index, but every row group spans the whole time range of the file
+#            and time predicates prune nothing
+LAYOUT_SORT_ORDER = os.environ.get("LAYOUT_SORT_ORDER", "time")
+LAYOUT_SORT_COLUMNS = {
+    "time": ["operating_datetime_utc", "plant_id_eia", "emissions_unit_id_epa"],
+    "key": ["plant_id_eia", "emissions_unit_id_epa", "operating_datetime_utc"],
+}[LAYOUT_SORT_ORDER]
+# Sorted by time every row group spans nearly all plants and units, the index
+# would not narrow the candidates
+LAYOUT_KEY_INDEX_ENABLED = LAYOUT_SORT_ORDER == "key"
+LAYOUT_DICTIONARY_COLUMNS = ["state", "*_measurement_code"]
+LAYOUT_BLOOM_FILTER_COLUMNS = ["plant_id_eia", "emissions_unit_id_epa"]
+# Distinct keys per row group, a few thousand units are reported per state
+LAYOUT_BLOOM_FILTER_NDV = 16 * 1024
+LAYOUT_BLOOM_FILTER_FPP = 0.05
+LAYOUT_ROW_GROUP_ROWS = 1024 * 1024
+# Rows sorted together, bounds the memory of each rewrite
+LAYOUT_SORT_BUFFER_ROWS = 4 * 1024 * 1024
+LAYOUT_TARGET_FILE_BYTES = 256 * 1024 * 1024
+# Rewrites hold a sort buffer each, fewer run in parallel than plain copies
+LAYOUT_REWRITE_MAX_WORKERS = 2
+
+# INCREMENTAL RECOMPUTE of the periods ( dates ) whose landing rows changed since
+# the last successful exec_date, the other periods are carried forward from its
+# outputs. Period fingerprints are computed by the layout conversion
+INCREMENTAL_RECOMPUTE_ENABLED = LAYOUT_REWRITE_ENABLED and (
+    os.environ.get("INCREMENTAL_RECOMPUTE_ENABLED", "false").lower() == "true"
+)
+INCREMENTAL_PERIOD_COLUMN = "operating_datetime_utc"
+# A delivery changing more periods than this is recomputed in full
+INCREMENTAL_MAX_CHANGED_PERIODS = 62
+
+# INPUT FINGERPRINT FAST PATH for deliveries identical to the last success
+#   off   ==> always run the pipeline
+#   skip  ==> record the decision and do nothing else
+#   alias ==> register the exec_date partitions on copies of the previous outputs
+# either way the .completed marker is written and the depends_on pipelines start
+INPUT_FINGERPRINT_FAST_PATH = os.environ.get("INPUT_FINGERPRINT_FAST_PATH", "off")
+# Changed deliveries received while a run was in flight are replayed to it
+WF_TRIGGER_LAMBDA_NAME = os.environ.get("WF_TRIGGER_LAMBDA_NAME", "apg-workflow-trigger-lambda")
+
+# EXECUTION LEDGER ( dynamodb | local )
+EXECUTION_LEDGER_BACKEND = os.environ.get("EXECUTION_LEDGER_BACKEND", "dynamodb")
+EXECUTION_LEDGER_TABLE_NAME = os.environ.get(
+    "EXECUTION_LEDGER_TABLE", f"apg-execution-ledger-{STAGE.lower()}"
+)
 
 DATA_PIPELINE = {
     "state_emission_daily.done": {
         "type": "state_emission_daily",
         "incoming_path": f"{INCOMING_FOLDER_NAME}/all_ef_files",
-        "create_wf_dependency_done_file": [
-            "state_emission_monthly.done",
-        ],
+        # Dependents are started by the execution complete lambda ( depends_on )
+        "create_wf_dependency_done_file": [],
         "workflows": [
             {
                 "cadence": "daily",
@@ -59,11 +134,21 @@ DATA_PIPELINE = {
             "param_processed_db_name": PROCESSED_DB_NAME,
         },
         "step_function_payloads": {"key": "value"},
+        "fingerprint_fast_path": INPUT_FINGERPRINT_FAST_PATH,
+        "fingerprint_alias_tables": [
+            {"db_name": PROCESSED_DB_NAME, "table_name": "utility_emissions_daily"},
+        ],
+        # Every task takes param_execution_start_date / param_execution_end_date
+        "set_based_backfill": True,
+        # Tasks take param_incremental_source_exec_date / param_changed_periods
+        "incremental_recompute": INCREMENTAL_RECOMPUTE_ENABLED,
     },
     "state_emission_monthly.done": {
         "type": "usghgemission_monthly",
         "incoming_path": f"{INCOMING_FOLDER_NAME}/all_ef_files",
         "create_wf_dependency_done_file": [],
+        # Started with the daily payload when daily succeeds for the exec_date
+        "depends_on": ["state_emission_daily.done"],
         "workflows": [
             {
                 "cadence": "daily",
@@ -80,5 +165,9 @@ DATA_PIPELINE = {
             "param_processed_db_name": PROCESSED_DB_NAME,
         },
         "step_function_payloads": {"key": "value"},
+        "fingerprint_fast_path": INPUT_FINGERPRINT_FAST_PATH,
+        "fingerprint_alias_tables": [],
+        # Audits are rendered for a single exec_date
+        "set_based_backfill": False,
     },
 }
@@ -3,13 +3,22 @@
     The Lambda function is responsible for creating
     {pipeline}.done file in the incoming folder
 """
-import json
 import os
 import boto3
 import config
+from common.execution_ledger import get_execution_ledger
 from common.log_utils import setup_logger
+from common.registered_files import (
+    check_shard_count,
+    describe_registered_file,
+    load_registered_files,
+    match_registered_file,
+)
 import datetime
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from io import BytesIO
+from urllib.parse import unquote_plus
 
 
 def handler(event, context):
@@ -21,11 +30,18 @@ def handler(event, context):
             If more or less files are present,done file is not created.
         3. If all checks are passed, it creates 0 byte .done file
            , e.g. state_emission.done
+    Incoming object-created events update the readiness record of the
+    (pipeline, date) and create the .done file as soon as the registered
+    set is complete. The scheduled run is a reconciliation sweep.
     TO-DO:
         1. If file not received by the end of the day?
     """
     print(f"Done Lambda payload = {event}")
     ex = CreateDoneFile(event=event, context=context, cnf=config)
+    if "Records" in event:
+        return ex.track_readiness()
+    if "backfill" in event.get("payload", {}):
+        return ex.backfill()
     return ex.execute()
 
 
@@ -33,7 +49,6 @@ class CreateDoneFile(object):
     def __init__(self, event, context, cnf):
         self.event = event
         self.context = context
-        self.pipeline_meta_path = None
         self.log = setup_logger()
         self.cnf = cnf
         self.exec_type = None
@@ -51,6 +66,10 @@ class CreateDoneFile(object):
             pass
 
         self.s3 = boto3.client("s3")
+        self.ledger = get_execution_ledger(cnf)
+        self.listing_cache = {}
+        # backfill evaluates (pipeline, date) pairs in threads sharing the cache
+        self.listing_lock = threading.Lock()
 
     def create_done_file(self, bucket_path, done_file_name) -> bool:
         self.log.info("In create_done_file module.")
@@ -65,16 +84,23 @@ class CreateDoneFile(object):
             f"Successfully created {self.cnf.S3_LANDING_BUCKET_NAME}/"
             f"{bucket_path}{done_file_name} "
         )
+        with self.listing_lock:
+            # copied, a listing handed out earlier is not changed under its reader
+            if bucket_path in self.listing_cache:
+                self.listing_cache[bucket_path] = self.listing_cache[bucket_path] + [
+                    done_file_name
+                ]
         return True
 
     # move the bucket out and use self. Data types
     def match_incoming_file(
-        self, objects_in_s3_path, expected_data_files_prefixes, done_file_name
+        self, objects_in_s3_path, registered_files, done_file_name
     ) -> bool:
         self.log.info(
             "In match_incoming_file module. \n"
             "Start the match process to see if all files are present "
-            "and only required files are present.One of each type."
+            "and only required files are present. One of each type, or the "
+            "registered shard count."
         )
 
         # check if .done file exists. if so, return without creating a new file
@@ -86,73 +112,77 @@ class CreateDoneFile(object):
                 )
                 return False
 
-        # match the incoming files with the data_file_prefixes.
-        # There should be exact 1 file for each data file prefixes
+        # match the incoming files with each registered file. Prefixes need
+        # exactly 1 file, shard patterns their expected or minimum count
+        mismatches = []
         incoming_file_match_count = 0
-        data_file_prefixes_count = len(expected_data_files_prefixes)
-
-        for incoming_file in objects_in_s3_path:
-            for data_file_prefix in expected_data_files_prefixes:
-                if incoming_file.find(data_file_prefix) >= 0:
-                    incoming_file_match_count = incoming_file_match_count + 1
-                    break
+        for registered_file in registered_files:
+            matched_files = match_registered_file(registered_file, objects_in_s3_path)
+            incoming_file_match_count += len(matched_files)
+            mismatch = check_shard_count(registered_file, matched_files)
+            if mismatch is not None:
+                mismatches.append(mismatch)
 
         self.log.info(
             f"{incoming_file_match_count} incoming files matched with "
-            f"{data_file_prefixes_count} data file prefixes."
+            f"{len(registered_files)} registered files."
         )
 
-        if incoming_file_match_count != data_file_prefixes_count:
+        if mismatches:
             self.log.info(
-                f"{done_file_name} not created: Number and/or name of incoming file do not match with data prefixes."
+                f"{done_file_name} not created: Number and/or name of incoming "
+                f"file do not match with registered files. {mismatches}"
             )
             return False
 
         return True
 
-    def get_expected_data_files_prefixes(self, pipeline) -> list:
-        self.log.info("In get_expected_data_files_prefixes module.")
-        self.pipeline_meta_path = os.path.join(
+    def get_registered_files(self, pipeline) -> list:
+        self.log.info("In get_registered_files module.")
+        pipeline_meta_path = os.path.join(
             os.path.dirname(os.path.abspath(__file__)),
             self.cnf.PIPELINE_META_DIR,
             f"{pipeline}.json",
         )
 
-        self.log.info(f"pipeline meta file to be read is {self.pipeline_meta_path}.")
-        data_file_prefixes = []
-        with open(self.pipeline_meta_path) as meta_file:
-            expected_files = json.load(meta_file)["registered_incoming_files"]
-            for value in expected_files:
-                data_file_prefixes.append(value["prefixes"])
+        self.log.info(f"pipeline meta file to be read is {pipeline_meta_path}.")
+        registered_files = load_registered_files(pipeline_meta_path)
         self.log.info(
-            f"List of all data file prefixes for pipeline {pipeline} is: "
-            f"{','.join(data_file_prefixes)}."
+            f"List of all registered files for pipeline {pipeline} is: "
+            f"{','.join(describe_registered_file(f) for f in registered_files)}."
         )
-        return data_file_prefixes
+        return registered_files
 
     def get_objects_in_s3_path(self, bucket_path) -> list:
+        """
+        Lists the folder once per invocation, pipelines sharing an
+        incoming_path are evaluated against the same listing
+        """
         self.log.info("In get_objects_in_s3_path module.")
-        s3_list_objects_response = self.s3.list_objects(
+        with self.listing_lock:
+            if bucket_path in self.listing_cache:
+                return self.listing_cache[bucket_path]
+
+        paginator = self.s3.get_paginator("list_objects_v2")
+        pages = paginator.paginate(
             Bucket=self.cnf.S3_LANDING_BUCKET_NAME, Prefix=bucket_path
         )
-        if (
-            "Contents" not in s3_list_objects_response
-        ):  # folder (e.g. 2023-03-03) not present.
-            self.log.info(
-                f"Incoming folder {bucket_path} not present in bucket "
-                f"{self.cnf.S3_LANDING_BUCKET_NAME}."
-            )
-            return []
-
-        s3_objects = []
         # get the files from the latest exec date folder and exclude the
         # folder name from the list
         s3_objects = [
             item["Key"].replace(bucket_path, "").strip()
-            for item in s3_list_objects_response["Contents"]
+            for page in pages
+            for item in page.get("Contents", [])
             if item["Key"] != bucket_path
         ]
-        return s3_objects
+        if not s3_objects:  # folder (e.g. 2023-03-03) not present.
+            self.log.info(
+                f"Incoming folder {bucket_path} not present in bucket "
+                f"{self.cnf.S3_LANDING_BUCKET_NAME}."
+            )
+        # a concurrent listing of the same folder may have been cached first
+        with self.listing_lock:
+            return self.listing_cache.setdefault(bucket_path, s3_objects)
 
     def check_cadence(self, pipeline_value: dict) -> bool:
         for schedule in pipeline_value["workflows"]:
@@ -162,28 +192,42 @@ class CreateDoneFile(object):
 
     def create_dependent_pipeline_completed(
         self, bucket_path: str, pipeline_props: dict
-    ):
+    ) -> list:
+        markers = []
         for done_file in pipeline_props["create_wf_dependency_done_file"]:
             self.create_done_file(bucket_path, done_file)
+            markers.append(done_file)
 
         self.create_done_file(bucket_path, f"{pipeline_props['type']}.completed")
+        markers.append(f"{pipeline_props['type']}.completed")
+        return markers
 
-    def create_done_file_logic(self, pipeline: str, pipeline_props: dict) -> dict:
+    def create_done_file_logic(
+        self, pipeline: str, pipeline_props: dict, exec_date: datetime.date = None
+    ) -> dict:
         """
         create_done_file
             True  ==> creates .done file for the current pipeline
             False ==> creates .done file(s) specified
                       in create_wf_dependency_done_file config
 
+        exec_date defaults to the run date of the invocation
         """
+        exec_date = exec_date or self.today
+        if self.exec_type == "self_pipeline" and pipeline_props.get("depends_on"):
+            self.log.info(
+                f"Not creating `{pipeline}` file: started on completion of "
+                f"{pipeline_props['depends_on']}"
+            )
+            return {"status": False, "bucket": "", "done_file": "", "reason": "dependency"}
 
         self.log.info("\n")
         # fmt: off
-        bucket_path = pipeline_props['incoming_path'] + '/' + self.today.strftime('%Y-%m-%d') + '/'  # noqa
+        bucket_path = pipeline_props['incoming_path'] + '/' + exec_date.strftime('%Y-%m-%d') + '/'  # noqa
         # fmt: on
         self.log.info(
             f"########      Verify for pipeline {pipeline_props['type']} for "
-            f"date {self.today}     ########"
+            f"date {exec_date}     ########"
         )
         self.log.info(
             f"Get the list of objects present in {self.cnf.S3_LANDING_BUCKET_NAME} "
@@ -192,19 +236,17 @@ class CreateDoneFile(object):
         objects_in_s3_path = self.get_objects_in_s3_path(bucket_path)
 
         self.log.info(
-            f"Get the list of expected data file prefixes for pipeline "
+            f"Get the list of registered files for pipeline "
             f"{pipeline.split('.')[0]}."
         )
-        expected_data_files_prefixes = self.get_expected_data_files_prefixes(
-            pipeline.split(".")[0]
-        )
+        registered_files = self.get_registered_files(pipeline.split(".")[0])
 
         done_file_name = (
             pipeline  # done file name is same as pipeline
         )
 
         if self.match_incoming_file(
-            objects_in_s3_path, expected_data_files_prefixes, done_file_name
+            objects_in_s3_path, registered_files, done_file_name
         ):
             # TO CHECK CADENCE
             if self.check_cadence(pipeline_props):
@@ -216,14 +258,34 @@ class CreateDoneFile(object):
                     "status": True,
                     "bucket": bucket_path,
                     "done_file": done_file_name,
+                    "reason": "ready",
                 }
             else:
                 self.log.info(
                     f"Not creating `{done_file_name}` file: All conditions met, "
                     f"but cadence not met"
                 )
+                return {"status": False, "bucket": "", "done_file": "", "reason": "cadence"}
 
-        return {"status": False, "bucket": "", "done_file": ""}
+        reason = (
+            "done_exists"
+            if done_file_name in objects_in_s3_path and self.exec_type == "self_pipeline"
+            else "incomplete"
+        )
+        return {"status": False, "bucket": "", "done_file": "", "reason": reason}
+
+    def get_pipelines_by_incoming_path(self) -> list:
+        """DATA_PIPELINE items ordered so pipelines sharing a prefix are adjacent"""
+        incoming_paths = {}
+        for pipeline, pipeline_props in self.cnf.DATA_PIPELINE.items():
+            incoming_paths.setdefault(pipeline_props["incoming_path"], []).append(
+                (pipeline, pipeline_props)
+            )
+        self.log.info(
+            f"{len(self.cnf.DATA_PIPELINE)} pipelines share "
+            f"{len(incoming_paths)} incoming paths"
+        )
+        return [item for items in incoming_paths.values() for item in items]
 
     def get_pipeline_info(self, target_pipeline_name: str) -> (str, dict):
         for pipeline, pipeline_name in self.cnf.DATA_PIPELINE.items():
@@ -231,6 +293,154 @@ class CreateDoneFile(object):
                 return pipeline, pipeline_name
         raise Exception(f"{target_pipeline_name} not found in configuration ")
 
+    def is_tracked_set_complete(self, registered_files: list, received_files: set) -> bool:
+        """
+        Registered files with untracked suffixes ( .done ) do not raise
+        events here and are confirmed by the listing in create_done_file_logic
+        """
+        for registered_file in registered_files:
+            if describe_registered_file(registered_file).endswith(
+                tuple(self.cnf.READINESS_UNTRACKED_SUFFIXES)
+            ):
+                continue
+            matched_files = match_registered_file(registered_file, list(received_files))
+            if check_shard_count(registered_file, matched_files) is not None:
+                return False
+        return True
+
+    def track_readiness(self) -> list:
+        """Event driven path, one S3 object-created record at a time"""
+        self.log.info("Started Track Readiness")
+        self.exec_type = "self_pipeline"
+        responses = []
+        for record in self.event["Records"]:
+            key = unquote_plus(record["s3"]["object"]["key"])
+            date_folder = os.path.dirname(key)
+            file_name = os.path.basename(key)
+            try:
+                exec_date = datetime.datetime.strptime(
+                    os.path.basename(date_folder), "%Y-%m-%d"
+                ).date()
+            except ValueError:
+                self.log.info(f"{key} is not in a dated incoming folder, skipping")
+                continue
+
+            for pipeline, pipeline_props in self.cnf.DATA_PIPELINE.items():
+                if os.path.dirname(date_folder) != pipeline_props["incoming_path"]:
+                    continue
+                registered_files = self.get_registered_files(pipeline.split(".")[0])
+                if not any(match_registered_file(f, [file_name]) for f in registered_files):
+                    continue
+                received_files = self.ledger.add_received_file(
+                    pipeline=pipeline,
+                    exec_date=exec_date.strftime("%Y-%m-%d"),
+                    file_name=file_name,
+                )
+                self.log.info(
+                    f"{pipeline} {exec_date} received {len(received_files)} files"
+                )
+                if not self.is_tracked_set_complete(registered_files, received_files):
+                    continue
+                responses.append(
+                    self.evaluate_readiness(
+                        pipeline=pipeline, pipeline_props=pipeline_props, exec_date=exec_date
+                    )
+                )
+        self.log.info("Completed Track Readiness")
+        return responses
+
+    def evaluate_readiness(
+        self, pipeline: str, pipeline_props: dict, exec_date: datetime.date
+    ) -> dict:
+        """Evaluates one (pipeline, date) pair and writes its markers when ready"""
+        result = {
+            "pipeline": pipeline_props["type"],
+            "exec_date": exec_date.strftime("%Y-%m-%d"),
+            "markers": [],
+        }
+        try:
+            response = self.create_done_file_logic(
+                pipeline=pipeline, pipeline_props=pipeline_props, exec_date=exec_date
+            )
+        except Exception as e:  # noqa
+            self.log.error(f"Failed {pipeline} {exec_date} : {e}")
+            return {**result, "status": "failed", "reason": str(e)}
+
+        if not response["status"]:
+            status = "incomplete" if response["reason"] == "incomplete" else "skipped"
+            return {**result, "status": status, "reason": response["reason"]}
+
+        if self.exec_type == "dependency_pipeline":
+            result["markers"] = self.create_dependent_pipeline_completed(
+                bucket_path=response["bucket"], pipeline_props=pipeline_props
+            )
+        elif self.ledger.claim_done_file(
+            pipeline=pipeline, exec_date=result["exec_date"]
+        ):
+            self.create_done_file(response["bucket"], response["done_file"])
+            result["markers"] = [response["done_file"]]
+        else:
+            return {**result, "status": "skipped", "reason": "claimed"}
+        return {**result, "status": "written", "reason": response["reason"]}
+
+    def get_backfill_pairs(self, backfill: dict) -> list:
+        """(pipeline, pipeline_props, date) for every date and selected pipeline"""
+        self.log.info("In get_backfill_pairs module.")
+        start_date = datetime.datetime.strptime(backfill["start_date"], "%Y-%m-%d").date()
+        end_date = datetime.datetime.strptime(
+            backfill.get("end_date", backfill["start_date"]), "%Y-%m-%d"
+        ).date()
+        days = (end_date - start_date).days + 1
+        if days < 1 or days > self.cnf.BACKFILL_MAX_DAYS:
+            raise Exception(
+                f"Backfill range {start_date} to {end_date} must cover 1 to "
+                f"{self.cnf.BACKFILL_MAX_DAYS} days"
+            )
+
+        selected = backfill.get("pipelines", [])
+        pipelines = [
+            (pipeline, pipeline_props)
+            for pipeline, pipeline_props in self.get_pipelines_by_incoming_path()
+            if not selected
+            or pipeline.split(".")[0] in selected
+            or pipeline_props["type"] in selected
+        ]
+        if not pipelines:
+            raise Exception(f"No pipeline in configuration matches {selected}")
+        return [
+            (pipeline, pipeline_props, start_date + datetime.timedelta(days=i))
+            for i in range(days)
+            for pipeline, pipeline_props in pipelines
+        ]
+
+    def backfill(self) -> dict:
+        """
+        Evaluates a date range in one call, payload
+            {"backfill": {"start_date": "YYYY-MM-DD", "end_date": "YYYY-MM-DD",
+                          "pipelines": [...], "mode": "self_pipeline"}}
+        mode dependency_pipeline writes the dependency .done and .completed
+        markers instead of the pipeline's own .done
+        """
+        self.log.info("Started Backfill")
+        backfill = self.event["payload"]["backfill"]
+        self.exec_type = backfill.get("mode", "self_pipeline")
+        if self.exec_type not in ("self_pipeline", "dependency_pipeline"):
+            raise Exception(f"Unknown backfill mode {self.exec_type}")
+
+        pairs = self.get_backfill_pairs(backfill)
+        max_workers = max(1, min(self.cnf.BACKFILL_MAX_WORKERS, len(pairs)))
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            results = list(executor.map(lambda pair: self.evaluate_readiness(*pair), pairs))
+
+        summary = {"written": [], "skipped": [], "incomplete": [], "failed": []}
+        for result in results:
+            summary[result.pop("status")].append(result)
+        self.log.info(
+            f"Backfill of {len(pairs)} (pipeline, date) pairs : "
+            + ", ".join(f"{k} = {len(v)}" for k, v in summary.items())
+        )
+        return summary
+
     def execute(self):
         """Driver module"""
         self.log.info("Started Create Done File Steps")
@@ -253,11 +463,13 @@ class CreateDoneFile(object):
                 )
         else:
             self.exec_type = "self_pipeline"
-            for pipeline, pipeline_props in self.cnf.DATA_PIPELINE.items():
+            for pipeline, pipeline_props in self.get_pipelines_by_incoming_path():
                 response = self.create_done_file_logic(
                     pipeline=pipeline, pipeline_props=pipeline_props
                 )
-                if response["status"]:
+                if response["status"] and self.ledger.claim_done_file(
+                    pipeline=pipeline, exec_date=self.today.strftime("%Y-%m-%d")
+                ):
                     self.create_done_file(response["bucket"], response["done_file"])
 
 
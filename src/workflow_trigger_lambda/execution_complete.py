@@ -0,0 +1,183 @@
+#!/usr/bin/python3
+"""
+The Lambda function is responsible for closing runs in the
+execution ledger, starting the next queued exec_date and
+starting the pipelines depending on a succeeded one
+"""
+import json
+
+import boto3
+
+import config as cfg
+from common.dependent_pipelines import DependentPipelines
+from common.execution_ledger import (
+    get_execution_ledger,
+    STATUS_RUNNING,
+    STATUS_SUCCEEDED,
+)
+from common.incremental_recompute import IncrementalRecompute
+from common.log_utils import setup_logger
+from common.run_starter import QueuedRunStarter
+
+
+def handler(event, context):
+    """
+    Lambda function is responsible for the following,
+        1. Receive Step Functions execution status change events
+        2. Record the terminal status against (state machine, exec_date),
+           events of executions the ledger did not start are ignored
+        3. Start the oldest exec_date queued while the execution was running
+        4. Replay a changed delivery received while the execution was running
+        5. On success, write the {pipeline}.completed marker and start the
+           pipelines declaring depends_on for the same exec_date
+        6. Release the exec_dates held by a finished backfill execution and,
+           on success, backfill the depends_on pipelines over its range
+    """
+    ex = CompleteExecution(event=event, context=context, cnf=cfg)
+    return ex.execute()
+
+
+class CompleteExecution(object):
+    def __init__(self, event, context, cnf):
+        self.log = setup_logger()
+        self.event = event
+        self.context = context
+        self.cnf = cnf
+        self.lambda_client = boto3.client("lambda")
+        self.ledger = get_execution_ledger(cnf)
+        self.run_starter = QueuedRunStarter(
+            ledger=self.ledger,
+            log=self.log,
+            incremental_recompute=IncrementalRecompute(cnf=cnf, ledger=self.ledger, log=self.log),
+        )
+        self.dependent_pipelines = DependentPipelines(
+            cnf=cnf, ledger=self.ledger, run_starter=self.run_starter, log=self.log
+        )
+
+    def get_execution_input(self, execution_input: str) -> dict:
+        self.log.info("In get_execution_input module")
+        try:
+            return json.loads(execution_input)
+        except (TypeError, ValueError):
+            return {}
+
+    def is_run_execution(self, run: dict, execution_arn: str) -> bool:
+        """
+        True when the execution is the one the ledger started for the run.
+        Events are delivered at least once, and executions started by hand
+        or by an earlier run of the exec_date must not close the current one.
+        """
+        self.log.info("In is_run_execution module")
+        if run is None or run["status"] != STATUS_RUNNING:
+            return False
+        # A run is RUNNING before mark_started records its execution
+        return run.get("execution_arn", execution_arn) == execution_arn
+
+    def replay_rerun_event(self, state_machine: str, exec_date: str) -> (dict, None):
+        """
+        Sends a delivery recorded while the run was in flight back to the
+        workflow trigger, which re-ingests and registers it as a new run
+        """
+        self.log.info("In replay_rerun_event module")
+        rerun_event = self.ledger.get_rerun_event(state_machine=state_machine, exec_date=exec_date)
+        if rerun_event is None:
+            return None
+        self.lambda_client.invoke(
+            FunctionName=self.cnf.WF_TRIGGER_LAMBDA_NAME,
+            InvocationType="Event",
+            Payload=json.dumps({"Records": [rerun_event]}),
+        )
+        self.log.info(f"Replayed changed delivery for {exec_date} : {rerun_event['s3']}")
+        return {"exec_date": exec_date, "status": "RERUN_REPLAYED"}
+
+    def complete_backfill(self, detail: dict) -> (list, None):
+        """
+        Releases the exec_dates a backfill execution held with its status,
+        replays the deliveries received for them meanwhile and, when it
+        succeeded, backfills the depends_on pipelines over the same range.
+        None when the execution is no backfill.
+        """
+        self.log.info("In complete_backfill module")
+        hold = self.ledger.release_backfill(
+            backfill_execution=detail["executionArn"], status=detail["status"]
+        )
+        if hold is None:
+            return None
+        self.log.info(
+            f"Backfill {detail['executionArn']} finished with status {detail['status']}, "
+            f"released {len(hold['released_exec_dates'])} exec_date(s)"
+        )
+        responses = []
+        for exec_date in hold["released_exec_dates"]:
+            rerun = self.replay_rerun_event(
+                state_machine=hold["held_state_machine"], exec_date=exec_date
+            )
+            if rerun is not None:
+                responses.append(rerun)
+        backfill = json.loads(hold["backfill"])
+        # A duplicate event releases nothing and starts nothing
+        if detail["status"] == STATUS_SUCCEEDED and hold["released_exec_dates"]:
+            responses.extend(
+                self.dependent_pipelines.start_dependent_backfills(
+                    pipeline_type=backfill["pipeline_type"], backfill=backfill["input"]
+                )
+            )
+        return responses
+
+    def execute(self):
+        """Driver module"""
+        self.log.info("Started Complete Execution")
+        detail = self.event["detail"]
+        responses = self.complete_backfill(detail)
+        if responses is not None:
+            return json.dumps(responses, default=str)
+        state_machine = detail["stateMachineArn"]
+        execution_input = self.get_execution_input(detail.get("input"))
+        exec_date = execution_input.get("date")
+        if exec_date is None:
+            self.log.info(f"No exec_date in input of {detail['executionArn']}, skipping")
+            return json.dumps([])
+        if execution_input.get("backfill") == "true":
+            # Distributed Map iteration of a backfill, not a ledger run
+            self.log.info(f"Backfill execution {detail['executionArn']}, skipping")
+            return json.dumps([])
+
+        self.log.info(
+            f"Execution {detail['executionArn']} for {exec_date} "
+            f"finished with status {detail['status']}"
+        )
+        run = self.ledger.get_run(state_machine=state_machine, exec_date=exec_date)
+        if not self.is_run_execution(run=run, execution_arn=detail["executionArn"]):
+            self.log.info(
+                f"SKIP: {detail['executionArn']} is not the ledger run of {exec_date}, "
+                f"duplicate event or execution started outside the trigger"
+            )
+            return json.dumps([])
+        # Queued dates that can not start are closed and the next one is tried
+        responses = self.run_starter.complete_and_start_next(
+            state_machine=state_machine, exec_date=exec_date, status=detail["status"]
+        )
+        # Read after the completion, a rerun recorded later is replayed by the trigger
+        rerun = self.replay_rerun_event(state_machine=state_machine, exec_date=exec_date)
+        if rerun is not None:
+            responses.append(rerun)
+
+        if detail["status"] == STATUS_SUCCEEDED:
+            responses.extend(
+                self.dependent_pipelines.complete(
+                    pipeline_type=execution_input.get("pipeline_type"),
+                    upstream_input=execution_input,
+                    event_token=detail["executionArn"],
+                    fingerprint=run.get("fingerprint", ""),
+                )
+            )
+        self.log.info("Completed CompleteExecution")
+        return json.dumps(responses, default=str)
+
+
+if __name__ == "__main__":
+    """Run Lambda Function locally"""
+    from pprint import pprint as pp
+
+    PAYLOAD = {}
+    pp(handler(PAYLOAD, {}))
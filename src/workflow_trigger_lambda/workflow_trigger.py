@@ -4,16 +4,39 @@ The Lambda function is responsible for triggering the
 respective StepFunction based on the file loaded
 """
 
+import hashlib
 import json
 import logging
 import os
 import boto3
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from botocore.exceptions import ClientError
 from urllib.parse import urlparse
 
 import config as cfg
+from common.dependent_pipelines import DependentPipelines
+from common.execution_ledger import (
+    get_execution_ledger,
+    DECISION_START,
+    DECISION_QUEUED,
+    STATUS_ALIASED,
+    STATUS_FAILED,
+    STATUS_INGESTED,
+    STATUS_UNCHANGED,
+)
+from common.key_index import KEY_INDEX_FILE_NAME, build_key_index
 from common.log_utils import setup_logger
+from common.incremental_recompute import INCREMENTAL_TABLES_KEY, IncrementalRecompute
+from common.period_fingerprint import PERIOD_FINGERPRINTS_FILE_NAME, merge_fingerprints
+from common.parquet_layout import ParquetLayoutRewriter
+from common.parquet_preflight import ParquetPreflight
+from common.run_starter import QueuedRunStarter
+from common.registered_files import (
+    check_shard_count,
+    load_registered_files,
+    match_registered_file,
+)
 
 
 def handler(event, context):
@@ -25,10 +48,47 @@ def handler(event, context):
         3. Trigger respective step function
     """
 
+    if is_sqs_event(event):
+        return handle_sqs_batch(event=event, context=context)
     ex = TriggerStateMachine(event=event, context=context, cnf=cfg)
     return ex.execute()
 
 
+def is_sqs_event(event) -> bool:
+    records = event.get("Records", [])
+    return len(records) > 0 and records[0].get("eventSource") == "aws:sqs"
+
+
+def handle_sqs_batch(event, context) -> dict:
+    """
+    S3 notifications buffered through SQS arrive as a batch of messages,
+    each wrapping an S3 event. Every S3 record runs as its own trigger and
+    failed messages are reported back so only they are redelivered.
+    """
+    batch_item_failures = []
+    seen_objects = set()
+    for message in event["Records"]:
+        try:
+            s3_event = json.loads(message["body"])
+            # s3:TestEvent is sent once when the notification is configured
+            for record in s3_event.get("Records", []):
+                object_id = (
+                    record["s3"]["bucket"]["name"],
+                    record["s3"]["object"]["key"],
+                    record["s3"]["object"].get("sequencer", ""),
+                )
+                if object_id in seen_objects:
+                    continue
+                seen_objects.add(object_id)
+                TriggerStateMachine(
+                    event={"Records": [record]}, context=context, cnf=cfg
+                ).execute()
+        except Exception as e:  # noqa
+            logging.error(f"Failed to process message {message['messageId']} : {e}")
+            batch_item_failures.append({"itemIdentifier": message["messageId"]})
+    return {"batchItemFailures": batch_item_failures}
+
+
 class TriggerStateMachine(object):
     def __init__(self, event, context, cnf):
         self.item = None
@@ -46,10 +106,24 @@ class TriggerStateMachine(object):
         self.s3 = boto3.client("s3")
         self.s3_resource = boto3.resource("s3")
         self.step_function = boto3.client("stepfunctions")
+        self.glue = boto3.client("glue")
+        self.ledger = get_execution_ledger(cnf)
+        self.incremental_recompute = IncrementalRecompute(cnf=cnf, ledger=self.ledger, log=self.log)
+        self.run_starter = QueuedRunStarter(
+            ledger=self.ledger, log=self.log, incremental_recompute=self.incremental_recompute
+        )
+        self.dependent_pipelines = DependentPipelines(
+            cnf=cnf, ledger=self.ledger, run_starter=self.run_starter, log=self.log
+        )
         self.today = datetime.today()
         self.exec_date = None
         self.step_function_payload = {}
         self.glue_bucket: str = self.cnf.S3_GLUE_BUCKET_NAME
+        self.incoming_file_stats = {}
+        self.table_storage_descriptors = {}
+        self.incoming_object_meta = {}
+        self.fingerprint = ""
+        self.s3_record = None
 
     def get_s3_file_content(self, s3_path: str) -> str:
         try:
@@ -80,6 +154,10 @@ class TriggerStateMachine(object):
             "size": str(
                 s3_payload["object"]["size"]
             ),  # Step function mandates this to be string
+            # Identifies the object write, so redelivered events coalesce
+            "event_token": s3_payload["object"].get(
+                "sequencer", s3_payload["object"].get("eTag", "")
+            ),
         }
 
     def get_objects_in_s3_path(
@@ -98,6 +176,10 @@ class TriggerStateMachine(object):
                         pass
                     else:
                         s3_objects.append(obj["Key"])
+                        self.incoming_object_meta[obj["Key"]] = {
+                            "etag": obj.get("ETag", "").strip('"'),
+                            "size": obj.get("Size", 0),
+                        }
             except KeyError:
                 logging.info(
                     f"No items in s3 bucket {bucket_name} in path {bucket_path}"
@@ -148,33 +230,78 @@ class TriggerStateMachine(object):
             bucket_path=self.s3_payload["key_path"],
         )
 
-        with open(self.pipeline_meta_path) as meta_file:
-            expected_files = json.load(meta_file)
-            for file in expected_files["registered_incoming_files"]:
-                print(f"get_destination_matrix ==>  {file}")
-                if self.is_file_to_be_omitted(
-                    file_name=self.get_src_file_path(file["prefixes"])
-                ):
-                    copy_matrix_item = {}
-                    copy_matrix_item["table_name"] = file["table_name"]
-                    copy_matrix_item["partitioned"] = file["partitioned"]
-                    source_file = self.get_src_file_path(file["prefixes"])
-                    copy_matrix_item["src_file_path"] = source_file
-                    copy_matrix_item["src_bucket"] = self.s3_payload["bucket"]
-                    copy_matrix_item["dest_bucket"] = self.s3_payload["bucket"]
-
-                    copy_matrix_item["dest_file_path"] = (
-                        f"{self.cnf.LANDING_DB_NAME}/{copy_matrix_item['table_name']}/"
-                        f"exec_date={self.exec_date}/{os.path.basename(source_file)}"
-                        if copy_matrix_item["partitioned"].lower() == "true"
-                        else f"{self.cnf.LANDING_DB_NAME}/{copy_matrix_item['table_name']}/"
-                        f"{os.path.basename(source_file)}"
-                    )
-                    copy_matrix_item["table_name"] = copy_matrix_item["table_name"]
-                    copy_matrix.append(copy_matrix_item)
+        errors = []
+        for file in load_registered_files(self.pipeline_meta_path):
+            print(f"get_destination_matrix ==>  {file}")
+            source_files = self.get_src_file_paths(file)
+            error = check_shard_count(file, source_files)
+            if error is not None:
+                errors.append(error)
+                continue
+            for source_file in source_files:
+                if not self.is_file_to_be_omitted(file_name=source_file):
+                    continue
+                copy_matrix_item = {}
+                copy_matrix_item["table_name"] = file["table_name"]
+                copy_matrix_item["partitioned"] = file["partitioned"]
+                copy_matrix_item["src_file_path"] = source_file
+                copy_matrix_item["expected_md5"] = self.get_expected_md5(
+                    file, source_file
+                )
+                copy_matrix_item["src_bucket"] = self.s3_payload["bucket"]
+                copy_matrix_item["dest_bucket"] = self.s3_payload["bucket"]
+
+                copy_matrix_item["dest_file_path"] = (
+                    f"{self.cnf.LANDING_DB_NAME}/{copy_matrix_item['table_name']}/"
+                    f"exec_date={self.exec_date}/{os.path.basename(source_file)}"
+                    if copy_matrix_item["partitioned"].lower() == "true"
+                    else f"{self.cnf.LANDING_DB_NAME}/{copy_matrix_item['table_name']}/"
+                    f"{os.path.basename(source_file)}"
+                )
+                copy_matrix.append(copy_matrix_item)
 
+        if errors:
+            raise Exception("Incoming files do not match registration : \n" + "\n".join(errors))
         return copy_matrix
 
+    def preflight_incoming_files(self):
+        """
+        Validates every incoming parquet file from its footer and rejects
+        the delivery before any copy or state machine start on failure
+        """
+        self.log.info("In preflight_incoming_files module")
+        preflight = ParquetPreflight(
+            footer_read_bytes=self.cnf.PREFLIGHT_FOOTER_READ_BYTES,
+            stats_columns=self.cnf.PREFLIGHT_STATS_COLUMNS,
+        )
+        errors = []
+        for item in self.copy_matrix:
+            if not item["src_file_path"].endswith(".parquet"):
+                continue
+            result = preflight.inspect(
+                bucket=item["src_bucket"],
+                key=item["src_file_path"],
+                database=self.cnf.LANDING_DB_NAME,
+                table=item["table_name"],
+                expected_md5=item["expected_md5"],
+            )
+            self.log.info(
+                f"Pre-flight {item['src_file_path']} : {result['num_rows']} rows in "
+                f"{result['num_row_groups']} row groups, "
+                f"row groups = {result.get('row_groups', [])}"
+            )
+            errors.extend(f"{item['src_file_path']} : {e}" for e in result["errors"])
+            table_stats = self.incoming_file_stats.setdefault(
+                item["table_name"], {"num_rows": 0, "num_row_groups": 0}
+            )
+            table_stats["num_rows"] += result["num_rows"]
+            table_stats["num_row_groups"] += result["num_row_groups"]
+
+        if errors:
+            raise Exception(
+                "Incoming files rejected by pre-flight validation : \n" + "\n".join(errors)
+            )
+
     def get_table_name(
         self, file_type: str, data_file_prefix: str, table_prefix: str
     ) -> (str, None):
@@ -185,13 +312,17 @@ class TriggerStateMachine(object):
         else:
             return None
 
-    def get_src_file_path(self, data_file_prefix: str) -> (str, None):
-        self.log.info("In get_src_file_path module")
-        for incoming_file in self.incoming_objects:
-            if incoming_file.find(data_file_prefix) >= 0:
-                return incoming_file
+    def get_src_file_paths(self, registered_file: dict) -> list:
+        """All incoming shards of a registered file, ordered by key"""
+        self.log.info("In get_src_file_paths module")
+        return match_registered_file(registered_file, self.incoming_objects)
 
-        raise Exception(f"File {data_file_prefix} not found")
+    def get_expected_md5(self, registered_file: dict, source_file: str) -> str:
+        """`md5` is a string for single files or a {file name: md5} map for shards"""
+        md5 = registered_file.get("md5", "")
+        if isinstance(md5, dict):
+            return md5.get(os.path.basename(source_file), "")
+        return md5
 
     def get_pipeline_type(self) -> str:
         self.log.info("In get_pipeline_type module")
@@ -224,9 +355,24 @@ class TriggerStateMachine(object):
         payload["param_execution_date"] = self.exec_date
         payload["frequency"], payload["monthly"] = self.get_cadence()
         # payload["frequency"] = self.pipeline_config_cadence
+        if self.cnf.DATA_PIPELINE[self.s3_payload["key_name"]].get("incremental_recompute"):
+            # resolved when the run starts, see common.incremental_recompute
+            self.step_function_payload[INCREMENTAL_TABLES_KEY] = self.get_incremental_tables()
         self.step_function_payload["glue_runtime_sql_params"] = json.dumps(payload)
         self.log.info(f"Parameters for {key} = {payload}")
 
+    def get_incremental_tables(self) -> list:
+        """Partitioned landing tables of the delivery, period fingerprints are kept per table"""
+        tables = {
+            item["table_name"]: {
+                "table_name": item["table_name"],
+                "dest_bucket": item["dest_bucket"],
+            }
+            for item in self.copy_matrix
+            if item["partitioned"].lower() == "true"
+        }
+        return [tables[table_name] for table_name in sorted(tables)]
+
     def get_step_function_input(self):
         self.log.info("In get_step_function_input module")
         self.step_function_payload.update({"date": self.exec_date})
@@ -240,6 +386,9 @@ class TriggerStateMachine(object):
                 "step_function_payloads"
             ].items():
                 self.step_function_payload.update({k: v})
+        # Row counts collected in pre-flight for downstream sanity checks
+        if self.incoming_file_stats:
+            self.step_function_payload["incoming_file_stats"] = self.incoming_file_stats
         # Pipeline Specific payload
         if (
             "glue_runtime_sql_params"
@@ -273,15 +422,80 @@ class TriggerStateMachine(object):
 
         return cadence, self.step_function_payload["monthly"]
 
-    def get_step_executions(self, step_function_arn: str) -> int:
+    def get_workflow_statemachine_arns(self) -> list:
+        self.log.info("In get_workflow_statemachine_arns module")
+        return [
+            self.get_statemachine_arn(parameter_name=item["param_store_state_machine_name"])
+            for item in self.cnf.DATA_PIPELINE[self.s3_payload["key_name"]]["workflows"]
+        ]
+
+    def is_exec_date_in_flight(self) -> bool:
         """
-        Given the stepfunction arn returns the running counts
+        True when every workflow of the pipeline already has a run for this
+        exec_date pending, queued or running from the same delivery, the
+        event is then a duplicate
         """
-        sm_execs = boto3.client("stepfunctions").list_executions(
-            stateMachineArn=step_function_arn, statusFilter="RUNNING", maxResults=100
+        self.log.info("In is_exec_date_in_flight module")
+        arns = self.get_workflow_statemachine_arns()
+        runs = [self.ledger.get_run(state_machine=arn, exec_date=self.exec_date) for arn in arns]
+        return len(arns) > 0 and all(
+            run is not None
+            and self.ledger.is_in_flight(state_machine=arn, exec_date=self.exec_date)
+            and run.get("fingerprint") == self.fingerprint
+            for arn, run in zip(arns, runs)
         )
 
-        return len(sm_execs["executions"])
+    def get_in_flight_statemachines(self, state_machines: list) -> list:
+        return [
+            arn
+            for arn in state_machines
+            if self.ledger.is_in_flight(state_machine=arn, exec_date=self.exec_date)
+        ]
+
+    def queue_rerun(self, state_machines: list) -> bool:
+        """
+        Re-copying the landing partitions of a changed delivery would purge
+        files the runs in flight are reading, so the delivery is recorded on
+        them and replayed by the execution complete lambda once they finish.
+        Returns False when none of them is in flight anymore.
+        """
+        self.log.info("In queue_rerun module")
+        queued = [
+            arn
+            for arn in state_machines
+            if self.ledger.request_rerun(
+                state_machine=arn, exec_date=self.exec_date, event=self.s3_record
+            )
+        ]
+        if queued:
+            self.log.info(
+                f"QUEUED: changed delivery for {self.exec_date} replays when the "
+                f"runs in flight complete : {queued}"
+            )
+        return len(queued) > 0
+
+    def start_statemachine(self, step_function_arn: str, step_payload: dict) -> dict:
+        self.log.info("In start_statemachine module")
+        try:
+            self.incremental_recompute.apply(
+                state_machine=step_function_arn, exec_date=self.exec_date, step_payload=step_payload
+            )
+            response = self.step_function.start_execution(
+                stateMachineArn=step_function_arn,
+                input=json.dumps(step_payload, indent=4),
+            )
+        except ClientError:
+            # Close the run and hand the slot to the queued dates behind it
+            self.run_starter.complete_and_start_next(
+                state_machine=step_function_arn, exec_date=self.exec_date, status=STATUS_FAILED
+            )
+            raise
+        self.ledger.mark_started(
+            state_machine=step_function_arn,
+            exec_date=self.exec_date,
+            execution_arn=response["executionArn"],
+        )
+        return response
 
     def trigger_statemachine(self) -> [dict]:
         self.log.info("In trigger_statemachine module")
@@ -309,17 +523,29 @@ class TriggerStateMachine(object):
                     f"{self.cnf.DATA_PIPELINE[self.s3_payload['key_name']]['type']} "
                     f"for cadence {step_payload['frequency']}"
                 )
-                if self.get_step_executions(self.get_statemachine_arn(parameter_name=ssm_step_function_name)) < 1: # noqa
-                    response = self.step_function.start_execution(
-                        stateMachineArn=self.get_statemachine_arn(
-                            parameter_name=ssm_step_function_name
-                        ),
-                        input=json.dumps(step_payload, indent=4),
+                step_function_arn = self.get_statemachine_arn(
+                    parameter_name=ssm_step_function_name
+                )
+                decision = self.ledger.register(
+                    state_machine=step_function_arn,
+                    exec_date=self.exec_date,
+                    payload=step_payload,
+                    event_token=self.s3_payload["event_token"],
+                    fingerprint=self.fingerprint,
+                )
+                if decision == DECISION_START:
+                    response = self.start_statemachine(
+                        step_function_arn=step_function_arn, step_payload=step_payload
                     )
                     responses.append(response)
+                elif decision == DECISION_QUEUED:
+                    self.log.info(f"QUEUED: Step function {ssm_step_function_name} "
+                                  f"is running another exec_date, {self.exec_date} "
+                                  f"starts on its completion")
+                    responses.append({"status": f"queued {self.exec_date}"})
                 else:
                     self.log.info(f"SKIP: Step function {ssm_step_function_name} "
-                                  f"already has atlease 1 RUNNING state "
+                                  f"already has a run for {self.exec_date} "
                                   f"and hence not starting a new instance")
         else:
             response = {
@@ -357,9 +583,14 @@ class TriggerStateMachine(object):
         self.log.info("In delete_all_table_partition module")
         total_counts = 0
         tables_affected = []
+        delete_paths = set()
         for item in copy_matrix:
             bucket_name = item["dest_bucket"]
             delete_path = os.path.dirname(item["dest_file_path"])
+            # Shards of a table share the partition path, clean it up once
+            if (bucket_name, delete_path) in delete_paths:
+                continue
+            delete_paths.add((bucket_name, delete_path))
             if len(delete_path.strip()) > 0:
                 del_count = self.delete_objects_from_s3_path(
                     bucket_name=bucket_name, bucket_prefix=delete_path
@@ -376,21 +607,528 @@ class TriggerStateMachine(object):
             f"\n in partition {self.exec_date} : {total_counts} \n"
         )
 
-    def copy_table_files(self):
+    def get_layout_rewriter(self) -> ParquetLayoutRewriter:
+        return ParquetLayoutRewriter(
+            region=self.cnf.REGION,
+            sort_columns=self.cnf.LAYOUT_SORT_COLUMNS,
+            dictionary_columns=self.cnf.LAYOUT_DICTIONARY_COLUMNS,
+            bloom_filter_columns=self.cnf.LAYOUT_BLOOM_FILTER_COLUMNS,
+            bloom_filter_ndv=self.cnf.LAYOUT_BLOOM_FILTER_NDV,
+            bloom_filter_fpp=self.cnf.LAYOUT_BLOOM_FILTER_FPP,
+            row_group_rows=self.cnf.LAYOUT_ROW_GROUP_ROWS,
+            sort_buffer_rows=self.cnf.LAYOUT_SORT_BUFFER_ROWS,
+            target_file_bytes=self.cnf.LAYOUT_TARGET_FILE_BYTES,
+            period_column=(
+                self.cnf.INCREMENTAL_PERIOD_COLUMN
+                if self.cnf.INCREMENTAL_RECOMPUTE_ENABLED
+                else None
+            ),
+        )
+
+    def is_layout_rewrite(self, item: dict) -> bool:
+        return self.cnf.LAYOUT_REWRITE_ENABLED and item["src_file_path"].endswith(".parquet")
+
+    def copy_table_file(self, item: dict) -> dict:
+        """
+        Returns the key ranges of the files and the period fingerprints a
+        layout rewrite wrote, none for copies
+        """
+        if self.is_layout_rewrite(item):
+            result = self.get_layout_rewriter().rewrite(
+                src_bucket=item["src_bucket"],
+                src_key=item["src_file_path"],
+                dest_bucket=item["dest_bucket"],
+                dest_key=item["dest_file_path"],
+            )
+            self.log.info(
+                f"Rewrote s3://{item['src_bucket']}/{item['src_file_path']}"
+                f" ==> {len(result['dest_keys'])} file(s) at s3://{item['dest_bucket']}/"
+                f"{item['dest_file_path']}"
+            )
+            return {
+                "files": [
+                    {
+                        "path": f"s3://{item['dest_bucket']}/{file['key']}",
+                        "num_rows": file["num_rows"],
+                        "row_groups": file["row_groups"],
+                    }
+                    for file in result["files"]
+                ],
+                "period_fingerprints": result.get("period_fingerprints"),
+            }
+        self.copy_file(
+            src_bucket=item["src_bucket"],
+            src_key=item["src_file_path"],
+            dest_bucket=item["dest_bucket"],
+            dest_key=item["dest_file_path"],
+        )
+        self.log.info(
+            f"Copied s3://{item['src_bucket']}/{item['src_file_path']}"
+            f" ==> s3://{item['dest_bucket']}/{item['dest_file_path']}"
+        )
+        return {"files": [], "period_fingerprints": None}
+
+    def copy_table_files(self, copy_matrix: list):
+        """Copies all files in copy_matrix, shards are transferred in parallel"""
         self.log.info("In copy_table_files module")
-        i = 0
-        for i, items in enumerate(self.copy_matrix, 1):  # noqa
-            self.copy_file(
-                src_bucket=items["src_bucket"],
-                src_key=items["src_file_path"],
-                dest_bucket=items["dest_bucket"],
-                dest_key=items["dest_file_path"],
+        max_workers = (
+            self.cnf.LAYOUT_REWRITE_MAX_WORKERS
+            if any(self.is_layout_rewrite(item) for item in copy_matrix)
+            else self.cnf.COPY_MAX_WORKERS
+        )
+        max_workers = max(1, min(max_workers, len(copy_matrix)))
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            copied = list(executor.map(self.copy_table_file, copy_matrix))
+        self.log.info(f" In all {len(copied)} files copied")
+        self.write_partition_sidecars(copy_matrix, copied)
+
+    def get_rewritten_partitions(self, copy_matrix: list, copied: list) -> dict:
+        """
+        (bucket, partition prefix) ==> written files and period fingerprints
+        of the partitions whose files were all rewritten, a sidecar missing
+        a file would make lookups skip it or hide a change
+        """
+        partitions = {}
+        for item, rewritten in zip(copy_matrix, copied):
+            partition = (item["dest_bucket"], os.path.dirname(item["dest_file_path"]))
+            entry = partitions.setdefault(
+                partition, {"complete": True, "files": [], "period_fingerprints": []}
             )
+            entry["complete"] = entry["complete"] and self.is_layout_rewrite(item)
+            entry["files"].extend(rewritten["files"])
+            entry["period_fingerprints"].append(rewritten["period_fingerprints"])
+
+        for (bucket, prefix), entry in list(partitions.items()):
+            if not entry["complete"]:
+                self.log.info(f"No sidecars for s3://{bucket}/{prefix}, not all files rewritten")
+                del partitions[(bucket, prefix)]
+        return partitions
+
+    def put_sidecar(self, bucket: str, key: str, content: dict):
+        self.s3.put_object(
+            Bucket=bucket,
+            Key=key,
+            Body=json.dumps(content, default=str),
+            ContentType="application/json",
+        )
+        self.log.info(f"Sidecar written to s3://{bucket}/{key}")
+
+    def write_partition_sidecars(self, copy_matrix: list, copied: list):
+        """Key-range index and period fingerprints of the rewritten partitions"""
+        self.log.info("In write_partition_sidecars module")
+        partitions = self.get_rewritten_partitions(copy_matrix, copied)
+        for (bucket, prefix), entry in partitions.items():
+            if self.cnf.LAYOUT_KEY_INDEX_ENABLED:
+                self.put_sidecar(
+                    bucket=bucket,
+                    key=f"{prefix}/{KEY_INDEX_FILE_NAME}",
+                    content=build_key_index(self.cnf.LAYOUT_SORT_COLUMNS, entry["files"]),
+                )
+            if None in entry["period_fingerprints"]:
+                continue
+            self.put_sidecar(
+                bucket=bucket,
+                key=f"{prefix}/{PERIOD_FINGERPRINTS_FILE_NAME}",
+                content=merge_fingerprints(entry["period_fingerprints"]),
+            )
+
+    def get_table_storage_descriptor(self, database: str, table: str) -> dict:
+        self.log.info("In get_table_storage_descriptor module")
+        if (database, table) not in self.table_storage_descriptors:
+            response = self.glue.get_table(DatabaseName=database, Name=table)
+            self.table_storage_descriptors[(database, table)] = response["Table"][
+                "StorageDescriptor"
+            ]
+        return self.table_storage_descriptors[(database, table)]
+
+    def get_partition_input(self, item: dict) -> dict:
+        self.log.info("In get_partition_input module")
+        storage_descriptor = dict(
+            self.get_table_storage_descriptor(
+                database=self.cnf.LANDING_DB_NAME, table=item["table_name"]
+            )
+        )
+        storage_descriptor["Location"] = (
+            f"s3://{item['dest_bucket']}/{os.path.dirname(item['dest_file_path'])}/"
+        )
+        return {
+            "Values": [self.exec_date],
+            "StorageDescriptor": storage_descriptor,
+        }
+
+    def register_table_partitions(self, copy_matrix: list):
+        """
+        Registers the exec_date partition of every partitioned table in
+        copy_matrix in the Glue catalog. Partitions that already exist are
+        left as they are, same as ADD IF NOT EXISTS.
+        """
+        self.log.info("In register_table_partitions module")
+        partitions = {}
+        for item in copy_matrix:
+            if item["partitioned"].lower() != "true":
+                continue
+            # Several files can land in the same table partition
+            partitions.setdefault(item["table_name"], self.get_partition_input(item))
+
+        # BatchCreatePartition is scoped to a single table
+        for table_name, partition_input in partitions.items():
+            response = self.glue.batch_create_partition(
+                DatabaseName=self.cnf.LANDING_DB_NAME,
+                TableName=table_name,
+                PartitionInputList=[partition_input],
+            )
+            errors = [
+                error
+                for error in response.get("Errors", [])
+                if error["ErrorDetail"]["ErrorCode"] != "AlreadyExistsException"
+            ]
+            if errors:
+                raise Exception(
+                    f"Failed to register partition exec_date={self.exec_date} "
+                    f"of {self.cnf.LANDING_DB_NAME}.{table_name} : {errors}"
+                )
             self.log.info(
-                f"Copied s3://{items['src_bucket']}/{items['src_file_path']}"
-                f" ==> s3://{items['dest_bucket']}/{items['dest_file_path']}"
+                f"Registered partition exec_date={self.exec_date} "
+                f"of {self.cnf.LANDING_DB_NAME}.{table_name}"
             )
-        self.log.info(f" In all {i} files copied")
+
+    def get_table_subscribers(self, table_name: str) -> list:
+        """State machines of every pipeline registering files for the table"""
+        self.log.info("In get_table_subscribers module")
+        subscribers = []
+        for control_file, pipeline_props in self.cnf.DATA_PIPELINE.items():
+            pipeline_meta_path = os.path.join(
+                os.path.dirname(os.path.abspath(__file__)),
+                self.cnf.PIPELINE_META_DIR,
+                f"{os.path.splitext(control_file)[0]}.json",
+            )
+            if not os.path.exists(pipeline_meta_path):
+                continue
+            registered_tables = {
+                file["table_name"] for file in load_registered_files(pipeline_meta_path)
+            }
+            if table_name in registered_tables:
+                subscribers.extend(
+                    self.get_statemachine_arn(
+                        parameter_name=item["param_store_state_machine_name"]
+                    )
+                    for item in pipeline_props["workflows"]
+                )
+        return subscribers
+
+    def ingest_landing_partitions(self) -> bool:
+        """
+        Ingest stage, idempotent per (landing table, exec_date). A partition
+        already ingested from the same files is left as it is; a changed
+        one is re-ingested only when no subscribing pipeline is running on it,
+        otherwise the delivery is queued as a rerun and False is returned.
+        """
+        self.log.info("In ingest_landing_partitions module")
+        tables = {}
+        for item in self.copy_matrix:
+            tables.setdefault(item["table_name"], []).append(item)
+
+        for table_name, copy_matrix in tables.items():
+            fingerprint = self.get_delivery_fingerprint(copy_matrix)
+            marker = self.ledger.get_ingest_marker(
+                database=self.cnf.LANDING_DB_NAME, table=table_name, exec_date=self.exec_date
+            )
+            if (
+                marker is not None
+                and marker["status"] == STATUS_INGESTED
+                and marker["fingerprint"] == fingerprint
+            ):
+                self.log.info(
+                    f"SKIP: {table_name} exec_date={self.exec_date} is already "
+                    f"ingested from the same files"
+                )
+                continue
+
+            running = self.get_in_flight_statemachines(self.get_table_subscribers(table_name))
+            if running and self.queue_rerun(running):
+                self.log.info(
+                    f"Not re-ingesting {table_name} exec_date={self.exec_date} "
+                    f"while subscribed state machines are running : {running}"
+                )
+                return False
+            if not self.ledger.acquire_ingest(
+                database=self.cnf.LANDING_DB_NAME,
+                table=table_name,
+                exec_date=self.exec_date,
+                fingerprint=fingerprint,
+                event_token=self.s3_payload["event_token"],
+            ):
+                raise Exception(
+                    f"{table_name} exec_date={self.exec_date} is being ingested "
+                    f"by another invocation"
+                )
+
+            try:
+                # Clean up prior files loaded to the same partition if any
+                self.delete_all_table_partition(copy_matrix)
+                self.copy_table_files(copy_matrix)
+                # Register landing partitions before the workflow queries them
+                self.register_table_partitions(copy_matrix)
+            except Exception:
+                self.ledger.release_ingest(
+                    database=self.cnf.LANDING_DB_NAME,
+                    table=table_name,
+                    exec_date=self.exec_date,
+                    status=STATUS_FAILED,
+                )
+                raise
+            self.ledger.release_ingest(
+                database=self.cnf.LANDING_DB_NAME,
+                table=table_name,
+                exec_date=self.exec_date,
+                status=STATUS_INGESTED,
+            )
+        return True
+
+    def get_delivery_fingerprint(self, copy_matrix: list) -> str:
+        """
+        Digest of the registered incoming files from the listing ETags and
+        sizes, so identical deliveries are detected without reading them
+        """
+        self.log.info("In get_delivery_fingerprint module")
+        files = sorted(
+            (
+                item["table_name"],
+                os.path.basename(item["src_file_path"]),
+                self.incoming_object_meta[item["src_file_path"]]["etag"],
+                self.incoming_object_meta[item["src_file_path"]]["size"],
+            )
+            for item in copy_matrix
+        )
+        return hashlib.sha256(json.dumps(files).encode("utf-8")).hexdigest()
+
+    def get_fast_path_mode(self) -> str:
+        return (
+            self.cnf.DATA_PIPELINE[self.s3_payload["key_name"]]
+            .get("fingerprint_fast_path", self.cnf.INPUT_FINGERPRINT_FAST_PATH)
+            .lower()
+        )
+
+    def get_unchanged_source_exec_date(self) -> (str, None):
+        """
+        Returns the exec_date whose outputs match this delivery when every
+        workflow last succeeded on the same fingerprint, otherwise None.
+        Monthly and yearly scheduled runs always go through the pipeline.
+        """
+        self.log.info("In get_unchanged_source_exec_date module")
+        source_exec_dates = set()
+        for item in self.cnf.DATA_PIPELINE[self.s3_payload["key_name"]]["workflows"]:
+            if self.today.date() in (item["monthly"], item["yearly"]):
+                return None
+            state_machine = self.get_statemachine_arn(
+                parameter_name=item["param_store_state_machine_name"]
+            )
+            last_success = self.ledger.get_last_success(state_machine=state_machine)
+            if last_success is None or last_success["fingerprint"] != self.fingerprint:
+                return None
+            # A rerun of the source date is rewriting the outputs to copy
+            if self.ledger.is_in_flight(
+                state_machine=state_machine, exec_date=last_success["source_exec_date"]
+            ):
+                return None
+            source_exec_dates.add(last_success["source_exec_date"])
+        return source_exec_dates.pop() if len(source_exec_dates) == 1 else None
+
+    def get_alias_tables(self) -> list:
+        tables = [
+            {"db_name": self.cnf.LANDING_DB_NAME, "table_name": table_name}
+            for table_name in sorted(
+                {
+                    item["table_name"]
+                    for item in self.copy_matrix
+                    if item["partitioned"].lower() == "true"
+                }
+            )
+        ]
+        return tables + self.cnf.DATA_PIPELINE[self.s3_payload["key_name"]].get(
+            "fingerprint_alias_tables", []
+        )
+
+    def get_partition_location(self, table: dict, exec_date: str) -> str:
+        storage_descriptor = self.get_table_storage_descriptor(
+            database=table["db_name"], table=table["table_name"]
+        )
+        return f"{storage_descriptor['Location'].rstrip('/')}/exec_date={exec_date}/"
+
+    def copy_partition_objects(self, source_location: str, dest_location: str) -> int:
+        """
+        Replaces the objects under dest_location with copies of the objects
+        under source_location, the key index is rewritten to the copied paths
+        """
+        self.log.info("In copy_partition_objects module")
+        source = urlparse(source_location)
+        dest = urlparse(dest_location)
+        source_prefix = source.path.lstrip("/")
+        dest_prefix = dest.path.lstrip("/")
+        self.delete_objects_from_s3_path(bucket_name=dest.netloc, bucket_prefix=dest_prefix)
+        keys = self.get_objects_in_s3_path(bucket_name=source.netloc, bucket_path=source_prefix)
+
+        def copy_object(key: str):
+            dest_key = f"{dest_prefix}{key[len(source_prefix):]}"
+            if os.path.basename(key) != KEY_INDEX_FILE_NAME:
+                self.copy_file(
+                    src_bucket=source.netloc,
+                    src_key=key,
+                    dest_bucket=dest.netloc,
+                    dest_key=dest_key,
+                )
+                return
+            key_index = self.s3.get_object(Bucket=source.netloc, Key=key)["Body"].read()
+            self.s3.put_object(
+                Bucket=dest.netloc,
+                Key=dest_key,
+                Body=key_index.decode("utf-8").replace(source_location, dest_location),
+                ContentType="application/json",
+            )
+
+        max_workers = max(1, min(self.cnf.COPY_MAX_WORKERS, len(keys)))
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            list(executor.map(copy_object, keys))
+        return len(keys)
+
+    def alias_partitions(self, source_exec_date: str) -> list:
+        """
+        Registers the exec_date partitions on copies of the source_exec_date
+        partitions. Each partition keeps its own location, so purges and
+        inserts of either exec_date never touch the other one's files.
+        """
+        self.log.info("In alias_partitions module")
+        aliased = []
+        for table in self.get_alias_tables():
+            try:
+                source = self.glue.get_partition(
+                    DatabaseName=table["db_name"],
+                    TableName=table["table_name"],
+                    PartitionValues=[source_exec_date],
+                )["Partition"]
+            except self.glue.exceptions.EntityNotFoundException:
+                self.log.info(
+                    f"No partition {source_exec_date} in {table['db_name']}."
+                    f"{table['table_name']} to alias, skipping"
+                )
+                continue
+            source_location = f"{source['StorageDescriptor']['Location'].rstrip('/')}/"
+            dest_location = self.get_partition_location(table=table, exec_date=self.exec_date)
+            copied = self.copy_partition_objects(
+                source_location=source_location, dest_location=dest_location
+            )
+            partition_input = {
+                "Values": [self.exec_date],
+                "StorageDescriptor": dict(source["StorageDescriptor"], Location=dest_location),
+                "Parameters": source.get("Parameters", {}),
+            }
+            try:
+                self.glue.create_partition(
+                    DatabaseName=table["db_name"],
+                    TableName=table["table_name"],
+                    PartitionInput=partition_input,
+                )
+            except self.glue.exceptions.AlreadyExistsException:
+                self.glue.update_partition(
+                    DatabaseName=table["db_name"],
+                    TableName=table["table_name"],
+                    PartitionValueList=[self.exec_date],
+                    PartitionInput=partition_input,
+                )
+            aliased.append(table)
+            if table["db_name"] == self.cnf.LANDING_DB_NAME:
+                # The incoming files were never ingested, a later delivery must ingest
+                self.ledger.release_ingest(
+                    database=table["db_name"],
+                    table=table["table_name"],
+                    exec_date=self.exec_date,
+                    status=STATUS_ALIASED,
+                )
+            self.log.info(
+                f"Aliased {table['db_name']}.{table['table_name']} "
+                f"exec_date={self.exec_date} ==> {copied} objects copied from {source_location}"
+            )
+        return aliased
+
+    def drop_aliased_partitions(self):
+        """
+        A changed delivery for an exec_date that was aliased drops the alias
+        partitions, partitions aliased before they were copied point at the
+        locations of another exec_date and must not be written through
+        """
+        self.log.info("In drop_aliased_partitions module")
+        for arn in self.get_workflow_statemachine_arns():
+            run = self.ledger.get_run(state_machine=arn, exec_date=self.exec_date)
+            if run is None or run.get("fingerprint_decision") != "alias":
+                continue
+            for table in json.loads(run.get("aliased_partitions", "[]")):
+                try:
+                    self.glue.delete_partition(
+                        DatabaseName=table["db_name"],
+                        TableName=table["table_name"],
+                        PartitionValues=[self.exec_date],
+                    )
+                    self.log.info(
+                        f"Dropped aliased partition exec_date={self.exec_date} "
+                        f"of {table['db_name']}.{table['table_name']}"
+                    )
+                except self.glue.exceptions.EntityNotFoundException:
+                    pass
+
+    def get_fast_path_input(self) -> dict:
+        """
+        Input the pipeline's first workflow would have started with, the
+        dependents of a fast-pathed exec_date are started from it
+        """
+        self.log.info("In get_fast_path_input module")
+        self.item = self.cnf.DATA_PIPELINE[self.s3_payload["key_name"]]["workflows"][0]
+        step_payload = dict(self.get_step_function_input())
+        step_payload["start_dttm"] = datetime.now().strftime("%Y%m%d%H%M%S")
+        step_payload["env"] = self.cnf.STAGE
+        step_payload["frequency"], _ = self.get_cadence()
+        return step_payload
+
+    def take_fast_path(self, mode: str, source_exec_date: str) -> list:
+        """Records the fast path decision per workflow and applies it"""
+        self.log.info("In take_fast_path module")
+        arns = self.get_workflow_statemachine_arns()
+        for arn in arns:
+            if not self.ledger.record_unchanged(
+                state_machine=arn,
+                exec_date=self.exec_date,
+                event_token=self.s3_payload["event_token"],
+                fingerprint=self.fingerprint,
+                decision=mode,
+                source_exec_date=source_exec_date,
+            ):
+                self.log.info(f"SKIP: {self.exec_date} already has a run for {arn}")
+                return [{"status": f"duplicate {self.exec_date}"}]
+
+        if mode == "alias" and source_exec_date != self.exec_date:
+            aliased = self.alias_partitions(source_exec_date=source_exec_date)
+            for arn in arns:
+                self.ledger.update_run(
+                    arn, self.exec_date, aliased_partitions=json.dumps(aliased)
+                )
+
+        self.log.info(
+            f"{STATUS_UNCHANGED}: delivery for {self.exec_date} matches the outputs "
+            f"of {source_exec_date}, fast path = {mode}"
+        )
+        # No execution completes the exec_date, its dependents are started here
+        dependents = self.dependent_pipelines.complete(
+            pipeline_type=self.get_pipeline_type(),
+            upstream_input=self.get_fast_path_input(),
+            event_token=self.s3_payload["event_token"],
+            fingerprint=self.fingerprint,
+        )
+        return [
+            {
+                "status": f"{STATUS_UNCHANGED.lower()} {self.exec_date}",
+                "fast_path": mode,
+                "source_exec_date": source_exec_date,
+            }
+        ] + dependents
 
     def execute(self):
         """Driver module"""
@@ -401,6 +1139,7 @@ class TriggerStateMachine(object):
             # fmt: off
             if record["eventSource"] == "aws:s3" and record["awsRegion"] == self.cnf.REGION:  # noqa
                 # fmt: on
+                self.s3_record = record
                 self.s3_payload = self.get_ingested_s3_object(record["s3"])
                 self.control_file = self.s3_payload["key_name"]
                 # Code to restrict execution during folder creation
@@ -416,10 +1155,32 @@ class TriggerStateMachine(object):
                 self.exec_date = self.get_exec_date_from_key()
                 self.destination_key = self.get_destination_key()
                 self.copy_matrix = self.get_destination_matrix()
-                # Clean up prior files loaded to the same partition if any
-                self.delete_all_table_partition(self.copy_matrix)
-                # Copy file
-                self.copy_table_files()
+                self.fingerprint = self.get_delivery_fingerprint(self.copy_matrix)
+                if self.is_exec_date_in_flight():
+                    self.log.info(
+                        f"SKIP: Duplicate event, {self.exec_date} is already "
+                        f"in flight for {self.s3_payload['key_name']}"
+                    )
+                    return json.dumps([], default=str)
+                running = self.get_in_flight_statemachines(
+                    self.get_workflow_statemachine_arns()
+                )
+                if running and self.queue_rerun(running):
+                    return json.dumps([{"status": f"rerun queued {self.exec_date}"}])
+                fast_path_mode = self.get_fast_path_mode()
+                if fast_path_mode in ("skip", "alias"):
+                    source_exec_date = self.get_unchanged_source_exec_date()
+                    if source_exec_date is not None:
+                        step_status = self.take_fast_path(
+                            mode=fast_path_mode, source_exec_date=source_exec_date
+                        )
+                        return json.dumps(step_status, default=str)
+                self.drop_aliased_partitions()
+                if self.cnf.PREFLIGHT_VALIDATION_ENABLED:
+                    self.preflight_incoming_files()
+                # Clean up, copy and register landing partitions not yet ingested
+                if not self.ingest_landing_partitions():
+                    return json.dumps([{"status": f"rerun queued {self.exec_date}"}])
                 step_status = self.trigger_statemachine()
                 self.log.info(step_status)
                 self.log.info("Completed TriggerStageMachine")
@@ -0,0 +1,6 @@
+import os
+import sys
+
+# Lambda sources import their modules from the function root ( config, common.* )
+for function_root in ("workflow_trigger_lambda", os.path.join("commons", "execute_athena_query")):
+    sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src", function_root))
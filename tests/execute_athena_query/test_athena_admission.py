@@ -0,0 +1,71 @@
+import pytest
+from botocore.exceptions import ClientError
+
+import athena_admission
+from athena_admission import AthenaFatalError, LocalAdmissionController
+
+WORKGROUP = "wg-daily"
+
+
+@pytest.fixture
+def admission(monkeypatch):
+    monkeypatch.setattr(athena_admission.time, "sleep", lambda seconds: None)
+    return LocalAdmissionController(slots=1)
+
+
+def client_error(code):
+    return ClientError({"Error": {"Code": code, "Message": code}}, "StartQueryExecution")
+
+
+def failing(errors, result="query-1"):
+    calls = []
+
+    def start_query():
+        calls.append(1)
+        if len(calls) <= len(errors):
+            raise errors[len(calls) - 1]
+        return result
+
+    return start_query, calls
+
+
+def test_submission_errors_are_retried(admission):
+    start_query, calls = failing(
+        [client_error("InternalServerException"), client_error("TooManyRequestsException")]
+    )
+    assert admission.run(WORKGROUP, start_query) == "query-1"
+    assert len(calls) == 3
+    assert admission.holders[WORKGROUP] == {}
+
+
+def test_transient_submission_retries_are_bounded(admission):
+    start_query, calls = failing([client_error("InternalServerException")] * 5)
+    with pytest.raises(ClientError):
+        admission.run(WORKGROUP, start_query)
+    assert len(calls) == athena_admission.MAX_TRANSIENT_RETRIES + 1
+
+
+def test_failed_query_is_not_resubmitted(admission):
+    start_query, calls = failing([Exception("GENERIC_INTERNAL_ERROR: query failed")])
+    with pytest.raises(Exception, match="GENERIC_INTERNAL_ERROR"):
+        admission.run(WORKGROUP, start_query)
+    assert len(calls) == 1
+
+
+def test_fatal_errors_are_not_retried(admission):
+    start_query, calls = failing([client_error("InvalidRequestException")])
+    with pytest.raises(AthenaFatalError):
+        admission.run(WORKGROUP, start_query)
+    assert len(calls) == 1
+
+
+def test_wait_releases_the_slot(admission):
+    query_execution_id, holder = admission.run(WORKGROUP, lambda: "query-1", keep_slot=True)
+    assert holder in admission.holders[WORKGROUP]
+
+    def wait_query():
+        raise Exception("SYNTAX_ERROR: line 1:8: Column 'x' cannot be resolved")
+
+    with pytest.raises(AthenaFatalError):
+        admission.wait(WORKGROUP, holder, wait_query)
+    assert admission.holders[WORKGROUP] == {}
@@ -0,0 +1,78 @@
+from types import SimpleNamespace
+
+import pytest
+
+from backfill_dates import BackfillDates
+from common.execution_ledger import (
+    STATUS_ABANDONED,
+    STATUS_BACKFILL,
+    STATUS_SUCCEEDED,
+    LocalExecutionLedger,
+)
+
+STATE_MACHINE = "arn:aws:states:us-east-1:123456789012:stateMachine:sm-daily"
+BACKFILL_EXECUTION = "arn:aws:states:us-east-1:123456789012:execution:sm-daily-backfill:1"
+PIPELINE_PROPS = {"type": "state_emission_daily"}
+CNF = SimpleNamespace(
+    EXECUTION_LEDGER_BACKEND="local",
+    REGION="us-east-1",
+    ACCOUNT="123456789012",
+    BACKFILL_MAX_DAYS=366,
+)
+
+
+def register(ledger, exec_date):
+    return ledger.register(
+        state_machine=STATE_MACHINE,
+        exec_date=exec_date,
+        payload={"date": exec_date},
+        event_token="event-1",
+        fingerprint="",
+    )
+
+
+def get_status(ledger, exec_date):
+    return ledger.get_run(STATE_MACHINE, exec_date)["status"]
+
+
+@pytest.fixture
+def backfill(monkeypatch):
+    event = {
+        "payload": {
+            "state_machine_parameter": "/pipeline/sm-daily",
+            "execution": BACKFILL_EXECUTION,
+            "backfill": {"start_date": "2024-11-07", "end_date": "2024-11-10"},
+        }
+    }
+    backfill = BackfillDates(event=event, context={}, cnf=CNF)
+    backfill.ledger = LocalExecutionLedger()
+    monkeypatch.setattr(backfill, "get_statemachine_arn", lambda parameter_name: STATE_MACHINE)
+    return backfill
+
+
+def hold_dates(backfill):
+    backfill.hold_dates(parameter_name="/pipeline/sm-daily", pipeline_props=PIPELINE_PROPS)
+
+
+def test_refuses_active_and_queued_exec_dates(backfill):
+    register(backfill.ledger, "2024-11-08")
+    register(backfill.ledger, "2024-11-10")
+
+    with pytest.raises(Exception, match="2024-11-08, 2024-11-10"):
+        hold_dates(backfill)
+    # dates held before the refusal are given up
+    assert get_status(backfill.ledger, "2024-11-07") == STATUS_ABANDONED
+
+
+def test_holds_completed_and_free_exec_dates(backfill):
+    register(backfill.ledger, "2024-11-08")
+    register(backfill.ledger, "2024-11-12")
+    backfill.ledger.complete(STATE_MACHINE, "2024-11-08", STATUS_SUCCEEDED)
+
+    hold_dates(backfill)
+    # a retried expansion of the same execution keeps its hold
+    hold_dates(backfill)
+
+    for exec_date in ("2024-11-07", "2024-11-08", "2024-11-09", "2024-11-10"):
+        assert get_status(backfill.ledger, exec_date) == STATUS_BACKFILL
+    assert backfill.ledger.is_in_flight(STATE_MACHINE, "2024-11-08")
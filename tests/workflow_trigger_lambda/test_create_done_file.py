@@ -0,0 +1,99 @@
+from types import SimpleNamespace
+
+import pytest
+
+from common.execution_ledger import LocalExecutionLedger
+from create_done_file import CreateDoneFile
+
+INCOMING_PATH = "incoming/all_ef_files"
+WORKFLOWS = [{"cadence": "daily"}]
+CNF = SimpleNamespace(
+    S3_LANDING_BUCKET_NAME="landing",
+    PIPELINE_META_DIR="pipeline_meta",
+    EXECUTION_LEDGER_BACKEND="local",
+    BACKFILL_MAX_DAYS=366,
+    BACKFILL_MAX_WORKERS=8,
+    # pipelines sharing an incoming_path with different registered files
+    DATA_PIPELINE={
+        "state_emission_daily.done": {
+            "type": "state_emission_daily",
+            "incoming_path": INCOMING_PATH,
+            "create_wf_dependency_done_file": [],
+            "workflows": WORKFLOWS,
+        },
+        "state_emission_monthly.done": {
+            "type": "usghgemission_monthly",
+            "incoming_path": INCOMING_PATH,
+            "create_wf_dependency_done_file": [],
+            "workflows": WORKFLOWS,
+        },
+    },
+)
+
+
+class LandingBucket(object):
+    """list_objects_v2 paginator and upload_fileobj over in-memory keys"""
+
+    def __init__(self, keys: list):
+        self.keys = list(keys)
+        self.uploaded = []
+
+    def get_paginator(self, operation_name):
+        return self
+
+    def paginate(self, Bucket, Prefix):
+        return [{"Contents": [{"Key": key} for key in self.keys if key.startswith(Prefix)]}]
+
+    def upload_fileobj(self, fileobj, bucket, key):
+        self.uploaded.append(key)
+
+
+def get_delivery(exec_date: str) -> list:
+    return [
+        f"{INCOMING_PATH}/{exec_date}/epacems-1996-IN.parquet",
+        f"{INCOMING_PATH}/{exec_date}/epacems-1996-OH.parquet",
+    ]
+
+
+@pytest.fixture
+def create_done(monkeypatch):
+    monkeypatch.setenv("AWS_DEFAULT_REGION", "us-east-1")
+
+    def get_create_done(keys: list, start_date: str, end_date: str):
+        event = {"payload": {"backfill": {"start_date": start_date, "end_date": end_date}}}
+        create_done = CreateDoneFile(event=event, context={}, cnf=CNF)
+        create_done.s3 = LandingBucket(keys)
+        create_done.ledger = LocalExecutionLedger()
+        return create_done
+
+    return get_create_done
+
+
+def test_parallel_backfill_checks_each_pipeline_against_its_own_files(create_done):
+    exec_dates = [f"2024-11-{day:02d}" for day in range(1, 31)]
+    keys = [key for exec_date in exec_dates for key in get_delivery(exec_date)]
+    create_done = create_done(keys, start_date=exec_dates[0], end_date=exec_dates[-1])
+
+    summary = create_done.backfill()
+
+    assert sorted(create_done.s3.uploaded) == [
+        f"{INCOMING_PATH}/{exec_date}/state_emission_daily.done" for exec_date in exec_dates
+    ]
+    assert [result["pipeline"] for result in summary["written"]] == [
+        "state_emission_daily"
+    ] * len(exec_dates)
+    # monthly also waits for the daily .done and .completed markers
+    assert [result["pipeline"] for result in summary["incomplete"]] == [
+        "usghgemission_monthly"
+    ] * len(exec_dates)
+    assert summary["failed"] == []
+
+
+def test_backfill_leaves_existing_done_files(create_done):
+    keys = get_delivery("2024-11-01") + [f"{INCOMING_PATH}/2024-11-01/state_emission_daily.done"]
+    create_done = create_done(keys, start_date="2024-11-01", end_date="2024-11-01")
+
+    summary = create_done.backfill()
+
+    assert create_done.s3.uploaded == []
+    assert [result["reason"] for result in summary["skipped"]] == ["done_exists"]
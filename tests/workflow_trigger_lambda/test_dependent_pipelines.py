@@ -0,0 +1,112 @@
+import json
+import logging
+from types import SimpleNamespace
+
+import pytest
+
+from common.dependent_pipelines import DependentPipelines
+from common.execution_ledger import DECISION_QUEUED, RUN_STARTED, LocalExecutionLedger
+from common.run_starter import QueuedRunStarter
+
+STATE_MACHINE_PREFIX = "arn:aws:states:us-east-1:123456789012:stateMachine:"
+WORKFLOW = {"cadence": "daily", "monthly": None, "yearly": None}
+CNF = SimpleNamespace(
+    REGION="us-east-1",
+    ACCOUNT="123456789012",
+    S3_LANDING_BUCKET_NAME="landing",
+    DATA_PIPELINE={
+        "daily.done": {
+            "type": "daily",
+            "incoming_path": "incoming/all_ef_files",
+            "trigger_statemachine": "true",
+            "workflows": [dict(WORKFLOW, param_store_state_machine_name="/pipeline/sm-daily")],
+        },
+        "monthly.done": {
+            "type": "monthly",
+            "incoming_path": "incoming/all_ef_files",
+            "depends_on": ["daily.done"],
+            "trigger_statemachine": "true",
+            "workflows": [dict(WORKFLOW, param_store_state_machine_name="/pipeline/sm-monthly")],
+            "glue_runtime_sql_params": {"param_processed_db_name": "processed"},
+        },
+    },
+)
+UPSTREAM_INPUT = {
+    "date": "2024-11-08",
+    "pipeline_type": "daily",
+    "incremental_tables": [{"table_name": "utility_data_oh", "dest_bucket": "landing"}],
+    "glue_runtime_sql_params": json.dumps(
+        {"param_execution_date": "2024-11-08", "param_changed_periods": "2024-11-02"}
+    ),
+}
+
+
+class Clients(object):
+    """put_object, get_parameter and start_execution recording their calls"""
+
+    def __init__(self):
+        self.keys = []
+        self.inputs = []
+
+    def put_object(self, Bucket, Key, Body):
+        self.keys.append(Key)
+
+    def get_parameter(self, Name, WithDecryption):
+        return {"Parameter": {"Value": Name.split("/")[-1]}}
+
+    def start_execution(self, stateMachineArn, input):
+        self.inputs.append(json.loads(input))
+        return {"executionArn": f"{stateMachineArn}:exec-{len(self.inputs)}"}
+
+
+@pytest.fixture
+def ledger():
+    return LocalExecutionLedger()
+
+
+@pytest.fixture
+def dependents(ledger, monkeypatch):
+    monkeypatch.setenv("AWS_DEFAULT_REGION", "us-east-1")
+    log = logging.getLogger()
+    clients = Clients()
+    run_starter = QueuedRunStarter(ledger=ledger, log=log)
+    run_starter.step_function = clients
+    dependents = DependentPipelines(cnf=CNF, ledger=ledger, run_starter=run_starter, log=log)
+    dependents.s3 = clients
+    dependents.ssm = clients
+    return dependents
+
+
+def test_complete_writes_marker_and_starts_dependents(dependents):
+    responses = dependents.complete(
+        pipeline_type="daily", upstream_input=UPSTREAM_INPUT, event_token="event-1", fingerprint=""
+    )
+
+    assert dependents.s3.keys == ["incoming/all_ef_files/2024-11-08/daily.completed"]
+    assert responses == [{"exec_date": "2024-11-08", "status": RUN_STARTED}]
+    started = dependents.s3.inputs[0]
+    assert started["pipeline_type"] == "monthly"
+    assert "incremental_tables" not in started
+    assert json.loads(started["glue_runtime_sql_params"]) == {
+        "param_execution_date": "2024-11-08",
+        "param_processed_db_name": "processed",
+        "frequency": "daily",
+    }
+
+
+def test_dependent_of_another_exec_date_in_flight_is_queued(dependents, ledger):
+    ledger.register(f"{STATE_MACHINE_PREFIX}sm-monthly", "2024-11-07", payload={})
+
+    responses = dependents.complete(
+        pipeline_type="daily", upstream_input=UPSTREAM_INPUT, event_token="event-1", fingerprint=""
+    )
+
+    assert responses == [{"exec_date": "2024-11-08", "status": DECISION_QUEUED}]
+    assert dependents.s3.inputs == []
+
+
+def test_unknown_pipeline_completes_nothing(dependents):
+    assert dependents.complete(
+        pipeline_type="other", upstream_input=UPSTREAM_INPUT, event_token="", fingerprint=""
+    ) == []
+    assert dependents.s3.keys == []
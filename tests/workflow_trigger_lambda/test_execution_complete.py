@@ -0,0 +1,173 @@
+import json
+from types import SimpleNamespace
+
+import pytest
+
+from common.execution_ledger import (
+    STATUS_BACKFILL,
+    STATUS_FAILED,
+    STATUS_QUEUED,
+    STATUS_RUNNING,
+    STATUS_SUCCEEDED,
+    LocalExecutionLedger,
+)
+from execution_complete import CompleteExecution
+
+STATE_MACHINE = "arn:aws:states:us-east-1:123456789012:stateMachine:sm-daily"
+EXECUTION_ARN = f"{STATE_MACHINE}:exec-0"
+BACKFILL_EXECUTION = "arn:aws:states:us-east-1:123456789012:execution:sm-daily-backfill:1"
+CNF = SimpleNamespace(
+    EXECUTION_LEDGER_BACKEND="local",
+    REGION="us-east-1",
+    ACCOUNT="123456789012",
+    WF_TRIGGER_LAMBDA_NAME="apg-workflow-trigger-lambda",
+    DATA_PIPELINE={
+        "daily.done": {"type": "daily", "workflows": []},
+        "monthly.done": {
+            "type": "monthly",
+            "depends_on": ["daily.done"],
+            "workflows": [{"param_store_state_machine_name": "/pipeline/sm-monthly"}],
+        },
+    },
+)
+
+
+class StepFunctions(object):
+    def __init__(self):
+        self.inputs = []
+        self.state_machines = []
+
+    def start_execution(self, stateMachineArn, input):
+        self.inputs.append(json.loads(input))
+        self.state_machines.append(stateMachineArn)
+        return {"executionArn": f"{stateMachineArn}:exec-{len(self.inputs)}"}
+
+    def get_parameter(self, Name, WithDecryption):
+        return {"Parameter": {"Value": Name.split("/")[-1]}}
+
+
+class Lambda(object):
+    def __init__(self):
+        self.payloads = []
+
+    def invoke(self, FunctionName, InvocationType, Payload):
+        self.payloads.append(json.loads(Payload))
+
+
+@pytest.fixture
+def ledger():
+    ledger = LocalExecutionLedger()
+    ledger.register(STATE_MACHINE, "2024-11-07", payload={"date": "2024-11-07"})
+    ledger.mark_started(STATE_MACHINE, "2024-11-07", execution_arn=EXECUTION_ARN)
+    ledger.register(STATE_MACHINE, "2024-11-08", payload={"date": "2024-11-08"})
+    return ledger
+
+
+@pytest.fixture
+def complete(ledger, monkeypatch):
+    monkeypatch.setenv("AWS_DEFAULT_REGION", "us-east-1")
+
+    def run_complete(execution_arn: str, status: str = STATUS_SUCCEEDED):
+        event = {
+            "detail": {
+                "stateMachineArn": STATE_MACHINE,
+                "executionArn": execution_arn,
+                "status": status,
+                "input": json.dumps({"date": "2024-11-07"}),
+            }
+        }
+        complete = CompleteExecution(event=event, context={}, cnf=CNF)
+        complete.ledger = ledger
+        complete.run_starter.ledger = ledger
+        complete.run_starter.incremental_recompute = None
+        complete.run_starter.step_function = StepFunctions()
+        complete.execute()
+        return complete.run_starter.step_function.inputs
+
+    return run_complete
+
+
+def test_run_execution_completes_and_starts_queued(ledger, complete):
+    assert [step_payload["date"] for step_payload in complete(EXECUTION_ARN)] == ["2024-11-08"]
+    assert ledger.get_run(STATE_MACHINE, "2024-11-07")["status"] == STATUS_SUCCEEDED
+    assert ledger.get_run(STATE_MACHINE, "2024-11-08")["status"] == STATUS_RUNNING
+
+
+def test_other_execution_of_the_exec_date_is_ignored(ledger, complete):
+    assert complete(f"{STATE_MACHINE}:started-by-hand", status=STATUS_FAILED) == []
+    assert ledger.get_run(STATE_MACHINE, "2024-11-07")["status"] == STATUS_RUNNING
+    assert ledger.get_run(STATE_MACHINE, "2024-11-08")["status"] == STATUS_QUEUED
+
+
+def test_duplicate_event_is_ignored(ledger, complete):
+    complete(EXECUTION_ARN)
+    assert complete(EXECUTION_ARN) == []
+    assert ledger.get_run(STATE_MACHINE, "2024-11-08")["status"] == STATUS_RUNNING
+
+
+def complete_backfill(ledger, status: str) -> CompleteExecution:
+    event = {
+        "detail": {
+            "stateMachineArn": f"{STATE_MACHINE}-backfill",
+            "executionArn": BACKFILL_EXECUTION,
+            "status": status,
+            "input": json.dumps({"start_date": "2024-11-09", "end_date": "2024-11-10"}),
+        }
+    }
+    complete = CompleteExecution(event=event, context={}, cnf=CNF)
+    complete.ledger = ledger
+    complete.dependent_pipelines.ssm = complete.dependent_pipelines.step_function = StepFunctions()
+    complete.lambda_client = Lambda()
+    complete.execute()
+    return complete
+
+
+@pytest.fixture
+def backfill_ledger():
+    ledger = LocalExecutionLedger()
+    assert ledger.hold_backfill(
+        STATE_MACHINE,
+        ["2024-11-09", "2024-11-10"],
+        backfill_execution=BACKFILL_EXECUTION,
+        backfill={
+            "pipeline_type": "daily",
+            "input": {"start_date": "2024-11-09", "end_date": "2024-11-10", "set_based": "true"},
+        },
+    ) == []
+    # delivery received while the backfill held the exec_date
+    ledger.request_rerun(STATE_MACHINE, "2024-11-10", event={"s3": "delivery"})
+    return ledger
+
+
+def test_backfill_releases_dates_replays_reruns_and_backfills_dependents(
+    backfill_ledger, monkeypatch
+):
+    monkeypatch.setenv("AWS_DEFAULT_REGION", "us-east-1")
+    complete = complete_backfill(backfill_ledger, STATUS_SUCCEEDED)
+
+    for exec_date in ("2024-11-09", "2024-11-10"):
+        assert backfill_ledger.get_run(STATE_MACHINE, exec_date)["status"] == STATUS_SUCCEEDED
+    assert complete.lambda_client.payloads == [{"Records": [{"s3": "delivery"}]}]
+    step_function = complete.dependent_pipelines.step_function
+    assert step_function.state_machines == [
+        "arn:aws:states:us-east-1:123456789012:stateMachine:sm-monthly-backfill"
+    ]
+    assert step_function.inputs == [
+        {"start_date": "2024-11-09", "end_date": "2024-11-10", "set_based": "false"}
+    ]
+
+    # duplicate event
+    complete = complete_backfill(backfill_ledger, STATUS_SUCCEEDED)
+    assert complete.lambda_client.payloads == []
+    assert complete.dependent_pipelines.step_function.inputs == []
+
+
+def test_failed_backfill_releases_dates_without_dependents(backfill_ledger, monkeypatch):
+    monkeypatch.setenv("AWS_DEFAULT_REGION", "us-east-1")
+    assert backfill_ledger.get_run(STATE_MACHINE, "2024-11-09")["status"] == STATUS_BACKFILL
+
+    complete = complete_backfill(backfill_ledger, "TIMED_OUT")
+
+    assert backfill_ledger.get_run(STATE_MACHINE, "2024-11-09")["status"] == "TIMED_OUT"
+    assert len(complete.lambda_client.payloads) == 1
+    assert complete.dependent_pipelines.step_function.inputs == []
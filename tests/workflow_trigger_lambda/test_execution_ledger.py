@@ -0,0 +1,177 @@
+import pytest
+
+from common.execution_ledger import (
+    ACTIVE_SORT_KEY,
+    DECISION_DUPLICATE,
+    DECISION_QUEUED,
+    DECISION_START,
+    RUN_STARTED,
+    STATUS_ABANDONED,
+    STATUS_FAILED,
+    STATUS_QUEUED,
+    STATUS_RUNNING,
+    STATUS_SUCCEEDED,
+    LocalExecutionLedger,
+)
+
+STATE_MACHINE = "arn:aws:states:us-east-1:123456789012:stateMachine:sm-daily"
+
+
+@pytest.fixture
+def ledger():
+    return LocalExecutionLedger()
+
+
+def register(ledger, exec_date, event_token="event-1", fingerprint=""):
+    return ledger.register(
+        state_machine=STATE_MACHINE,
+        exec_date=exec_date,
+        payload={"date": exec_date},
+        event_token=event_token,
+        fingerprint=fingerprint,
+    )
+
+
+def get_status(ledger, exec_date):
+    return ledger.get_run(STATE_MACHINE, exec_date)["status"]
+
+
+def get_active_exec_date(ledger):
+    return ledger.get_item(STATE_MACHINE, ACTIVE_SORT_KEY).get("active_exec_date")
+
+
+def test_register_starts_queues_and_coalesces(ledger):
+    assert register(ledger, "2024-11-08") == DECISION_START
+    assert register(ledger, "2024-11-09") == DECISION_QUEUED
+    assert register(ledger, "2024-11-08", event_token="event-2") == DECISION_DUPLICATE
+    assert get_status(ledger, "2024-11-08") == STATUS_RUNNING
+    assert get_status(ledger, "2024-11-09") == STATUS_QUEUED
+    assert get_active_exec_date(ledger) == "2024-11-08"
+
+
+def test_complete_claims_oldest_queued(ledger):
+    register(ledger, "2024-11-08")
+    register(ledger, "2024-11-10")
+    register(ledger, "2024-11-09")
+
+    claimed = ledger.complete(STATE_MACHINE, "2024-11-08", STATUS_SUCCEEDED)
+
+    assert claimed["exec_date"] == "2024-11-09"
+    assert claimed["payload"] == {"date": "2024-11-09"}
+    assert get_status(ledger, "2024-11-08") == STATUS_SUCCEEDED
+    assert get_status(ledger, "2024-11-09") == STATUS_RUNNING
+    assert get_active_exec_date(ledger) == "2024-11-09"
+
+
+def test_complete_without_queue_frees_slot(ledger):
+    register(ledger, "2024-11-08")
+    assert ledger.complete(STATE_MACHINE, "2024-11-08", STATUS_SUCCEEDED) is None
+    assert get_active_exec_date(ledger) is None
+    assert register(ledger, "2024-11-09") == DECISION_START
+
+
+def test_complete_records_last_success(ledger):
+    register(ledger, "2024-11-08", fingerprint="abc")
+    ledger.complete(STATE_MACHINE, "2024-11-08", STATUS_SUCCEEDED)
+    last_success = ledger.get_last_success(STATE_MACHINE)
+    assert last_success["fingerprint"] == "abc"
+    assert last_success["source_exec_date"] == "2024-11-08"
+
+
+def test_complete_and_start_next_skips_runs_failing_to_start(ledger):
+    register(ledger, "2024-11-08")
+    register(ledger, "2024-11-09")
+    register(ledger, "2024-11-10")
+    started = []
+
+    def start_run(run):
+        if run["exec_date"] == "2024-11-09":
+            return {"exec_date": run["exec_date"], "status": STATUS_FAILED}
+        ledger.mark_started(STATE_MACHINE, run["exec_date"], execution_arn="arn:exec")
+        started.append(run["exec_date"])
+        return {"exec_date": run["exec_date"], "status": RUN_STARTED}
+
+    responses = ledger.complete_and_start_next(
+        STATE_MACHINE, "2024-11-08", STATUS_SUCCEEDED, start_run=start_run
+    )
+
+    assert [r["status"] for r in responses] == [STATUS_FAILED, RUN_STARTED]
+    assert started == ["2024-11-10"]
+    assert get_status(ledger, "2024-11-09") == STATUS_FAILED
+    assert get_status(ledger, "2024-11-10") == STATUS_RUNNING
+    assert get_active_exec_date(ledger) == "2024-11-10"
+
+
+def test_complete_and_start_next_frees_slot_when_nothing_starts(ledger):
+    register(ledger, "2024-11-08")
+    register(ledger, "2024-11-09")
+
+    responses = ledger.complete_and_start_next(
+        STATE_MACHINE,
+        "2024-11-08",
+        STATUS_FAILED,
+        start_run=lambda run: {"exec_date": run["exec_date"], "status": STATUS_FAILED},
+    )
+
+    assert [r["exec_date"] for r in responses] == ["2024-11-09"]
+    assert get_status(ledger, "2024-11-09") == STATUS_FAILED
+    assert get_active_exec_date(ledger) is None
+    assert register(ledger, "2024-11-10") == DECISION_START
+
+
+def test_expired_active_slot_is_reclaimed(ledger):
+    register(ledger, "2024-11-08")
+    # Trigger crashed between acquiring the slot and start_execution
+    ledger.items[(STATE_MACHINE, ACTIVE_SORT_KEY)]["lease_expires"] = "2000-01-01T00:00:00Z"
+
+    assert register(ledger, "2024-11-09") == DECISION_START
+    assert get_status(ledger, "2024-11-08") == STATUS_ABANDONED
+    assert get_active_exec_date(ledger) == "2024-11-09"
+    # The abandoned date can be registered again
+    assert register(ledger, "2024-11-08", event_token="event-2") == DECISION_QUEUED
+
+
+def test_started_run_extends_lease(ledger):
+    register(ledger, "2024-11-08")
+    start_lease = ledger.get_item(STATE_MACHINE, ACTIVE_SORT_KEY)["lease_expires"]
+    ledger.mark_started(STATE_MACHINE, "2024-11-08", execution_arn="arn:exec")
+    run_lease = ledger.get_item(STATE_MACHINE, ACTIVE_SORT_KEY)["lease_expires"]
+    assert run_lease > start_lease
+    assert register(ledger, "2024-11-09") == DECISION_QUEUED
+
+
+def test_dependent_failing_to_start_hands_slot_to_queue(ledger):
+    # Dependent registered while another date of its state machine was queued
+    register(ledger, "2024-11-07")
+    register(ledger, "2024-11-08")
+    ledger.complete(STATE_MACHINE, "2024-11-07", STATUS_SUCCEEDED)
+    register(ledger, "2024-11-09")
+
+    responses = ledger.complete_and_start_next(
+        STATE_MACHINE,
+        "2024-11-08",
+        STATUS_FAILED,
+        start_run=lambda run: {"exec_date": run["exec_date"], "status": RUN_STARTED},
+    )
+
+    assert responses == [{"exec_date": "2024-11-09", "status": RUN_STARTED}]
+    assert get_status(ledger, "2024-11-08") == STATUS_FAILED
+    assert get_active_exec_date(ledger) == "2024-11-09"
+
+
+def test_rerun_request_is_kept_for_completion(ledger):
+    register(ledger, "2024-11-08")
+    event = {"s3": {"object": {"key": "incoming/all_ef_files/2024-11-08/x.done"}}}
+
+    assert ledger.request_rerun(STATE_MACHINE, "2024-11-08", event) is True
+    ledger.complete(STATE_MACHINE, "2024-11-08", STATUS_SUCCEEDED)
+
+    assert ledger.get_rerun_event(STATE_MACHINE, "2024-11-08") == event
+    # The replayed delivery registers a new run for the date
+    assert register(ledger, "2024-11-08", event_token="event-2") == DECISION_START
+
+
+def test_rerun_request_after_completion_is_left_to_caller(ledger):
+    register(ledger, "2024-11-08")
+    ledger.complete(STATE_MACHINE, "2024-11-08", STATUS_SUCCEEDED)
+    assert ledger.request_rerun(STATE_MACHINE, "2024-11-08", {"s3": {}}) is False
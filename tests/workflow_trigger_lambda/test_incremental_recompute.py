@@ -0,0 +1,160 @@
+import io
+import json
+import logging
+from types import SimpleNamespace
+
+import pytest
+from botocore.exceptions import ClientError
+
+from common.execution_ledger import STATUS_RUNNING, STATUS_SUCCEEDED, LocalExecutionLedger
+from common.incremental_recompute import INCREMENTAL_TABLES_KEY, IncrementalRecompute
+from common.period_fingerprint import PERIOD_FINGERPRINTS_FILE_NAME
+from common.run_starter import QueuedRunStarter
+from execution_complete import CompleteExecution
+
+STATE_MACHINE = "arn:aws:states:us-east-1:123456789012:stateMachine:sm-daily"
+TABLES = [{"table_name": "utility_data_oh", "dest_bucket": "landing"}]
+CNF = SimpleNamespace(
+    LANDING_DB_NAME="landing_db_dev",
+    INCREMENTAL_MAX_CHANGED_PERIODS=62,
+    EXECUTION_LEDGER_BACKEND="local",
+    DATA_PIPELINE={},
+)
+
+
+class LandingSidecars(object):
+    """get_object over the period fingerprint sidecars of the landing bucket"""
+
+    def __init__(self):
+        self.objects = {}
+
+    def put(self, exec_date: str, fingerprints: dict):
+        key = f"landing_db_dev/utility_data_oh/exec_date={exec_date}/{PERIOD_FINGERPRINTS_FILE_NAME}"
+        self.objects[key] = json.dumps(fingerprints).encode()
+
+    def get_object(self, Bucket, Key):
+        if Key not in self.objects:
+            raise ClientError({"Error": {"Code": "NoSuchKey"}}, "GetObject")
+        return {"Body": io.BytesIO(self.objects[Key])}
+
+
+class StepFunctions(object):
+    """start_execution recording the inputs of the started runs"""
+
+    def __init__(self):
+        self.inputs = []
+
+    def start_execution(self, stateMachineArn, input):
+        self.inputs.append(json.loads(input))
+        return {"executionArn": f"{stateMachineArn}:exec-{len(self.inputs)}"}
+
+
+def period(digest: str) -> dict:
+    return {"num_rows": 24, "digest": digest}
+
+
+@pytest.fixture
+def ledger():
+    return LocalExecutionLedger()
+
+
+@pytest.fixture
+def incremental(ledger, monkeypatch):
+    monkeypatch.setenv("AWS_DEFAULT_REGION", "us-east-1")
+    incremental = IncrementalRecompute(cnf=CNF, ledger=ledger, log=logging.getLogger())
+    incremental.s3 = LandingSidecars()
+    return incremental
+
+
+def run_to_success(ledger, incremental, exec_date):
+    ledger.register(
+        state_machine=STATE_MACHINE,
+        exec_date=exec_date,
+        payload={},
+        event_token=f"event-{exec_date}",
+        fingerprint=f"fingerprint-{exec_date}",
+    )
+    params = apply(incremental, exec_date)
+    ledger.complete(STATE_MACHINE, exec_date, STATUS_SUCCEEDED)
+    return params
+
+
+def apply(incremental, exec_date):
+    step_payload = {INCREMENTAL_TABLES_KEY: TABLES, "glue_runtime_sql_params": "{}"}
+    incremental.apply(STATE_MACHINE, exec_date, step_payload)
+    return json.loads(step_payload["glue_runtime_sql_params"])
+
+
+def test_changed_periods_against_last_success(ledger, incremental):
+    incremental.s3.put("2024-11-07", {"2024-11-01": period("a"), "2024-11-02": period("b")})
+    incremental.s3.put("2024-11-08", {"2024-11-01": period("a"), "2024-11-02": period("c")})
+    assert run_to_success(ledger, incremental, "2024-11-07") == {}
+
+    assert run_to_success(ledger, incremental, "2024-11-08") == {
+        "param_incremental_source_exec_date": "2024-11-07",
+        "param_changed_periods": "2024-11-02",
+    }
+
+
+def test_source_changed_since_its_run_recomputes_in_full(ledger, incremental):
+    incremental.s3.put("2024-11-07", {"2024-11-01": period("a")})
+    incremental.s3.put("2024-11-08", {"2024-11-01": period("a")})
+    run_to_success(ledger, incremental, "2024-11-07")
+    # re-ingested after its run, its outputs no longer match its landing
+    incremental.s3.put("2024-11-07", {"2024-11-01": period("x")})
+
+    assert run_to_success(ledger, incremental, "2024-11-08") == {}
+
+
+def test_purged_source_recomputes_in_full(ledger, incremental):
+    incremental.s3.put("2024-11-07", {"2024-11-01": period("a")})
+    incremental.s3.put("2024-11-08", {"2024-11-01": period("a")})
+    run_to_success(ledger, incremental, "2024-11-07")
+    incremental.s3.objects.clear()
+    incremental.s3.put("2024-11-08", {"2024-11-01": period("a")})
+
+    assert run_to_success(ledger, incremental, "2024-11-08") == {}
+
+
+def test_payload_without_tables_is_left_as_is(incremental):
+    step_payload = {"glue_runtime_sql_params": '{"param_execution_date": "2024-11-08"}'}
+    incremental.apply(STATE_MACHINE, "2024-11-08", step_payload)
+    assert step_payload == {"glue_runtime_sql_params": '{"param_execution_date": "2024-11-08"}'}
+
+
+def test_queued_run_started_by_execution_complete(ledger, incremental):
+    incremental.s3.put("2024-11-07", {"2024-11-01": period("a"), "2024-11-02": period("b")})
+    incremental.s3.put("2024-11-08", {"2024-11-01": period("a"), "2024-11-02": period("c")})
+    ledger.register(STATE_MACHINE, "2024-11-07", payload={}, fingerprint="fingerprint-1")
+    apply(incremental, "2024-11-07")
+    ledger.mark_started(STATE_MACHINE, "2024-11-07", execution_arn=f"{STATE_MACHINE}:exec-0")
+    queued_payload = {
+        "date": "2024-11-08",
+        INCREMENTAL_TABLES_KEY: TABLES,
+        "glue_runtime_sql_params": "{}",
+    }
+    ledger.register(STATE_MACHINE, "2024-11-08", payload=queued_payload)
+
+    event = {
+        "detail": {
+            "stateMachineArn": STATE_MACHINE,
+            "executionArn": f"{STATE_MACHINE}:exec-0",
+            "status": STATUS_SUCCEEDED,
+            "input": json.dumps({"date": "2024-11-07"}),
+        }
+    }
+    complete = CompleteExecution(event=event, context={}, cnf=CNF)
+    complete.ledger = ledger
+    complete.run_starter = QueuedRunStarter(
+        ledger=ledger, log=complete.log, incremental_recompute=incremental
+    )
+    complete.run_starter.step_function = StepFunctions()
+    complete.execute()
+
+    started = complete.run_starter.step_function.inputs
+    assert [step_payload["date"] for step_payload in started] == ["2024-11-08"]
+    assert json.loads(started[0]["glue_runtime_sql_params"]) == {
+        "param_incremental_source_exec_date": "2024-11-07",
+        "param_changed_periods": "2024-11-02",
+    }
+    assert ledger.get_run(STATE_MACHINE, "2024-11-08")["status"] == STATUS_RUNNING
@@ -0,0 +1,109 @@
+import json
+from types import SimpleNamespace
+
+import pytest
+
+from common.key_index import KEY_INDEX_FILE_NAME, find_candidates, get_path_predicate, in_range
+from common.period_fingerprint import PERIOD_FINGERPRINTS_FILE_NAME
+from workflow_trigger import TriggerStateMachine
+
+PARTITION = "landing_db_dev/utility_data_oh/exec_date=2024-11-08"
+KEY_INDEX = {
+    "key_columns": ["plant_id_eia", "emissions_unit_id_epa", "operating_datetime_utc"],
+    "files": [
+        {
+            "path": f"s3://landing/{PARTITION}/part-0.parquet",
+            "row_groups": [
+                {
+                    "row_group": 0,
+                    "plant_id_eia": [3, 2828],
+                    "emissions_unit_id_epa": ["1", "9"],
+                    "operating_datetime_utc": ["2024-11-01 00:00:00", "2024-11-07 23:00:00"],
+                },
+                {
+                    "row_group": 1,
+                    "plant_id_eia": [2828, 6000],
+                    "emissions_unit_id_epa": ["1", "4"],
+                    "operating_datetime_utc": ["2024-11-01 00:00:00", "2024-11-07 23:00:00"],
+                },
+            ],
+        },
+        {
+            "path": f"s3://landing/{PARTITION}/part-1.parquet",
+            # no statistics for the unit column, it never prunes
+            "row_groups": [{"row_group": 0, "plant_id_eia": [6001, 9000]}],
+        },
+    ],
+}
+
+
+def test_in_range_compares_as_the_statistics_type():
+    # CLI values are strings, "10" < "9" as strings but not as plant ids
+    assert in_range([9, 2828], "10")
+    assert not in_range([9, 2828], "3000")
+    assert in_range(["1", "9"], 1)
+    assert not in_range(["1", "4"], "9a")
+    assert in_range([1.5, 2.5], "2.5")
+
+
+def test_find_candidates_keeps_row_groups_matching_every_filter():
+    candidates = find_candidates(KEY_INDEX, {"plant_id_eia": "2828", "emissions_unit_id_epa": "5"})
+
+    assert candidates == [{"path": f"s3://landing/{PARTITION}/part-0.parquet", "row_groups": [0]}]
+    assert get_path_predicate(candidates) == (
+        f"\"$path\" IN ('s3://landing/{PARTITION}/part-0.parquet')"
+    )
+
+
+def test_find_candidates_does_not_prune_on_missing_statistics():
+    candidates = find_candidates(KEY_INDEX, {"plant_id_eia": "7000", "emissions_unit_id_epa": "99"})
+
+    assert candidates == [{"path": f"s3://landing/{PARTITION}/part-1.parquet", "row_groups": [0]}]
+    assert get_path_predicate(find_candidates(KEY_INDEX, {"plant_id_eia": "1"})) == "false"
+
+
+class Sidecars(object):
+    def __init__(self):
+        self.keys = []
+
+    def put_object(self, Bucket, Key, Body, ContentType):
+        json.loads(Body)
+        self.keys.append(Key)
+
+
+@pytest.mark.parametrize(
+    "key_index_enabled, written",
+    [
+        (True, [KEY_INDEX_FILE_NAME, PERIOD_FINGERPRINTS_FILE_NAME]),
+        (False, [PERIOD_FINGERPRINTS_FILE_NAME]),
+    ],
+)
+def test_key_index_written_in_the_key_order_only(monkeypatch, key_index_enabled, written):
+    monkeypatch.setenv("AWS_DEFAULT_REGION", "us-east-1")
+    cnf = SimpleNamespace(
+        EXECUTION_LEDGER_BACKEND="local",
+        S3_GLUE_BUCKET_NAME="glue-assets",
+        LAYOUT_REWRITE_ENABLED=True,
+        LAYOUT_KEY_INDEX_ENABLED=key_index_enabled,
+        LAYOUT_SORT_COLUMNS=KEY_INDEX["key_columns"],
+    )
+    trigger = TriggerStateMachine(event={}, context=None, cnf=cnf)
+    trigger.s3 = Sidecars()
+
+    trigger.write_partition_sidecars(
+        copy_matrix=[
+            {
+                "src_file_path": "incoming/2024-11-08/utility_data_oh.parquet",
+                "dest_bucket": "landing",
+                "dest_file_path": f"{PARTITION}/utility_data_oh.parquet",
+            }
+        ],
+        copied=[
+            {
+                "files": KEY_INDEX["files"][:1],
+                "period_fingerprints": {"2024-11-07": {"num_rows": 24, "digest": "a"}},
+            }
+        ],
+    )
+
+    assert trigger.s3.keys == [f"{PARTITION}/{name}" for name in written]